@@ -0,0 +1,106 @@
+"""Lookup latency of the duplicate-invoice index at scale.
+
+Fills a temporary index with N synthetic invoices (random MinHash and
+dHash signatures) and times `match()` for unseen documents and for
+near-duplicates of indexed ones, plus `find_invoice()`.
+
+Usage:
+    uv run python benchmarks/bench_dedup.py [--entries 1000000] [--lookups 2000]
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from invoice_intake_agent.pipeline.dedup import (  # noqa: E402
+    NUM_PERM,
+    DedupIndex,
+    Fingerprint,
+)
+
+
+def _random_fp(rng: random.Random, i: int) -> Fingerprint:
+    return Fingerprint(
+        sha256=f"{i:064x}",
+        dhash=rng.getrandbits(64),
+        minhash=tuple(rng.getrandbits(32) for _ in range(NUM_PERM)),
+        numbers=f"{i:032x}",
+    )
+
+
+def _near(rng: random.Random, fp: Fingerprint) -> Fingerprint:
+    """Same invoice, re-rendered: ~5% of MinHash values and 2 dHash bits differ."""
+    minhash = list(fp.minhash)
+    for j in rng.sample(range(NUM_PERM), NUM_PERM // 20):
+        minhash[j] = rng.getrandbits(32)
+    return Fingerprint(
+        sha256="f" * 64,
+        dhash=fp.dhash ^ (1 << 3) ^ (1 << 40),
+        minhash=tuple(minhash),
+        numbers=fp.numbers,
+    )
+
+
+def _time(fn, items) -> list[float]:
+    samples = []
+    for item in items:
+        t0 = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def _report(label: str, samples: list[float]) -> None:
+    samples = sorted(samples)
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    print(
+        f"  {label:<28} median {statistics.median(samples) * 1e6:7.1f} us"
+        f"   p99 {p99 * 1e6:7.1f} us"
+    )
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--entries", type=int, default=1_000_000)
+    p.add_argument("--lookups", type=int, default=2000)
+    args = p.parse_args()
+
+    rng = random.Random(0)
+    with (
+        tempfile.TemporaryDirectory() as tmp,
+        DedupIndex(Path(tmp) / "dedup.sqlite3") as index,
+    ):
+        t0 = time.perf_counter()
+        indexed = []
+        for i in range(args.entries):
+            fp = _random_fp(rng, i)
+            index.add(
+                fp, job_id=f"job-{i}", vendor_name="Vendor", invoice_number=str(i)
+            )
+            if i % max(1, args.entries // args.lookups) == 0:
+                indexed.append(fp)
+        print(f"Indexed {args.entries} invoices in {time.perf_counter() - t0:.1f}s")
+
+        unseen = [_random_fp(rng, args.entries + i) for i in range(args.lookups)]
+        near = [_near(rng, fp) for fp in indexed]
+        hits = sum(index.match(fp) is not None for fp in near)
+
+        print(f"Lookups ({args.lookups} each):")
+        _report("match() unseen document", _time(index.match, unseen))
+        _report("match() exact duplicate", _time(index.match, indexed))
+        _report("match() near duplicate", _time(index.match, near))
+        _report(
+            "find_invoice()",
+            _time(lambda i: index.find_invoice("Vendor", str(i)), range(args.lookups)),
+        )
+        print(f"Near duplicates found: {hits}/{len(near)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Startup benchmark for the invoice-intake-agent CLI.
+
+Measures wall-clock time of `invoice-intake-agent --help` (the fixed cost
+paid by every per-job CLI start) and breaks down module import time with
+`python -X importtime`.
+
+Usage:
+    uv run python benchmarks/bench_startup.py [--runs 10] [--top 15]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+
+
+def _env() -> dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(SRC), env.get("PYTHONPATH")]))
+    return env
+
+
+def time_command(args: list[str], runs: int) -> list[float]:
+    """Wall-clock seconds of `runs` executions of `python <args>`."""
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *args],
+            env=_env(),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=False,
+        )
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def import_breakdown(module: str) -> list[tuple[int, int, str]]:
+    """(self_us, cumulative_us, name) for every module imported by `module`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return rows
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--runs", type=int, default=10)
+    p.add_argument("--top", type=int, default=15)
+    args = p.parse_args()
+
+    cases = {
+        "python -c pass (interpreter baseline)": ["-c", "pass"],
+        "invoice-intake-agent --help": ["-m", "invoice_intake_agent.cli", "--help"],
+        "import invoice_intake_agent.app (model path)": [
+            "-c",
+            "import invoice_intake_agent.app",
+        ],
+    }
+    print(f"Wall time over {args.runs} runs (median / min):")
+    for label, cmd in cases.items():
+        samples = time_command(cmd, args.runs)
+        print(
+            f"  {label:<48} {statistics.median(samples) * 1000:8.1f} ms"
+            f" / {min(samples) * 1000:8.1f} ms"
+        )
+
+    for module in ("invoice_intake_agent.cli", "invoice_intake_agent.app"):
+        rows = import_breakdown(module)
+        total = sum(self_us for self_us, _, _ in rows)
+
+        # Aggregate self time by top-level package (agents, openai, rich, ...).
+        by_package: dict[str, int] = {}
+        for self_us, _, name in rows:
+            package = name.strip().split(".")[0]
+            by_package[package] = by_package.get(package, 0) + self_us
+
+        print(f"\nImport time for {module}: {total / 1000:.1f} ms total")
+        ranked = sorted(by_package.items(), key=lambda kv: -kv[1])[: args.top]
+        for package, self_us in ranked:
+            print(f"  {self_us / 1000:8.1f} ms  {package}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 """Guardrails for the invoice intake agent."""
 
+import time
+from functools import lru_cache
+
 from agents import InputGuardrail, Agent, Runner, GuardrailFunctionOutput
 from pydantic import BaseModel
 
 from ..config import MODEL
+from ..utils.metrics import GUARDRAIL_CHECKS
+from ..utils.ratelimit import Permit, estimate_input_tokens, get_model_limiter
+from ..utils.usage import record_usage
 
 
 class GuardrailOutput(BaseModel):
@@ -13,9 +19,10 @@ class GuardrailOutput(BaseModel):
     reasoning: str
 
 
-async def invoice_intake_guardrail(ctx, agent, input_data):
-    """Guardrail for the invoice intake agent."""
-    guardrail_agent = Agent(
+@lru_cache(maxsize=1)
+def build_guardrail_agent() -> Agent:
+    """Build the guardrail agent (once; static prompt for prefix caching)."""
+    return Agent(
         name="Guardrail check",
         instructions=(
             "Check if the input is asking about inappropiate content."
@@ -24,8 +31,29 @@ async def invoice_intake_guardrail(ctx, agent, input_data):
         output_type=GuardrailOutput,
         model=str(MODEL),
     )
-    result = await Runner.run(guardrail_agent, input_data, context=ctx.context)
+
+
+async def invoice_intake_guardrail(ctx, agent, input_data):
+    """Guardrail for the invoice intake agent."""
+    guardrail_agent = build_guardrail_agent()
+
+    async def _run_once(permit: Permit):
+        t0 = time.monotonic()
+        result = await Runner.run(guardrail_agent, input_data, context=ctx.context)
+        usage = result.context_wrapper.usage
+        record_usage(guardrail_agent.name, usage, time.monotonic() - t0)
+        permit.actual_tokens = usage.total_tokens
+        return result
+
+    # Runs alongside the guarded agent's own call, so skip the concurrency
+    # slot (it could otherwise wait on the call it is guarding).
+    result = await get_model_limiter().call(
+        _run_once,
+        estimated_tokens=estimate_input_tokens(input_data, output=100),
+        concurrency=False,
+    )
     final_output = result.final_output_as(GuardrailOutput)
+    GUARDRAIL_CHECKS.labels("passed" if final_output.is_safe else "tripped").inc()
     return GuardrailFunctionOutput(
         output_info=final_output,
         tripwire_triggered=not final_output.is_safe,
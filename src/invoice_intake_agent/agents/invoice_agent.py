@@ -1,18 +1,27 @@
 """Agent for extracting information from invoice images."""
 
 import base64
+import hashlib
+import json
+import time
 
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional
 
-from agents import Agent, Runner, InputGuardrail
+from agents import Agent, Runner, InputGuardrail, ModelSettings
 from openai.types.responses import ResponseTextDeltaEvent
 
 from ..config import MODEL
 from ..schema.invoice import Invoice
 from .guardrails import invoice_intake_guardrail
 
+from ..utils.hedge import get_hedger
+from ..utils.metrics import IMAGE_PAYLOAD_BYTES, INVOICE_TOKENS, MODEL_TTFT_SECONDS
+from ..utils.partial_json import PartialObjectParser
+from ..utils.ratelimit import Permit, estimate_tokens, get_model_limiter
 from ..utils.runtime import RUNTIME
+from ..utils.usage import record_usage
 from ..utils import console as c
 
 
@@ -45,89 +54,241 @@ def _safe_get(d: dict[str, Any], keys: list[str]) -> Any:
     return x
 
 
-async def run_invoice_agent(
-    *,
-    email: dict[str, Any],
-    pdf_text: str,
-    pdf_images: List[str],
-) -> Invoice:
-    """Single-shot: fill Invoice schema  (email + pdf text + images)"""
+# --- Static prompt -----------------------------------------------------------
+#
+# Everything below is identical on every call and is sent first (agent
+# instructions, then the first user text part), so the provider can serve it
+# from its prompt cache. Per-invoice content is appended after it. Keep these
+# strings deterministic: any change to them invalidates the cached prefix.
 
-    # TODO: bound text size for cost control
+_RULES = (
+    "You extract invoice fields and return ONLY a JSON object matching "
+    "the Invoice schema.\n"
+    "Rules:\n"
+    "- invoice_number is REQUIRED. It may only appear in the image(s); "
+    "read the images carefully.\n"
+    "- If a field is not present, set it to null / empty list "
+    "as appropriate.\n"
+    "- Prefer exact strings/numbers as printed on the invoice.\n"
+    "- Dates: prefer YYYY-MM-DD if clearly implied, "
+    "otherwise preserve the original date string.\n"
+    "- Currency: prefer ISO 4217 codes like CAD, USD when visible.\n"
+    "- Line items: include at least "
+    "sku/description/quantity/unit_price/line_total when present.\n"
+    "- Do not include extra keys.\n"
+    "- Generate a human-readable summary of the invoice, to be used "
+    "in the outbound email. This should be a bulleted list of the "
+    "most important information from the invoice.\n"
+)
 
-    instructions = (
-        "You extract invoice fields and return ONLY a JSON object matching "
-        "the Invoice schema.\n"
-        "Rules:\n"
-        "- invoice_number is REQUIRED. It may only appear in the image(s); "
-        "read the images carefully.\n"
-        "- If a field is not present, set it to null / empty list "
-        "as appropriate.\n"
-        "- Prefer exact strings/numbers as printed on the invoice.\n"
-        "- Dates: prefer YYYY-MM-DD if clearly implied, "
-        "otherwise preserve the original date string.\n"
-        "- Currency: prefer ISO 4217 codes like CAD, USD when visible.\n"
-        "- Line items: include at least "
-        "sku/description/quantity/unit_price/line_total when present.\n"
-        "- Do not include extra keys.\n"
-        "- Generate a human-readable summary of the invoice, to be used "
-        "in the outbound email. This should be a bulleted list of the "
-        "most important information from the invoice.\n"
-    )
+_EXAMPLE_INPUT = (
+    "Email Subject: Invoice for March supplies\n"
+    "Email Body: Please process the attached invoice against PO 7781.\n"
+    "PDF Text: ACME OFFICE SUPPLY LTD. Invoice Date: March 3, 2025 "
+    "Terms: Net 15 Bill To: Example Corp, 100 King St W, Toronto ON "
+    "SKU PEN-12 Blue pens (box of 12) Qty 10 @ 8.50 = 85.00 "
+    "SKU PAD-50 Notepads Qty 4 @ 3.75 = 15.00 "
+    "Subtotal 100.00 HST (13%) 13.00 Total Due CAD 113.00\n"
+    "[image: page 1 header reads 'INVOICE # AOS-20931']"
+)
 
-    invoice_agent = Agent(
-        name="Invoice Specialist",
-        instructions=instructions,
-        model=str(MODEL),
-        output_type=Invoice,
-        input_guardrails=[InputGuardrail(invoice_intake_guardrail)],
-    )
+_EXAMPLE_OUTPUT = Invoice(
+    vendor_name="Acme Office Supply Ltd.",
+    invoice_number="AOS-20931",
+    invoice_date="2025-03-03",
+    invoice_due_date="2025-03-18",
+    payment_terms="Net 15",
+    currency="CAD",
+    customer_po_number="7781",
+    total_due=113.0,
+    subtotal=100.0,
+    taxes=13.0,
+    taxes_breakdown=["HST (13%): 13.00"],
+    line_items=[
+        {
+            "sku": "PEN-12",
+            "description": "Blue pens (box of 12)",
+            "quantity": 10,
+            "unit_price": 8.5,
+            "line_total": 85.0,
+        },
+        {
+            "sku": "PAD-50",
+            "description": "Notepads",
+            "quantity": 4,
+            "unit_price": 3.75,
+            "line_total": 15.0,
+        },
+    ],
+    ship_to_locations=["Example Corp, 100 King St W, Toronto ON"],
+    notes=[],
+    summary=(
+        "- Vendor: Acme Office Supply Ltd.\n"
+        "- Invoice AOS-20931 dated 2025-03-03, due 2025-03-18 (Net 15)\n"
+        "- PO 7781\n"
+        "- Total due: CAD 113.00 (incl. 13.00 HST)"
+    ),
+)
+
+INSTRUCTIONS = (
+    _RULES
+    + "\nInvoice JSON schema:\n"
+    + json.dumps(Invoice.model_json_schema(), sort_keys=True, separators=(",", ":"))
+    + "\n\nExample input:\n"
+    + _EXAMPLE_INPUT
+    + "\n\nExample output:\n"
+    + _EXAMPLE_OUTPUT.model_dump_json()
+    + "\n"
+)
+
+# Lead-in for the user message; static, so it extends the cached prefix.
+_TASK = "Extract the invoice data into the invoice schema."
+
+# Routes requests with this prefix to the same cache; changes with the prompt.
+PROMPT_CACHE_KEY = (
+    "invoice-specialist-" + hashlib.sha256(INSTRUCTIONS.encode()).hexdigest()[:12]
+)
+
+
+# Structured outputs emit fields in schema order, so once any of these has
+# started the model has moved past `invoice_number`.
+_FIELDS = list(Invoice.model_fields)
+_AFTER_INVOICE_NUMBER = frozenset(_FIELDS[_FIELDS.index("invoice_number") + 1 :])
+
+# Extra immediate attempts after a stream is cut short for lacking the number.
+EARLY_ABORT_RETRIES = 1
+
+
+class _InvoiceNumberMissing(Exception):
+    """The streamed output moved past `invoice_number` without a value."""
+
+
+def _invoice_number_state(parser: PartialObjectParser) -> Optional[bool]:
+    """True once a non-blank invoice number streamed, False once it cannot."""
+    if "invoice_number" in parser.fields:
+        number = parser.fields["invoice_number"]
+        return isinstance(number, str) and bool(number.strip())
+    if parser.done or _AFTER_INVOICE_NUMBER.intersection(parser.keys):
+        return False
+    return None
+
+
+def build_invoice_content(
+    email: dict[str, Any], pdf_text: str, pdf_images: List[str]
+) -> List[Dict[str, Any]]:
+    """User message content for one invoice (email + pdf text + images)."""
+
+    # TODO: bound text size for cost control
 
     subject = _safe_get(email, ["Subject"]) or ""
     body = _safe_get(email, ["Body", "Content"]) or ""
 
-    # Construct the content for the agent to process (text + images)
+    # Construct the content for the agent to process: the static task first,
+    # then the per-invoice text and images.
     content: List[Dict[str, Any]] = [
+        {"type": "input_text", "text": _TASK},
         {
             "type": "input_text",
             "text": (
-                "Extract the invoice data into the invoice schema. \n\n"
                 f"Email Subject: {subject}\n"
                 f"Email Body: {body}\n"
                 f"PDF Text: {pdf_text}\n"
             ),
-        }
+        },
     ]
 
     # Add the images to the content
+    image_bytes = 0
     for image_path in pdf_images:
-        content.append(
-            {
-                "type": "input_image",
-                "image_url": _image_to_data_url(image_path),
-            }
-        )
+        data_url = _image_to_data_url(image_path)
+        image_bytes += len(data_url)
+        content.append({"type": "input_image", "image_url": data_url})
+    IMAGE_PAYLOAD_BYTES.observe(image_bytes)
+    return content
 
-    messages = [{"role": "user", "content": content}]
 
-    result = Runner.run_streamed(
-        invoice_agent,
-        messages,
-        max_turns=1,
+@lru_cache(maxsize=1)
+def build_invoice_agent() -> Agent:
+    """Build the Invoice Specialist (once; its prompt never changes)."""
+
+    return Agent(
+        name="Invoice Specialist",
+        instructions=INSTRUCTIONS,
+        model=str(MODEL),
+        model_settings=ModelSettings(
+            extra_args={"prompt_cache_key": PROMPT_CACHE_KEY},
+        ),
+        output_type=Invoice,
+        input_guardrails=[InputGuardrail(invoice_intake_guardrail)],
     )
 
-    spinner_cm = None
-    if RUNTIME.verbose:
-        spinner_cm = c.status(
-            "[green]Invoice Specialist analyzing email + PDF text + PDF images..."
+
+async def run_invoice_agent(
+    *,
+    email: dict[str, Any],
+    pdf_text: str,
+    pdf_images: List[str],
+    on_invoice_number: Callable[[Dict[str, Any]], None] | None = None,
+) -> Invoice:
+    """Single-shot: fill Invoice schema  (email + pdf text + images)
+
+    The streamed output is parsed as it arrives. `on_invoice_number` is
+    called once, with the fields decoded so far, as soon as the invoice
+    number is known. A stream that moves past the field without a value is
+    cancelled and retried immediately instead of running to completion.
+    """
+
+    invoice_agent = build_invoice_agent()
+    content = build_invoice_content(email, pdf_text, pdf_images)
+    messages = [{"role": "user", "content": content}]
+
+    async def _run_once(
+        permit: Permit,
+        on_first_token: Callable[[], None] | None = None,
+        echo: bool = True,
+    ) -> Invoice:
+        t0 = time.monotonic()
+        result = Runner.run_streamed(
+            invoice_agent,
+            messages,
+            max_turns=1,
         )
-        spinner_cm.__enter__()
 
+        echo = echo and RUNTIME.verbose
+        spinner_cm = None
+        if echo:
+            spinner_cm = c.status(
+                "[green]Invoice Specialist analyzing email + PDF text + PDF images..."
+            )
+            spinner_cm.__enter__()
+
+        ttft = MODEL_TTFT_SECONDS.labels(invoice_agent.name)
+        first_token = True
+        parser = PartialObjectParser()
+        number_known: Optional[bool] = None
         at_line_start = True
-        async for event in result.stream_events():
-            if event.type == "raw_response_event" and isinstance(
-                event.data, ResponseTextDeltaEvent
-            ):
+        try:
+            async for event in result.stream_events():
+                if not (
+                    event.type == "raw_response_event"
+                    and isinstance(event.data, ResponseTextDeltaEvent)
+                ):
+                    continue
+                if first_token:
+                    ttft.observe(time.monotonic() - t0)
+                    first_token = False
+                if on_first_token is not None:
+                    on_first_token()
+                if number_known is None:
+                    parser.feed(event.data.delta)
+                    number_known = _invoice_number_state(parser)
+                    if number_known is False:
+                        raise _InvoiceNumberMissing()
+                    if number_known:
+                        _notify_invoice_number(parser.fields)
+                if not echo:
+                    # Minimal mode: just drain the stream.
+                    continue
                 for ch in event.data.delta:
                     if spinner_cm is not None:
                         spinner_cm.__exit__(None, None, None)
@@ -138,25 +299,71 @@ async def run_invoice_agent(
                     c.print(ch, style="dim", end="")
                     if ch == "\n":
                         at_line_start = True
-        if spinner_cm is not None:
-            spinner_cm.__exit__(None, None, None)
-            spinner_cm = None
-        if not at_line_start:
+        finally:
+            if spinner_cm is not None:
+                spinner_cm.__exit__(None, None, None)
+                spinner_cm = None
+            # Stop the background run if we were cancelled (e.g. lost a hedge).
+            if not result.is_complete:
+                result.cancel()
+        if echo and not at_line_start:
             c.print("\n")
-    else:
-        # Minimal mode: just stream raw deltas.
-        async for _ in result.stream_events():
-            pass
-        if spinner_cm is not None:
-            spinner_cm.__exit__(None, None, None)
-            spinner_cm = None
 
-    invoice: Invoice = result.final_output
+        usage = result.context_wrapper.usage
+        record_usage(invoice_agent.name, usage, time.monotonic() - t0)
+        INVOICE_TOKENS.labels("input").observe(usage.input_tokens)
+        INVOICE_TOKENS.labels("output").observe(usage.output_tokens)
+        permit.actual_tokens = usage.total_tokens
+        return result.final_output
+
+    notified = False
+
+    def _notify_invoice_number(fields: Dict[str, Any]) -> None:
+        # Once per invoice, even with hedged or retried attempts.
+        nonlocal notified
+        if on_invoice_number is not None and not notified:
+            notified = True
+            on_invoice_number(dict(fields))
+
+    limiter = get_model_limiter()
+    estimated = estimate_tokens(
+        INSTRUCTIONS + _TASK + content[1]["text"], images=len(pdf_images)
+    )
+
+    async def _attempt(
+        on_start: Callable[[], None], on_first_token: Callable[[], None], primary: bool
+    ) -> Invoice:
+        # Rate-limited, with retries on 429/5xx (the whole run is retried).
+        # Only the primary attempt echoes to the console.
+        async def admitted(permit: Permit) -> Invoice:
+            on_start()
+            return await _run_once(permit, on_first_token, echo=primary)
+
+        return await limiter.call(admitted, estimated_tokens=estimated)
+
+    invoice: Optional[Invoice] = None
+    for _ in range(1 + EARLY_ABORT_RETRIES):
+        try:
+            if RUNTIME.hedge_percentile is not None:
+                hedger = get_hedger(RUNTIME.hedge_percentile)
+                invoice = await hedger.run(_attempt, saturated=limiter.saturated)
+            else:
+                invoice = await _attempt(lambda: None, lambda: None, True)
+            break
+        except _InvoiceNumberMissing:
+            if RUNTIME.verbose:
+                c.error(
+                    "INVOICE_AGENT output skipped the invoice number; stream cut short."
+                )
 
     # TODO: supplement missing OPTIONAL fields from text/email by regex
 
     # Enforce Required Fields
-    if not invoice.invoice_number or not invoice.invoice_number.strip():
+    if (
+        invoice is None
+        or not invoice.invoice_number
+        or not invoice.invoice_number.strip()
+    ):
         if RUNTIME.verbose:
             c.error("INVOICE_AGENT failed to extract invoice number.")
             c.rule("Invoice Specialist Error")
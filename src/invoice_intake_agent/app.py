@@ -1,11 +1,16 @@
 """Application for the invoice intake agent."""
 
 import sys
+import time
 
 from agents import Runner, InputGuardrailTripwireTriggered
 from openai.types.responses import ResponseTextDeltaEvent
 
+from .config import load_settings
+from .utils.hedge import hedge_stats
+from .utils.ratelimit import Permit, estimate_tokens, get_model_limiter
 from .utils.runtime import RUNTIME
+from .utils.usage import USAGE, record_usage
 from .utils import console as c
 from .agents.orchestrator import build_orchestrator_agent
 
@@ -13,6 +18,8 @@ from .agents.orchestrator import build_orchestrator_agent
 async def run_app() -> None:
     """Run the invoice intake orchestration agent with streaming output."""
 
+    load_settings()
+
     c.print("-> Assembling orchestrator agent...\n", style="dim")
 
     orchestrator_agent = build_orchestrator_agent()
@@ -24,55 +31,82 @@ async def run_app() -> None:
         c.print("\n")
         c.rule("Orchestrator Agent", style="orch")
 
-        # Startup spinner for any cold-start issues
-        spinner_cm = c.status("[blue]Starting orchestrator agent...")
-        spinner_cm.__enter__()
-
-        result = Runner.run_streamed(orchestrator_agent, user_input, max_turns=6)
-
-        # Verbose: stream token-by-token but only print the prefix at the start of each line.
-        at_line_start = True
-
-        async for event in result.stream_events():
-            if event.type == "raw_response_event" and isinstance(
-                event.data, ResponseTextDeltaEvent
-            ):
-                delta = event.data.delta
-
-                # Stop the spinner as soon as we get any response
+        async def _run_once(permit: Permit) -> None:
+            # Startup spinner for any cold-start issues
+            spinner_cm = c.status("[blue]Starting orchestrator agent...")
+            spinner_cm.__enter__()
+
+            t0 = time.monotonic()
+            try:
+                result = Runner.run_streamed(
+                    orchestrator_agent, user_input, max_turns=6
+                )
+
+                # Verbose: stream token-by-token but only print the prefix at
+                # the start of each line.
+                at_line_start = True
+
+                async for event in result.stream_events():
+                    if event.type == "raw_response_event" and isinstance(
+                        event.data, ResponseTextDeltaEvent
+                    ):
+                        delta = event.data.delta
+
+                        # Stop the spinner as soon as we get any response
+                        if spinner_cm is not None:
+                            spinner_cm.__exit__(None, None, None)
+                            spinner_cm = None
+
+                        if not RUNTIME.verbose:
+                            # Minimal mode: just stream raw deltas.
+                            print(delta, end="", flush=True, file=sys.stderr)
+                            continue
+
+                        # Verbose mode: stream with a prefix per line.
+                        for ch in delta:
+                            if at_line_start:
+                                c.pre("ORCHESTRATOR", style="orch")
+                                at_line_start = False
+
+                            c.print(ch, end="")
+
+                            if ch == "\n":
+                                at_line_start = True
+            finally:
+                # Stop the spinner if it's still running
                 if spinner_cm is not None:
                     spinner_cm.__exit__(None, None, None)
                     spinner_cm = None
 
-                if not RUNTIME.verbose:
-                    # Minimal mode: just stream raw deltas.
-                    print(delta, end="", flush=True, file=sys.stderr)
-                    continue
-
-                # Verbose mode: stream with a prefix per line.
-                for ch in delta:
-                    if at_line_start:
-                        c.pre("ORCHESTRATOR", style="orch")
-                        at_line_start = False
-
-                    c.print(ch, end="")
-
-                    if ch == "\n":
-                        at_line_start = True
-
-        # Stop the spinner if it's still running
-        if spinner_cm is not None:
-            spinner_cm.__exit__(None, None, None)
-            spinner_cm = None
-
-        # Ensure we end with a newline in verbose mode
-        if RUNTIME.verbose and not at_line_start:
-            c.print("\n")
+            record_usage(
+                orchestrator_agent.name,
+                result.context_wrapper.usage,
+                time.monotonic() - t0,
+            )
+
+            # Ensure we end with a newline in verbose mode
+            if RUNTIME.verbose and not at_line_start:
+                c.print("\n")
+
+        # Rate-limited but not retried as a whole: a retry would run the tool
+        # chain again and notify twice. The model calls inside the tools
+        # retry on their own (the OpenAI client also retries each request).
+        # Nested tool calls take their own concurrency slots, so this call
+        # does not hold one.
+        async with get_model_limiter().slot(
+            estimate_tokens(user_input), concurrency=False
+        ) as permit:
+            await _run_once(permit)
 
     except InputGuardrailTripwireTriggered as e:
         c.emit("ERROR", f"Guardrail blocked this input: {e}", style="err")
 
     if RUNTIME.verbose:
+        hedging = hedge_stats()
+        if hedging is not None:
+            c.dim("HEDGE", str(hedging))
+        for name, usage in USAGE.items():
+            c.dim("USAGE", f"{name}: {usage}")
         c.rule("Orchestrator Agent Complete", style="orch")
         c.print("\n")
 
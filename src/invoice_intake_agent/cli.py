@@ -1,12 +1,24 @@
 """Command line interface for the invoice intake agent."""
 
 import argparse
-import asyncio
+import re
+import time
 
-from .app import run_app
+# Keep module-level imports light: the CLI is started once per job, and
+# `--help` / `--jobs-status` must not pay for the Agents SDK, openai, Rich or
+# the PDF backends. Those are imported in main() on the paths that use them.
 from .utils.runtime import set_runtime
 
 
+def parse_size(text: str) -> int:
+    """Parse a size such as `512M`, `2G` or `1.5GiB` into bytes."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(?:i?b)?\s*", text.lower())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"invalid size: {text!r}")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** "_kmgt".find(unit or "_"))
+
+
 def build_parser() -> argparse.ArgumentParser:
     """Build the argument parser."""
 
@@ -22,6 +34,12 @@ def build_parser() -> argparse.ArgumentParser:
         "  uv run invoice-intake-agent --verbose\n"
         "  uv run invoice-intake-agent --log-level debug\n"
         "  uv run invoice-intake-agent --no-color\n"
+        "  uv run invoice-intake-agent inputs/ --batch --concurrency 8\n"
+        "  uv run invoice-intake-agent inbox/ --watch\n"
+        "  uv run invoice-intake-agent inbox/ --bulk-submit\n"
+        "  uv run invoice-intake-agent --bulk-collect --bulk-wait\n"
+        "  uv run invoice-intake-agent --jobs-status\n"
+        "  uv run invoice-intake-agent --serve --port 8765\n"
     )
 
     p = argparse.ArgumentParser(
@@ -33,8 +51,9 @@ def build_parser() -> argparse.ArgumentParser:
 
     p.add_argument(
         "email",
+        nargs="?",
         help=(
-            "Path to the inbound email JSON file. "
+            "Path to the inbound email JSON file (or inbox directory with --batch). "
             "The PDF attachment must be in the same directory."
         ),
     )
@@ -56,14 +75,297 @@ def build_parser() -> argparse.ArgumentParser:
         action="store_true",
         help="Disable colorized/stylized console output.",
     )
+    p.add_argument(
+        "--hedge-percentile",
+        type=float,
+        default=None,
+        metavar="P",
+        help=(
+            "Hedge Invoice Specialist calls: if a call has no first token after "
+            "the P-th percentile (e.g. 0.95) of recent time-to-first-token, send "
+            "a duplicate and keep whichever finishes first. Off by default."
+        ),
+    )
+
+    p.add_argument(
+        "--outputs-dir",
+        default="outputs",
+        metavar="PATH",
+        help="Folder for outbound notification files (default: outputs).",
+    )
+    p.add_argument(
+        "--output-format",
+        choices=["json", "json-compact", "jsonl"],
+        default="json",
+        help=(
+            "Notification output: one indented JSON file per invoice (json), "
+            "one compact JSON file per invoice (json-compact), or lines appended "
+            "to outbound_emails.jsonl (jsonl). Default: json."
+        ),
+    )
+
+    artifacts = p.add_argument_group("artifacts and cleanup")
+    artifacts.add_argument(
+        "--artifacts-dir",
+        default="outputs/artifacts",
+        metavar="PATH",
+        help="Store for rendered PDF pages (default: outputs/artifacts).",
+    )
+    artifacts.add_argument(
+        "--artifacts-max-size",
+        type=parse_size,
+        default=2 * 1024**3,
+        metavar="SIZE",
+        help=(
+            "Evict least recently used page renders above this size, "
+            "e.g. 500M or 2G (default: 2G; 0 for no limit)."
+        ),
+    )
+    artifacts.add_argument(
+        "--artifacts-max-age",
+        type=float,
+        default=7.0,
+        metavar="DAYS",
+        help="Delete page renders unused for this long (default: 7; 0 to keep).",
+    )
+    artifacts.add_argument(
+        "--clean",
+        action="store_true",
+        help="Delete artifacts and notification outputs of prior runs.",
+    )
+    artifacts.add_argument(
+        "--clean-artifacts",
+        action="store_true",
+        help="Delete artifacts (page renders) of prior runs.",
+    )
+    artifacts.add_argument(
+        "--clean-outputs",
+        action="store_true",
+        help="Delete notification outputs of prior runs.",
+    )
+    artifacts.add_argument(
+        "-y",
+        "--yes",
+        action="store_true",
+        help="Do not ask for confirmation before cleaning.",
+    )
+
+    batch = p.add_argument_group("batch processing")
+    batch.add_argument(
+        "--batch",
+        action="store_true",
+        help=(
+            "Treat EMAIL as an inbox directory and process every *.json in it "
+            "through the persistent job store (resumes after a crash)."
+        ),
+    )
+    batch.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "Treat EMAIL as an inbox directory and keep processing emails as "
+            "they arrive (inotify, or polling where unavailable) until Ctrl-C."
+        ),
+    )
+    batch.add_argument(
+        "--settle",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help=(
+            "In --watch mode, wait until an email and its attachments have not "
+            "changed for this long before processing it (default: 1.0)."
+        ),
+    )
+    batch.add_argument(
+        "--poll-interval",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help=(
+            "In --watch mode, poll the inbox every SECONDS instead of using "
+            "inotify (e.g. on network filesystems)."
+        ),
+    )
+    batch.add_argument(
+        "--jobs-db",
+        default="outputs/jobs.sqlite3",
+        metavar="PATH",
+        help="SQLite job store used by --batch (default: outputs/jobs.sqlite3).",
+    )
+    batch.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        metavar="N",
+        help="Maximum concurrent model calls in --batch mode (default: 4).",
+    )
+    batch.add_argument(
+        "--cpu-workers",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Processes used for PDF parsing/rasterization (default: CPU count).",
+    )
+    batch.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        metavar="N",
+        help="Attempts per email before it is left failed (default: 3).",
+    )
+    batch.add_argument(
+        "--dedup-db",
+        default="outputs/dedup.sqlite3",
+        metavar="PATH",
+        help=(
+            "Index of processed invoices used to skip duplicates (same PDF, "
+            "near-identical PDF, or same vendor and invoice number) before "
+            "extraction/notification (default: outputs/dedup.sqlite3)."
+        ),
+    )
+    batch.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="Process every email, even if it duplicates an earlier invoice.",
+    )
+    batch.add_argument(
+        "--vip-senders",
+        default="",
+        metavar="LIST",
+        help=(
+            "Comma-separated sender addresses or @domains whose invoices are "
+            "extracted ahead of normal ones (SLA class 'high')."
+        ),
+    )
+    batch.add_argument(
+        "--lease-dir",
+        default=None,
+        metavar="PATH",
+        help=(
+            "Share the inbox with other nodes using the same directory (e.g. "
+            "inbox/.leases on NFS): emails are claimed through lease files, so "
+            "each is processed once and work spreads by --concurrency."
+        ),
+    )
+    batch.add_argument(
+        "--node-id",
+        default=None,
+        help="Unique name of this node in --lease-dir (default: <host>-<pid>).",
+    )
+    batch.add_argument(
+        "--lease-ttl",
+        type=float,
+        default=60.0,
+        metavar="SECONDS",
+        help="Seconds without heartbeat after which a node's leases are reclaimed.",
+    )
+    batch.add_argument(
+        "--jobs-status",
+        action="store_true",
+        help="Print job counts, stuck jobs and today's failures, then exit.",
+    )
+
+    bulk = p.add_argument_group("bulk mode (Batch API)")
+    bulk.add_argument(
+        "--bulk-submit",
+        action="store_true",
+        help=(
+            "Treat EMAIL as an inbox directory: prepare every ready email and "
+            "submit the extraction requests as Batch API jobs (half price, "
+            "results within 24h) instead of calling the model now."
+        ),
+    )
+    bulk.add_argument(
+        "--bulk-collect",
+        action="store_true",
+        help=(
+            "Ingest finished batches: validate each invoice, notify, and report "
+            "cost and throughput against the streaming path."
+        ),
+    )
+    bulk.add_argument(
+        "--bulk-wait",
+        action="store_true",
+        help="With --bulk-collect, keep polling until every batch has finished.",
+    )
+    bulk.add_argument(
+        "--bulk-poll",
+        type=float,
+        default=60.0,
+        metavar="SECONDS",
+        help="How often --bulk-wait checks running batches (default: 60).",
+    )
+    bulk.add_argument(
+        "--bulk-backend",
+        choices=["openai", "local"],
+        default="openai",
+        help=(
+            "Where batches run: the OpenAI Batch API, or a local stand-in that "
+            "makes the calls itself at submit time (default: openai)."
+        ),
+    )
+    bulk.add_argument(
+        "--bulk-dir",
+        default="outputs/bulk",
+        metavar="PATH",
+        help="Batch input files and manifests (default: outputs/bulk).",
+    )
+    bulk.add_argument(
+        "--bulk-limit",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Submit at most N emails with --bulk-submit.",
+    )
+
+    service = p.add_argument_group("service mode")
+    service.add_argument(
+        "--serve",
+        action="store_true",
+        help=(
+            "Run a resident worker that accepts jobs over local HTTP "
+            "(POST /jobs, GET /health, GET /stats) and keeps agents warm."
+        ),
+    )
+    service.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address to bind in --serve mode (default: 127.0.0.1).",
+    )
+    service.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="Port to bind in --serve mode (default: 8765).",
+    )
+    service.add_argument(
+        "--socket",
+        default=None,
+        metavar="PATH",
+        help="Serve on a Unix socket instead of TCP.",
+    )
+
+    metrics = p.add_argument_group("metrics")
+    metrics.add_argument(
+        "--metrics-file",
+        default=None,
+        metavar="PATH",
+        help=(
+            "Write Prometheus text-format metrics to PATH periodically and on "
+            "exit (e.g. for the node_exporter textfile collector)."
+        ),
+    )
+    metrics.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=15.0,
+        metavar="SECONDS",
+        help="How often to rewrite --metrics-file (default: 15).",
+    )
 
     # TODO(cli): Add `--email PATH` to point at a specific inbound email JSON (default: first in ./data).
     # TODO(cli): Add `--data-dir PATH` to set the input folder (default: ./data).
-    # TODO(cli): Add `--outputs-dir PATH` to set the outputs folder (default: ./outputs).
-    # TODO(cli): Add `--artifacts-dir PATH` to set artifacts folder (default: ./outputs/artifacts/<run_id>/).
-    # TODO(cli): Add `--clean` to delete artifacts/outputs from prior runs (confirm unless --yes).
-    # TODO(cli): Add `--clean-artifacts` and `--clean-outputs` to clean selectively.
-    # TODO(cli): Add `--yes` to skip confirmation prompts for destructive actions (clean).
     # TODO(cli): Add `--dry-run` to run extraction without writing notification files.
     # TODO(cli): Add `--format {json,text,both}` to control notification output format.
     # TODO(cli): Add `--max-turns N` to control orchestrator max turns (useful for debugging costs).
@@ -74,20 +376,231 @@ def build_parser() -> argparse.ArgumentParser:
     return p
 
 
+def print_jobs_status(db_path: str) -> None:
+    """Print a summary of the batch job store."""
+
+    from .pipeline.jobs import JobStore
+
+    midnight = time.mktime(time.localtime()[:3] + (0, 0, 0, 0, 0, -1))
+
+    with JobStore(db_path) as store:
+        print(f"Jobs: {store.counts()}")
+        for job in store.stuck():
+            print(f"  stuck   {job.state!s:<8} {job.email_path}")
+        for job in store.failed_since(midnight):
+            print(
+                f"  failed  attempt {job.attempts} {job.email_path}: {job.last_error}"
+            )
+
+
+def run_clean(
+    *,
+    artifacts_dir: str,
+    outputs_dir: str,
+    artifacts: bool,
+    outputs: bool,
+    yes: bool = False,
+) -> None:
+    """Delete artifacts and/or notification outputs, confirming unless `yes`."""
+
+    from .utils.artifacts import ArtifactStore
+    from .utils.sinks import notification_files
+
+    store = ArtifactStore(artifacts_dir)
+    plan = []
+    if artifacts:
+        files, size = store.usage()
+        if files:
+            plan.append(
+                f"{files} artifact files ({size / 2**20:.1f} MiB) in {store.root}"
+            )
+    output_files = notification_files(outputs_dir) if outputs else []
+    if output_files:
+        size = sum(f.stat().st_size for f in output_files)
+        plan.append(
+            f"{len(output_files)} notification files ({size / 2**20:.1f} MiB) "
+            f"in {outputs_dir}"
+        )
+
+    if not plan:
+        print("Nothing to clean.")
+        return
+    print("This will delete:\n  " + "\n  ".join(plan))
+    if not yes:
+        try:
+            answer = input("Proceed? [y/N] ")
+        except EOFError:
+            answer = ""
+        if answer.strip().lower() not in ("y", "yes"):
+            print("Aborted.")
+            return
+
+    if artifacts:
+        store.clean()
+    for f in output_files:
+        f.unlink(missing_ok=True)
+    print("Cleaned.")
+
+
+async def _exporting_metrics(main_coro, path: str | None, interval: float):
+    """Run `main_coro` while exporting metrics to `path` (if set)."""
+
+    from .utils.metrics import export_metrics_file
+
+    async with export_metrics_file(path, interval):
+        return await main_coro
+
+
 def main() -> None:
     """Main entry point for the invoice intake agent."""
 
     parser = build_parser()
     args = parser.parse_args()
 
+    if args.jobs_status:
+        print_jobs_status(args.jobs_db)
+        return
+
+    if args.clean or args.clean_artifacts or args.clean_outputs:
+        run_clean(
+            artifacts_dir=args.artifacts_dir,
+            outputs_dir=args.outputs_dir,
+            artifacts=args.clean or args.clean_artifacts,
+            outputs=args.clean or args.clean_outputs,
+            yes=args.yes,
+        )
+        if args.email is None and not args.serve:
+            return
+
+    bulk_collect = args.bulk_collect or args.bulk_wait
+    if args.email is None and not (
+        args.serve or (bulk_collect and not args.bulk_submit)
+    ):
+        parser.error("the following arguments are required: email")
+    if args.hedge_percentile is not None and not 0 < args.hedge_percentile < 1:
+        parser.error("--hedge-percentile must be between 0 and 1")
+    if args.metrics_interval <= 0:
+        parser.error("--metrics-interval must be positive")
+    if args.bulk_poll <= 0:
+        parser.error("--bulk-poll must be positive")
+    if args.lease_dir is not None and (
+        args.serve or args.bulk_submit or bulk_collect or not (args.batch or args.watch)
+    ):
+        parser.error("--lease-dir only applies to --batch and --watch")
+
     set_runtime(
         email_path=args.email,
         log_level=args.log_level,
         verbose=args.verbose,
         color=not args.no_color,
+        hedge_percentile=args.hedge_percentile,
+        outputs_dir=args.outputs_dir,
+        output_format=args.output_format,
+        artifacts_dir=args.artifacts_dir,
+        artifacts_max_bytes=args.artifacts_max_size or None,
+        artifacts_max_age=args.artifacts_max_age * 24 * 3600 or None,
+        vip_senders=tuple(s.strip() for s in args.vip_senders.split(",") if s.strip()),
     )
 
-    asyncio.run(run_app())
+    import asyncio
+
+    def run(main_coro) -> None:
+        asyncio.run(
+            _exporting_metrics(main_coro, args.metrics_file, args.metrics_interval)
+        )
+
+    if args.serve:
+        from .service import run_service
+
+        run(
+            run_service(
+                host=args.host,
+                port=args.port,
+                socket_path=args.socket,
+                db_path=args.jobs_db,
+                concurrency=args.concurrency,
+                cpu_workers=args.cpu_workers,
+                max_attempts=args.max_attempts,
+                dedup_db=None if args.no_dedup else args.dedup_db,
+            )
+        )
+        return
+
+    if args.bulk_submit or bulk_collect:
+        from .pipeline.bulk import collect_batches, make_backend, submit_inbox
+
+        backend = make_backend(args.bulk_backend, args.bulk_dir)
+        dedup_db = None if args.no_dedup else args.dedup_db
+        if args.bulk_submit:
+            run(
+                submit_inbox(
+                    args.email,
+                    backend,
+                    db_path=args.jobs_db,
+                    bulk_dir=args.bulk_dir,
+                    cpu_workers=args.cpu_workers,
+                    max_attempts=args.max_attempts,
+                    dedup_db=dedup_db,
+                    limit=args.bulk_limit,
+                )
+            )
+        if bulk_collect:
+            run(
+                collect_batches(
+                    backend,
+                    db_path=args.jobs_db,
+                    bulk_dir=args.bulk_dir,
+                    max_attempts=args.max_attempts,
+                    dedup_db=dedup_db,
+                    wait=args.bulk_wait,
+                    poll_interval=args.bulk_poll,
+                    concurrency=args.concurrency,
+                )
+            )
+        return
+
+    if args.watch:
+        from .pipeline.watch import watch_inbox
+
+        run(
+            watch_inbox(
+                args.email,
+                db_path=args.jobs_db,
+                concurrency=args.concurrency,
+                cpu_workers=args.cpu_workers,
+                max_attempts=args.max_attempts,
+                settle=args.settle,
+                poll_interval=args.poll_interval or 1.0,
+                polling=args.poll_interval is not None,
+                dedup_db=None if args.no_dedup else args.dedup_db,
+                lease_dir=args.lease_dir,
+                node_id=args.node_id,
+                lease_ttl=args.lease_ttl,
+            )
+        )
+        return
+
+    if args.batch:
+        from .pipeline.batch import run_batch
+
+        run(
+            run_batch(
+                args.email,
+                db_path=args.jobs_db,
+                concurrency=args.concurrency,
+                cpu_workers=args.cpu_workers,
+                max_attempts=args.max_attempts,
+                dedup_db=None if args.no_dedup else args.dedup_db,
+                lease_dir=args.lease_dir,
+                node_id=args.node_id,
+                lease_ttl=args.lease_ttl,
+            )
+        )
+        return
+
+    from .app import run_app
+
+    run(run_app())
 
 
 if __name__ == "__main__":
@@ -1,16 +1,14 @@
-"""Configuration for the invoice intake agent."""
+"""Configuration for the invoice intake agent.
+
+Importing this module has no side effects: `.env` is loaded and the API key
+is checked on first call to `load_settings()`, i.e. only on code paths that
+actually talk to the model (not `--help` or `--jobs-status`).
+"""
 
 import os
-from dotenv import load_dotenv
+from dataclasses import dataclass
 from enum import Enum
-
-
-load_dotenv()
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY is not set")
+from functools import lru_cache
 
 
 class Model(str, Enum):
@@ -22,3 +20,45 @@ class Model(str, Enum):
 
 
 MODEL = Model.GPT_5_MINI
+
+# List prices in USD per 1M tokens: (input, cached input, output). Only used
+# for cost reports; update them with the provider's pricing page.
+PRICES = {
+    Model.GPT_5_MINI: (0.25, 0.025, 2.00),
+    Model.GPT_5_NANO: (0.05, 0.005, 0.40),
+}
+
+# Batch API requests are billed at this fraction of the list price.
+BATCH_PRICE_FACTOR = 0.5
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Settings read from the environment (and `.env`)."""
+
+    openai_api_key: str
+    # Provider quotas for MODEL (requests/min, tokens/min) and the ceiling for
+    # concurrent model calls. Defaults match a tier-1 account.
+    rpm_limit: int = 500
+    tpm_limit: int = 500000
+    max_concurrency: int = 16
+
+
+@lru_cache(maxsize=1)
+def load_settings() -> Settings:
+    """Load `.env` and validate the configuration (once per process)."""
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY is not set")
+
+    return Settings(
+        openai_api_key=api_key,
+        rpm_limit=int(os.getenv("OPENAI_RPM_LIMIT", "500")),
+        tpm_limit=int(os.getenv("OPENAI_TPM_LIMIT", "500000")),
+        max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")),
+    )
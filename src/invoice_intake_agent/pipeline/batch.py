@@ -0,0 +1,549 @@
+"""Resumable batch processing of an inbox directory.
+
+Emails flow through three stages connected by bounded queues:
+
+    prepare (process pool: load + PDF text + raster)
+      -> extract (async model calls, own concurrency limit)
+      -> notify (write the outbound email via the output sink)
+
+so CPU-bound parsing of the next emails overlaps with the network-bound
+model calls of the current ones. Progress is checkpointed in the job store.
+With a dedup index, duplicate invoices are completed from the earlier
+result instead of being extracted and notified again.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, List, Optional
+
+from ..agents.invoice_agent import run_invoice_agent
+from ..config import load_settings
+from ..tools.notify import compose_email, notification_name
+from ..utils import console as c
+from ..utils.artifacts import get_artifact_store
+from ..utils.hedge import hedge_stats
+from ..utils.metrics import (
+    DUPLICATES,
+    FAILURES,
+    INVOICES,
+    JOBS,
+    QUEUE_DEPTH,
+    REGISTRY,
+    RENDER_CACHE,
+    STAGE_ACTIVE,
+    STAGE_SECONDS,
+)
+from ..utils.runtime import RUNTIME
+from ..utils.sinks import OutputSink, SinkWriter, get_sink
+from ..utils.usage import USAGE
+from .dedup import DedupIndex, DuplicateMatch
+from .jobs import Job, JobState, JobStore
+from .leases import LeaseCoordinator, LeaseError, make_leases
+from .prepare import PreparedEmail, prepare_email
+from .schedule import (
+    DeadlineQueue,
+    SlaPolicy,
+    invoice_terms_days,
+    received_at,
+    sender_address,
+)
+from .stages import Pipeline, Stage
+
+
+@dataclass
+class WorkItem:
+    """A claimed job travelling through the pipeline."""
+
+    job: Job
+    prepared: Optional[PreparedEmail] = None
+    invoice: Any = None
+    # SLA class and deadline (epoch seconds), set once the email is prepared.
+    priority: str = "normal"
+    deadline: float = 0.0
+    # Holds a slot of the runner's cap on claimed jobs not yet extracting.
+    held: bool = False
+    # Resolved with the notify result (or the error) for callers that wait.
+    done: Optional[asyncio.Future] = None
+
+
+async def _acquire(slots: asyncio.Semaphore, stop: asyncio.Event | None) -> bool:
+    """Take a slot, unless `stop` is set first (then returns False)."""
+    if stop is None:
+        await slots.acquire()
+        return True
+    acquire = asyncio.ensure_future(slots.acquire())
+    stopping = asyncio.ensure_future(stop.wait())
+    try:
+        await asyncio.wait({acquire, stopping}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stopping.cancel()
+        acquire.cancel()  # no-op once it has the slot
+    return acquire.done() and not acquire.cancelled()
+
+
+class BatchRunner:
+    """Wires the job store to the staged pipeline."""
+
+    def __init__(
+        self,
+        store: JobStore,
+        pool: ProcessPoolExecutor,
+        *,
+        cpu_workers: int,
+        llm_concurrency: int,
+        notify_workers: int = 1,
+        sink: OutputSink | None = None,
+        dedup: DedupIndex | None = None,
+        policy: SlaPolicy | None = None,
+        leases: LeaseCoordinator | None = None,
+    ):
+        self.store = store
+        self.pool = pool
+        self.dedup = dedup
+        # Shared with other nodes processing the same inbox, if any.
+        self.leases = leases
+        # Passed to the parse workers, which may not inherit RUNTIME.
+        self.artifacts = get_artifact_store()
+        # Notifications are written by one background thread, in batches.
+        self.writer = SinkWriter(sink or get_sink())
+        self.policy = policy or SlaPolicy(
+            vip_senders=frozenset(s.lower() for s in RUNTIME.vip_senders)
+        )
+        # Prepared emails wait for a model call in deadline order; the window
+        # is deeper than a FIFO stage queue so urgent ones can overtake.
+        self.schedule = DeadlineQueue(
+            max(64, llm_concurrency * 8),
+            schedule=lambda item: (item.priority, item.deadline),
+        )
+        self.pipeline = Pipeline(
+            [
+                Stage("prepare", self._prepare, workers=cpu_workers),
+                Stage(
+                    "extract",
+                    self._extract,
+                    workers=llm_concurrency,
+                    queue=self.schedule,
+                ),
+                Stage("notify", self._notify, workers=notify_workers),
+            ],
+            on_error=self._on_error,
+        )
+        # With a shared inbox, every claimed job holds a lease: cap how many
+        # may wait before extraction so the rest stays free for other nodes.
+        self._unstarted = (
+            asyncio.Semaphore(max(2 * llm_concurrency, cpu_workers))
+            if leases is not None
+            else None
+        )
+        REGISTRY.add_collector(self._collect_metrics)
+
+    def _collect_metrics(self) -> None:
+        """Refresh queue and job gauges (runs on each metrics render)."""
+        for stats in self.pipeline.stats():
+            QUEUE_DEPTH.labels(stats.name).set(stats.queue_depth)
+            STAGE_ACTIVE.labels(stats.name).set(stats.active)
+        counts = self.store.counts()
+        for state in JobState:
+            JOBS.labels(str(state)).set(counts.get(str(state), 0))
+
+    async def _prepare(self, item: WorkItem) -> WorkItem:
+        loop = asyncio.get_running_loop()
+        item.prepared = await loop.run_in_executor(
+            self.pool,
+            partial(
+                prepare_email,
+                dedup=self.dedup is not None,
+                artifacts=self.artifacts,
+                # Keeps the pages while the job waits in the deadline queue.
+                pin=item.job.job_id,
+            ),
+            item.job.email_path,
+        )
+        self._schedule(item)
+        return item
+
+    def _schedule(self, item: WorkItem) -> None:
+        """Set the item's SLA class and deadline from cheap email signals."""
+        email = item.prepared.email
+        known_terms = self.store.sender_terms(sender_address(email))
+        item.priority, reason = self.policy.classify(
+            email, known_terms_days=known_terms
+        )
+        queued = item.job.created_at
+        received = received_at(email) or queued
+        item.deadline = self.policy.deadline(item.priority, received, queued)
+        if item.priority != "normal":
+            c.dim(
+                "SCHEDULE",
+                f"{Path(item.job.email_path).name}: {item.priority} ({reason})",
+            )
+
+    def _complete_duplicate(self, item: WorkItem, match: DuplicateMatch) -> None:
+        """Finish a job from the result of the invoice it duplicates."""
+        original = match.original
+        result = {
+            **(original.result or {}),
+            "duplicate_of": original.job_id,
+            "duplicate": match.kind,
+        }
+        self.store.complete(item.job.job_id, result)
+        self.artifacts.unpin(item.job.job_id)
+        if self.leases is not None:
+            self.leases.finish(item.job.job_id, result)
+        INVOICES.labels("duplicate").inc()
+        DUPLICATES.labels(match.kind).inc()
+        c.ok(
+            f"{Path(item.job.email_path).name}: duplicate ({match.kind}) of "
+            f"invoice {original.invoice_number or '?'} (job {original.job_id}), "
+            "not notified again"
+        )
+        if item.done is not None and not item.done.done():
+            item.done.set_result(result)
+
+    def _started(self, item: WorkItem) -> None:
+        """Give back the item's slot of claimed jobs not yet extracting."""
+        if item.held and self._unstarted is not None:
+            item.held = False
+            self._unstarted.release()
+
+    async def _extract(self, item: WorkItem) -> Optional[WorkItem]:
+        self._started(item)
+        prepared = item.prepared
+        assert prepared is not None
+        # load/text/raster ran together in the pool; record their own timings.
+        self.store.advance(item.job.job_id, JobState.EXTRACT, timings=prepared.timings)
+        for stage, seconds in prepared.timings.items():
+            STAGE_SECONDS.labels(stage).observe(seconds)
+        RENDER_CACHE.labels("hit" if prepared.render_cached else "miss").inc()
+
+        if self.dedup is not None and prepared.fingerprint is not None:
+            match = self.dedup.match(prepared.fingerprint)
+            if match is not None and match.conclusive:
+                self._complete_duplicate(item, match)
+                return None
+            if match is not None:
+                c.dim(
+                    "DEDUP",
+                    f"{Path(item.job.email_path).name}: first page resembles job "
+                    f"{match.original.job_id} ({match.hamming} bits); extracting",
+                )
+
+        t0 = time.perf_counter()
+        early: list[DuplicateMatch] = []
+
+        def on_invoice_number(fields: dict[str, Any]) -> None:
+            # The number streams in well before the line items: if it is a
+            # known invoice, stop generating the rest.
+            match = self.dedup.find_invoice(
+                fields.get("vendor_name"), fields["invoice_number"]
+            )
+            if match is not None:
+                early.append(match)
+                extraction.cancel()
+
+        extraction = asyncio.create_task(
+            run_invoice_agent(
+                email=prepared.email,
+                pdf_text=prepared.pdf_text,
+                pdf_images=prepared.pdf_images,
+                on_invoice_number=on_invoice_number if self.dedup else None,
+            )
+        )
+        try:
+            item.invoice = await extraction
+        except asyncio.CancelledError:
+            if not early or not extraction.cancelled():
+                raise
+            self._complete_duplicate(item, early[0])
+            return None
+        finally:
+            STAGE_SECONDS.labels("extract").observe(time.perf_counter() - t0)
+        return item
+
+    async def _notify(self, item: WorkItem) -> None:
+        self.store.advance(item.job.job_id, JobState.NOTIFY)
+        invoice = item.invoice
+        fp = item.prepared.fingerprint if item.prepared is not None else None
+
+        if self.dedup is not None:
+            # One notify worker by default, so concurrent copies of an
+            # invoice are caught here by whichever is notified second.
+            match = self.dedup.find_invoice(invoice.vendor_name, invoice.invoice_number)
+            if match is not None:
+                self._complete_duplicate(item, match)
+                return
+
+        t0 = time.perf_counter()
+        result = await self.writer.write(
+            notification_name(invoice), compose_email(invoice)
+        )
+        STAGE_SECONDS.labels("notify").observe(time.perf_counter() - t0)
+        if self.dedup is not None and fp is not None:
+            self.dedup.add(
+                fp,
+                job_id=item.job.job_id,
+                vendor_name=invoice.vendor_name,
+                invoice_number=invoice.invoice_number,
+                result=result,
+            )
+        self.store.complete(item.job.job_id, result)
+        self.artifacts.unpin(item.job.job_id)
+        if self.leases is not None:
+            self.leases.finish(item.job.job_id, result)
+        INVOICES.labels("notified").inc()
+        sender = sender_address(item.prepared.email) if item.prepared else None
+        terms = invoice_terms_days(
+            invoice.payment_terms, invoice.invoice_date, invoice.invoice_due_date
+        )
+        if sender and terms is not None:
+            self.store.remember_terms(sender, terms)
+        c.ok(f"{Path(item.job.email_path).name}: {result['outbound_email_json']}")
+        if item.done is not None and not item.done.done():
+            item.done.set_result(result)
+
+    async def _on_error(self, stage: str, item: WorkItem, e: BaseException) -> None:
+        self._started(item)
+        error = f"{type(e).__name__}: {e}"
+        failed = self.store.fail(item.job.job_id, error)
+        self.artifacts.unpin(item.job.job_id)
+        FAILURES.labels(stage).inc()
+        if self.leases is not None:
+            # Share the attempt count and backoff, so any node retries it once
+            # the backoff has passed and no more than max_attempts in total.
+            self.leases.fail(
+                item.job.job_id,
+                attempts=failed.attempts,
+                retry_in=failed.next_attempt_at - time.time(),
+                error=error,
+            )
+        c.error(
+            f"{Path(item.job.email_path).name}: attempt {failed.attempts} "
+            f"failed in {stage}: {e}"
+        )
+        if item.done is not None and not item.done.done():
+            item.done.set_exception(e)
+
+    def claim(self, job: Job) -> bool:
+        """Claim a ready job, across nodes when the inbox is shared.
+
+        A job another node has finished is completed locally from its result;
+        one that failed elsewhere takes over that attempt count and backoff;
+        one leased elsewhere is postponed locally for a lease poll interval.
+        Either way it leaves the ready list, so `feed()` moves on.
+        """
+        if self.leases is None:
+            return self.store.claim(job.job_id)
+        try:
+            result = self.leases.finished(job.job_id)
+        except LeaseError as e:
+            c.error(str(e))
+            result = None
+        if result is not None:
+            self.store.complete(job.job_id, result)
+            return False
+        failure = self.leases.failure(job.job_id)
+        if failure is not None and failure.attempts > job.attempts:
+            self.store.adopt_failure(
+                job.job_id,
+                attempts=failure.attempts,
+                next_attempt_at=time.time() + failure.retry_in,
+                error=failure.error,
+            )
+            if failure.retry_in > 0 or failure.attempts >= self.store.max_attempts:
+                return False
+        if not self.leases.acquire(job.job_id):
+            self.store.postpone(job.job_id, time.time() + self.leases.poll_interval)
+            return False
+        if self.store.claim(job.job_id):
+            return True
+        self.leases.release(job.job_id)
+        return False
+
+    def claimable(self, jobs: List[Job]) -> List[Job]:
+        """Ready jobs in claiming order (this node's own share first)."""
+        return jobs if self.leases is None else self.leases.order(jobs)
+
+    async def feed(
+        self,
+        on_submit: Callable[[Job, asyncio.Future], None] | None = None,
+        *,
+        stop: asyncio.Event | None = None,
+    ) -> int:
+        """Claim ready jobs and submit them to the (started) pipeline.
+
+        Pages through the ready jobs until none is left that this node can
+        claim, or `stop` is set: that is checked between claims and while
+        waiting for a slot. With a shared inbox, at most a few claimed jobs per
+        model call wait before extraction (this blocks until a slot frees up).
+        With `on_submit`, each job is passed with a future as in `submit()`.
+        Returns the number of jobs submitted.
+        """
+        submitted = 0
+        while stop is None or not stop.is_set():
+            jobs = self.store.ready(limit=64)
+            if not jobs:
+                break
+            for job in self.claimable(jobs):
+                if self._unstarted is not None and not await _acquire(
+                    self._unstarted, stop
+                ):
+                    break
+                if stop is not None and stop.is_set():
+                    if self._unstarted is not None:
+                        self._unstarted.release()
+                    break
+                if not self.claim(job):
+                    if self._unstarted is not None:
+                        self._unstarted.release()
+                    continue
+                item = WorkItem(job, held=self._unstarted is not None)
+                if on_submit is not None:
+                    item.done = asyncio.get_running_loop().create_future()
+                # Blocks while the prepare queue is full.
+                await self.pipeline.submit(item)
+                submitted += 1
+                if on_submit is not None:
+                    on_submit(job, item.done)
+        return submitted
+
+    async def submit(self, job: Job) -> asyncio.Future:
+        """Feed a claimed job into the (started) pipeline.
+
+        Returns a future resolved with the notify result or the error.
+        """
+        item = WorkItem(job, done=asyncio.get_running_loop().create_future())
+        await self.pipeline.submit(item)
+        return item.done
+
+    async def run(self, *, wait_for_retries: bool = True, report_every: float = 30.0):
+        """Feed ready jobs into the pipeline until none are left."""
+
+        async with self.pipeline as pipeline:
+            reporter = asyncio.create_task(
+                pipeline.report_every(
+                    report_every, lambda line: c.dim("PIPELINE", line)
+                )
+            )
+            try:
+                while True:
+                    await self.feed()
+                    pending = self.store.counts().get(str(JobState.PENDING), 0)
+                    retry_at = self.store.next_retry_at()
+                    if self.leases is not None and pending and retry_at is not None:
+                        # Jobs leased by other nodes: look again when they are
+                        # due, while our own pipeline keeps working.
+                        delay = min(retry_at - time.time(), self.leases.poll_interval)
+                        await asyncio.sleep(max(0.0, delay))
+                        continue
+
+                    await pipeline.drain()
+                    if self.store.ready(limit=1):
+                        continue
+
+                    retry_at = self.store.next_retry_at()
+                    if not wait_for_retries or retry_at is None:
+                        break
+                    await asyncio.sleep(max(0.0, retry_at - time.time()))
+            finally:
+                reporter.cancel()
+
+            await self.close()
+            self.report()
+
+    async def close(self) -> None:
+        """Finish writing queued notifications."""
+        await self.writer.close()
+        REGISTRY.remove_collector(self._collect_metrics)
+
+    def report(self) -> None:
+        """Log final stage, hedging and token usage statistics."""
+        for stats in self.pipeline.stats():
+            c.dim("PIPELINE", str(stats))
+        c.dim("PIPELINE", f"bottleneck: {self.pipeline.bottleneck().name}")
+        c.dim("SCHEDULE", str(self.schedule.schedule_stats))
+
+        hedging = hedge_stats()
+        if hedging is not None:
+            c.dim("HEDGE", str(hedging))
+        for name, usage in USAGE.items():
+            c.dim("USAGE", f"{name}: {usage}")
+
+
+async def run_batch(
+    inbox: str | Path,
+    *,
+    db_path: str | Path = "outputs/jobs.sqlite3",
+    concurrency: int = 4,
+    cpu_workers: int | None = None,
+    max_attempts: int = 3,
+    wait_for_retries: bool = True,
+    dedup_db: str | Path | None = "outputs/dedup.sqlite3",
+    lease_dir: str | Path | None = None,
+    node_id: str | None = None,
+    lease_ttl: float = 60.0,
+) -> dict[str, int]:
+    """Process every email JSON in `inbox`, resuming from the job store.
+
+    Completed jobs are skipped, jobs interrupted by a crash are requeued,
+    and failures are retried with backoff up to `max_attempts`. When
+    `wait_for_retries` is set the call sleeps until backed-off jobs are due
+    instead of returning early. `concurrency` bounds concurrent model calls;
+    `cpu_workers` sizes the parse/raster process pool (default: CPU count).
+    Duplicate invoices are detected with the index at `dedup_db` (None
+    disables it). With `lease_dir`, the inbox is shared with other nodes
+    using the same directory (see `leases`). Returns the final job counts
+    per state.
+    """
+
+    load_settings()
+
+    inbox = Path(inbox).expanduser().resolve()
+    if not inbox.is_dir():
+        raise NotADirectoryError(f"Inbox directory not found: {inbox}")
+
+    cpu_workers = cpu_workers or os.cpu_count() or 1
+    leases = make_leases(
+        lease_dir, node_id=node_id, capacity=concurrency, ttl=lease_ttl
+    )
+
+    with (
+        JobStore(db_path, max_attempts=max_attempts) as store,
+        DedupIndex(dedup_db) if dedup_db else nullcontext() as dedup,
+    ):
+        requeued = store.recover()
+        for path in sorted(inbox.glob("*.json")):
+            store.enqueue(path)
+
+        counts = store.counts()
+        c.sysmsg(
+            f"Batch: {sum(counts.values())} jobs, "
+            f"{counts.get(str(JobState.DONE), 0)} already done, "
+            f"{requeued} resumed after interruption."
+        )
+
+        with ProcessPoolExecutor(max_workers=cpu_workers) as pool:
+            runner = BatchRunner(
+                store,
+                pool,
+                cpu_workers=cpu_workers,
+                llm_concurrency=concurrency,
+                dedup=dedup,
+                leases=leases,
+            )
+            async with (
+                store.heartbeating(),
+                leases.heartbeating() if leases else nullcontext(),
+            ):
+                await runner.run(wait_for_retries=wait_for_retries)
+
+        counts = store.counts()
+        c.sysmsg(f"Batch complete: {counts}")
+        return counts
@@ -0,0 +1,891 @@
+"""Deferred extraction of large backlogs through the OpenAI Batch API.
+
+Overnight backlogs do not need interactive latency, and batch requests are
+billed at half the list price. Instead of one streamed call per email:
+
+    submit   claim ready jobs, prepare them in the process pool and write
+             their Invoice Specialist and guardrail requests (the same
+             prompts, text and page images as the streaming path) as
+             /v1/responses lines of batch input files; upload each file and
+             start a batch. The jobs wait in the `submitted` state.
+    collect  for every finished batch, read its result file, validate each
+             `Invoice` and its guardrail verdict, notify and complete the
+             jobs. Failed or missing results go back to the normal retry
+             path, so a later run (batch or streaming) picks them up.
+
+Each batch is recorded in `<bulk_dir>/batches/<input file>.json` with its
+jobs and, per job, the sender and dedup fingerprint, so results can be
+collected by another process days later. The record is written and the jobs
+parked before the upload starts, and the batch is tagged with the record's
+name: if the submitting process dies mid-upload, collect finds the batch by
+that name (or, if none was created, sends the jobs back to the retry path)
+instead of the jobs being requeued and billed a second time. Backend calls
+run in a thread, so uploads and polls do not block the event loop.
+
+`LocalBatchBackend` stands in for the Batch API: it runs an input file
+through a responder and writes a result file in the same format, for tests
+and trial runs.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional
+
+from agents import Agent, AgentOutputSchema
+from pydantic import ValidationError
+
+from ..agents.guardrails import GuardrailOutput, build_guardrail_agent
+from ..agents.invoice_agent import build_invoice_agent, build_invoice_content
+from ..config import BATCH_PRICE_FACTOR, MODEL, PRICES, load_settings
+from ..schema.invoice import Invoice
+from ..tools.notify import compose_email, notification_name
+from ..utils import console as c
+from ..utils.artifacts import get_artifact_store
+from ..utils.metrics import (
+    DUPLICATES,
+    FAILURES,
+    GUARDRAIL_CHECKS,
+    INVOICES,
+    MODEL_TOKENS,
+    RENDER_CACHE,
+)
+from ..utils.sinks import OutputSink, get_sink, safe_name
+from .dedup import DedupIndex, DuplicateMatch, Fingerprint
+from .jobs import Job, JobState, JobStore
+from .prepare import PreparedEmail, prepare_email
+from .schedule import invoice_terms_days, sender_address
+
+ENDPOINT = "/v1/responses"
+BACKENDS = ("openai", "local")
+
+# Batch API limits per input file (the upload limit is 200 MB).
+MAX_REQUESTS = 50_000
+MAX_FILE_BYTES = 190 * 2**20
+
+# Batch states after which no more results will appear.
+FINAL_STATES = frozenset({"completed", "failed", "expired", "cancelled"})
+
+# An upload recorded this long ago without a batch ID was interrupted.
+UPLOAD_GRACE = 3600.0
+
+
+class BulkError(RuntimeError):
+    """Error submitting a batch or reading one of its results."""
+
+
+# --- Requests and results ----------------------------------------------------
+
+
+@lru_cache(maxsize=None)
+def _text_format(output_type: type) -> dict[str, Any]:
+    """Structured output format the Agents SDK sends for `output_type`."""
+    return {
+        "format": {
+            "type": "json_schema",
+            "name": "final_output",
+            "schema": AgentOutputSchema(output_type).json_schema(),
+            "strict": True,
+        }
+    }
+
+
+def _request(custom_id: str, agent: Agent, content: List[dict]) -> dict[str, Any]:
+    """Batch request line equivalent to a single-turn run of `agent`."""
+    body = {
+        "model": str(agent.model),
+        "instructions": agent.instructions,
+        "input": [{"role": "user", "content": content}],
+        "text": _text_format(agent.output_type),
+        **(agent.model_settings.extra_args or {}),
+    }
+    return {"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body}
+
+
+def request_lines(job_id: str, prepared: PreparedEmail) -> List[dict[str, Any]]:
+    """Invoice Specialist and guardrail requests for one prepared email."""
+    content = build_invoice_content(
+        prepared.email, prepared.pdf_text, prepared.pdf_images
+    )
+    return [
+        _request(f"{job_id}:invoice", build_invoice_agent(), content),
+        # The streaming path guards the same input with a parallel call.
+        _request(f"{job_id}:guardrail", build_guardrail_agent(), content),
+    ]
+
+
+def _result_body(record: dict[str, Any]) -> dict[str, Any]:
+    """Response body of a batch result line (raises for failed requests)."""
+    error = record.get("error")
+    if error:
+        raise BulkError(f"{error.get('code')}: {error.get('message')}")
+    response = record.get("response") or {}
+    body = response.get("body") or {}
+    if response.get("status_code") != 200:
+        detail = body.get("error") or {}
+        raise BulkError(
+            f"HTTP {response.get('status_code')}: {detail.get('message', detail)}"
+        )
+    return body
+
+
+def _output_text(body: dict[str, Any]) -> str:
+    """Text output of a Responses API body."""
+    status = body.get("status")
+    if status not in (None, "completed"):
+        reason = (body.get("incomplete_details") or {}).get("reason")
+        raise BulkError(f"Response {status}: {reason or body.get('error')}")
+    parts = [
+        part.get("text") or ""
+        for item in body.get("output") or []
+        if item.get("type") == "message"
+        for part in item.get("content") or []
+        if part.get("type") == "output_text"
+    ]
+    if not parts:
+        raise BulkError("Response has no output text")
+    return "".join(parts)
+
+
+# --- Backends ----------------------------------------------------------------
+
+
+@dataclass
+class BatchStatus:
+    """Where a submitted batch is, and its result files once finished."""
+
+    status: str
+    output_file_id: Optional[str] = None
+    error_file_id: Optional[str] = None
+    finished_at: Optional[float] = None
+
+
+@lru_cache(maxsize=1)
+def _client() -> Any:
+    from openai import OpenAI
+
+    return OpenAI(api_key=load_settings().openai_api_key)
+
+
+class OpenAIBatchBackend:
+    """Runs input files through the OpenAI Batch API."""
+
+    name = "openai"
+
+    def __init__(self, client: Any = None):
+        self.client = client or _client()
+
+    def submit(self, path: Path, name: str) -> str:
+        with open(path, "rb") as f:
+            upload = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=upload.id,
+            endpoint=ENDPOINT,
+            completion_window="24h",
+            metadata={"manifest": name},
+        )
+        return batch.id
+
+    def find(self, name: str, since: float) -> Optional[str]:
+        """ID of the batch submitted as `name` no earlier than `since`."""
+        for batch in self.client.batches.list(limit=100):
+            if batch.created_at < since - 60:
+                break  # newest first
+            if (batch.metadata or {}).get("manifest") == name:
+                return batch.id
+        return None
+
+    def status(self, batch_id: str) -> BatchStatus:
+        batch = self.client.batches.retrieve(batch_id)
+        return BatchStatus(
+            status=batch.status,
+            output_file_id=batch.output_file_id,
+            error_file_id=batch.error_file_id,
+            finished_at=(
+                batch.completed_at
+                or batch.failed_at
+                or batch.expired_at
+                or batch.cancelled_at
+            ),
+        )
+
+    def download(self, file_id: str) -> bytes:
+        return self.client.files.content(file_id).read()
+
+
+def _respond_with_api(body: dict[str, Any]) -> dict[str, Any]:
+    """One synchronous Responses API call (full price)."""
+    return _client().responses.create(**body).model_dump(mode="json")
+
+
+class LocalBatchBackend:
+    """Stand-in for the Batch API that runs input files itself.
+
+    Each request body goes through `respond` (default: a synchronous
+    Responses API call) when the file is submitted, and the results are
+    written in the Batch API output format under `root`.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        root: str | Path,
+        respond: Callable[[dict[str, Any]], dict[str, Any]] | None = None,
+    ):
+        self.root = Path(root)
+        self.respond = respond or _respond_with_api
+
+    def submit(self, path: Path, name: str) -> str:
+        batch_id = f"local_batch_{name}"
+        self.root.mkdir(parents=True, exist_ok=True)
+        output = self.root / f"{batch_id}.output.jsonl"
+        with (
+            open(path, encoding="utf-8") as src,
+            open(output, "w", encoding="utf-8") as out,
+        ):
+            for n, line in enumerate(src):
+                request = json.loads(line)
+                try:
+                    body = self.respond(request["body"])
+                    result = {
+                        "response": {
+                            "status_code": 200,
+                            "request_id": f"local_req_{n}",
+                            "body": body,
+                        },
+                        "error": None,
+                    }
+                except Exception as e:
+                    result = {
+                        "response": None,
+                        "error": {"code": type(e).__name__, "message": str(e)},
+                    }
+                record = {"id": f"{batch_id}_{n}", "custom_id": request["custom_id"]}
+                out.write(json.dumps({**record, **result}) + "\n")
+        status = BatchStatus("completed", output.name, None, time.time())
+        (self.root / f"{batch_id}.json").write_text(json.dumps(asdict(status)))
+        return batch_id
+
+    def find(self, name: str, since: float) -> Optional[str]:
+        batch_id = f"local_batch_{name}"
+        return batch_id if (self.root / f"{batch_id}.json").exists() else None
+
+    def status(self, batch_id: str) -> BatchStatus:
+        try:
+            return BatchStatus(
+                **json.loads((self.root / f"{batch_id}.json").read_text())
+            )
+        except FileNotFoundError:
+            raise BulkError(f"Unknown local batch: {batch_id}")
+
+    def download(self, file_id: str) -> bytes:
+        return (self.root / file_id).read_bytes()
+
+
+def make_backend(name: str, bulk_dir: str | Path = "outputs/bulk"):
+    """Backend for `--bulk-backend`."""
+    if name == "openai":
+        return OpenAIBatchBackend()
+    if name == "local":
+        return LocalBatchBackend(Path(bulk_dir) / "local")
+    raise ValueError(f"Unknown bulk backend: {name!r} (expected one of {BACKENDS})")
+
+
+# --- Bookkeeping -------------------------------------------------------------
+
+
+@dataclass
+class BatchManifest:
+    """A submitted batch and the jobs waiting on it.
+
+    `batch_id` is None while the input file is being uploaded.
+    """
+
+    batch_id: Optional[str]
+    backend: str
+    input_file: str
+    model: str
+    submitted_at: float
+    requests: int
+    bytes: int
+    # job_id -> {"email_path", "sender", "fingerprint"}
+    jobs: Dict[str, Dict[str, Any]]
+    status: str = "uploading"
+    collected_at: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        """Stable name of the batch, known before the upload."""
+        return Path(self.input_file).stem
+
+    def save(self, bulk_dir: str | Path) -> Path:
+        path = Path(bulk_dir) / "batches" / f"{safe_name(self.name)}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_text(json.dumps(asdict(self), indent=2))
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path) -> "BatchManifest":
+        return cls(**json.loads(Path(path).read_text()))
+
+
+@dataclass
+class BulkReport:
+    """What collected batches produced, what they cost and how long they took."""
+
+    notified: int = 0
+    duplicates: int = 0
+    failed: int = 0
+    input_tokens: int = 0
+    cached_tokens: int = 0
+    output_tokens: int = 0
+    first_submitted: Optional[float] = None
+    last_finished: Optional[float] = None
+
+    def add_usage(self, agent_name: str, usage: dict[str, Any] | None) -> None:
+        usage = usage or {}
+        input_tokens = usage.get("input_tokens") or 0
+        cached = (usage.get("input_tokens_details") or {}).get("cached_tokens") or 0
+        output_tokens = usage.get("output_tokens") or 0
+        self.input_tokens += input_tokens
+        self.cached_tokens += cached
+        self.output_tokens += output_tokens
+        label = f"{agent_name} (batch)"
+        MODEL_TOKENS.labels(label, "input").inc(input_tokens)
+        MODEL_TOKENS.labels(label, "cached").inc(cached)
+        MODEL_TOKENS.labels(label, "output").inc(output_tokens)
+
+    def add_batch(self, submitted_at: float, finished_at: float) -> None:
+        if self.first_submitted is None or submitted_at < self.first_submitted:
+            self.first_submitted = submitted_at
+        if self.last_finished is None or finished_at > self.last_finished:
+            self.last_finished = finished_at
+
+    def cost(self, factor: float = 1.0) -> Optional[float]:
+        """USD for the tokens used, at `factor` times the list price of MODEL."""
+        prices = PRICES.get(MODEL)
+        if prices is None:
+            return None
+        input_price, cached_price, output_price = prices
+        uncached = self.input_tokens - self.cached_tokens
+        total = (
+            uncached * input_price
+            + self.cached_tokens * cached_price
+            + self.output_tokens * output_price
+        )
+        return factor * total / 1e6
+
+    def lines(self, streaming_seconds: List[float], concurrency: int) -> List[str]:
+        """Summary, with cost and throughput next to the streaming path."""
+        done = self.notified + self.duplicates
+        lines = [
+            f"{self.notified} notified, {self.duplicates} duplicates, "
+            f"{self.failed} failed; input {self.input_tokens} tok "
+            f"({self.cached_tokens} cached), output {self.output_tokens} tok"
+        ]
+        batch, listed = self.cost(BATCH_PRICE_FACTOR), self.cost()
+        if batch is not None and listed is not None and done:
+            lines.append(
+                f"cost ${batch:.4f} (${batch / done:.5f}/invoice) vs "
+                f"${listed:.4f} for the same tokens streamed; "
+                f"saved ${listed - batch:.4f}"
+            )
+        if self.first_submitted is not None and self.last_finished is not None:
+            elapsed = max(self.last_finished - self.first_submitted, 1.0)
+            lines.append(
+                f"throughput {done * 3600 / elapsed:.0f} invoices/h "
+                f"({done} in {elapsed / 60:.1f} min from submit to results)"
+            )
+        if streaming_seconds:
+            mean = sum(streaming_seconds) / len(streaming_seconds)
+            lines.append(
+                f"streaming: {mean:.1f}s per extraction, about "
+                f"{concurrency * 3600 / mean:.0f} invoices/h at concurrency "
+                f"{concurrency} (last {len(streaming_seconds)} jobs)"
+            )
+        return lines
+
+
+# --- Runner ------------------------------------------------------------------
+
+
+class BulkRunner:
+    """Packs prepared emails into batch input files and ingests the results."""
+
+    def __init__(
+        self,
+        store: JobStore,
+        backend: Any,
+        *,
+        bulk_dir: str | Path = "outputs/bulk",
+        sink: OutputSink | None = None,
+        dedup: DedupIndex | None = None,
+        max_requests: int = MAX_REQUESTS,
+        max_bytes: int = MAX_FILE_BYTES,
+    ):
+        self.store = store
+        self.backend = backend
+        self.bulk_dir = Path(bulk_dir)
+        self.sink = sink or get_sink()
+        self.dedup = dedup
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.submitted: List[BatchManifest] = []
+        self.report = BulkReport()
+        # The input file being filled and the jobs in it.
+        self._file: Optional[BinaryIO] = None
+        self._path: Optional[Path] = None
+        self._requests = 0
+        self._bytes = 0
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+
+    # --- Submitting ----------------------------------------------------------
+
+    async def add(self, job: Job, prepared: PreparedEmail) -> None:
+        """Write the requests of a prepared (extracting) job.
+
+        The current input file is submitted first if the job would push it
+        over the Batch API limits; a job's requests never span files.
+        """
+        lines = [
+            json.dumps(request, separators=(",", ":")).encode() + b"\n"
+            for request in request_lines(job.job_id, prepared)
+        ]
+        size = sum(len(line) for line in lines)
+        if self._file is not None and (
+            self._requests + len(lines) > self.max_requests
+            or self._bytes + size > self.max_bytes
+        ):
+            await self.flush()
+        if self._file is None:
+            self._open()
+        assert self._file is not None
+        self._file.write(b"".join(lines))
+        self._requests += len(lines)
+        self._bytes += size
+        fp = prepared.fingerprint
+        self._jobs[job.job_id] = {
+            "email_path": job.email_path,
+            "sender": sender_address(prepared.email),
+            "fingerprint": asdict(fp) if fp is not None else None,
+        }
+
+    def _open(self) -> None:
+        directory = self.bulk_dir / "requests"
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self._path = directory / f"requests-{stamp}-{uuid.uuid4().hex[:8]}.jsonl"
+        self._file = open(self._path, "wb")
+        self._requests = 0
+        self._bytes = 0
+        self._jobs = {}
+
+    async def flush(self) -> Optional[BatchManifest]:
+        """Submit the current input file as a batch and park its jobs."""
+        if self._file is None or self._path is None:
+            return None
+        self._file.close()
+        self._file = None
+        path, jobs = self._path, self._jobs
+        self._jobs = {}
+
+        manifest = BatchManifest(
+            batch_id=None,
+            backend=self.backend.name,
+            input_file=str(path),
+            model=str(MODEL),
+            submitted_at=time.time(),
+            requests=self._requests,
+            bytes=self._bytes,
+            jobs=jobs,
+        )
+        # Recorded before the upload, so a crash cannot requeue billed jobs.
+        manifest.save(self.bulk_dir)
+        for job_id in jobs:
+            self.store.defer(job_id)
+
+        try:
+            manifest.batch_id = await asyncio.to_thread(
+                self.backend.submit, path, manifest.name
+            )
+        except Exception as e:
+            # The batch may exist even if creating it timed out.
+            manifest.batch_id = await self._find(manifest)
+            if manifest.batch_id is None:
+                self._abandon(manifest, e)
+                c.error(f"Could not submit {path.name} ({len(jobs)} emails): {e}")
+                return None
+
+        manifest.status = "submitted"
+        manifest.save(self.bulk_dir)
+        self.submitted.append(manifest)
+        c.ok(
+            f"Submitted batch {manifest.batch_id}: {len(jobs)} emails, "
+            f"{manifest.requests} requests, {manifest.bytes / 2**20:.1f} MiB"
+        )
+        return manifest
+
+    async def _find(self, manifest: BatchManifest) -> Optional[str]:
+        try:
+            return await asyncio.to_thread(
+                self.backend.find, manifest.name, manifest.submitted_at
+            )
+        except Exception as e:
+            c.error(f"Could not look up batch {manifest.name}: {e}")
+            return None
+
+    def _abandon(self, manifest: BatchManifest, e: BaseException) -> None:
+        """Send the jobs of a batch that was never created back to retry."""
+        for job_id in manifest.jobs:
+            job = self.store.get(job_id)
+            if job is not None and job.state == JobState.SUBMITTED:
+                self.store.fail(job_id, f"{type(e).__name__}: {e}")
+                FAILURES.labels("submit").inc()
+        manifest.status = "failed"
+        manifest.collected_at = time.time()
+        manifest.save(self.bulk_dir)
+
+    def skip_duplicate(self, job: Job, prepared: PreparedEmail) -> bool:
+        """Complete a job whose PDF was extracted before; True if it was."""
+        if self.dedup is None or prepared.fingerprint is None:
+            return False
+        match = self.dedup.match(prepared.fingerprint)
+        if match is None or not match.conclusive:
+            return False
+        self._complete_duplicate(job, match)
+        return True
+
+    def _complete_duplicate(self, job: Job, match: DuplicateMatch) -> None:
+        original = match.original
+        result = {
+            **(original.result or {}),
+            "duplicate_of": original.job_id,
+            "duplicate": match.kind,
+        }
+        self.store.complete(job.job_id, result)
+        INVOICES.labels("duplicate").inc()
+        DUPLICATES.labels(match.kind).inc()
+        c.ok(
+            f"{Path(job.email_path).name}: duplicate ({match.kind}) of "
+            f"invoice {original.invoice_number or '?'} (job {original.job_id}), "
+            "not notified again"
+        )
+
+    # --- Collecting ----------------------------------------------------------
+
+    def pending(self) -> List[BatchManifest]:
+        """Batches of this backend whose results have not been collected."""
+        manifests = (
+            BatchManifest.load(path)
+            for path in sorted((self.bulk_dir / "batches").glob("*.json"))
+        )
+        return [
+            m
+            for m in manifests
+            if m.collected_at is None and m.backend == self.backend.name
+        ]
+
+    async def collect(self) -> int:
+        """Ingest every finished batch; returns how many are still running."""
+        running = 0
+        for manifest in self.pending():
+            if manifest.batch_id is None and not await self._resume_upload(manifest):
+                running += 1
+                continue
+            if manifest.batch_id is None:
+                continue
+            status = await asyncio.to_thread(self.backend.status, manifest.batch_id)
+            if status.status not in FINAL_STATES:
+                running += 1
+                continue
+            await self._ingest(manifest, status)
+        self.sink.flush()
+        return running
+
+    async def _resume_upload(self, manifest: BatchManifest) -> bool:
+        """Settle an upload whose process died; False while it may still run."""
+        if time.time() - manifest.submitted_at < UPLOAD_GRACE:
+            return False
+        manifest.batch_id = await self._find(manifest)
+        if manifest.batch_id is None:
+            self._abandon(manifest, BulkError("Batch upload was interrupted"))
+            c.error(f"Upload of {manifest.name} was interrupted; jobs requeued.")
+        else:
+            manifest.status = "submitted"
+            manifest.save(self.bulk_dir)
+        return True
+
+    async def _results(self, status: BatchStatus) -> Dict[str, dict[str, Any]]:
+        """Result lines of a finished batch by custom ID."""
+        results = {}
+        for file_id in (status.output_file_id, status.error_file_id):
+            if not file_id:
+                continue
+            data = await asyncio.to_thread(self.backend.download, file_id)
+            for line in data.splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    results[record["custom_id"]] = record
+        return results
+
+    async def _ingest(self, manifest: BatchManifest, status: BatchStatus) -> None:
+        results = await self._results(status)
+        finished = status.finished_at or time.time()
+        self.report.add_batch(manifest.submitted_at, finished)
+
+        for job_id, info in manifest.jobs.items():
+            job = self.store.get(job_id)
+            if job is None or job.state != JobState.SUBMITTED:
+                continue  # requeued and processed another way meanwhile
+            try:
+                invoice = self._invoice(job_id, results, status.status)
+            except (BulkError, ValidationError) as e:
+                self._fail(job, e)
+                continue
+            self.store.advance(
+                job_id,
+                JobState.NOTIFY,
+                timings={"batch": finished - manifest.submitted_at},
+            )
+            try:
+                self._notify(job, info, invoice)
+            except Exception as e:
+                self._fail(job, e)
+
+        manifest.status = status.status
+        manifest.collected_at = time.time()
+        manifest.save(self.bulk_dir)
+        c.sysmsg(
+            f"Collected batch {manifest.batch_id} ({status.status}): "
+            f"{len(manifest.jobs)} emails."
+        )
+
+    def _invoice(
+        self, job_id: str, results: Dict[str, dict[str, Any]], batch_status: str
+    ) -> Invoice:
+        """Validated invoice of a job from its batch results."""
+        bodies = []
+        for kind, agent in (
+            ("guardrail", build_guardrail_agent()),
+            ("invoice", build_invoice_agent()),
+        ):
+            record = results.get(f"{job_id}:{kind}")
+            if record is None:
+                raise BulkError(f"No {agent.name} result (batch {batch_status})")
+            body = _result_body(record)
+            self.report.add_usage(agent.name, body.get("usage"))
+            bodies.append(body)
+        guardrail, extraction = bodies
+
+        verdict = GuardrailOutput.model_validate_json(_output_text(guardrail))
+        GUARDRAIL_CHECKS.labels("passed" if verdict.is_safe else "tripped").inc()
+        if not verdict.is_safe:
+            raise BulkError(f"Guardrail tripped: {verdict.reasoning}")
+
+        invoice = Invoice.model_validate_json(_output_text(extraction))
+        if not invoice.invoice_number or not invoice.invoice_number.strip():
+            raise BulkError("Invoice number is required, but was not extracted.")
+        return invoice
+
+    def _notify(self, job: Job, info: Dict[str, Any], invoice: Invoice) -> None:
+        if self.dedup is not None:
+            match = self.dedup.find_invoice(invoice.vendor_name, invoice.invoice_number)
+            if match is not None:
+                self._complete_duplicate(job, match)
+                self.report.duplicates += 1
+                return
+
+        result = self.sink.write(notification_name(invoice), compose_email(invoice))
+        fp = info.get("fingerprint")
+        if self.dedup is not None and fp is not None:
+            self.dedup.add(
+                _fingerprint(fp),
+                job_id=job.job_id,
+                vendor_name=invoice.vendor_name,
+                invoice_number=invoice.invoice_number,
+                result=result,
+            )
+        self.store.complete(job.job_id, result)
+        INVOICES.labels("notified").inc()
+        self.report.notified += 1
+        terms = invoice_terms_days(
+            invoice.payment_terms, invoice.invoice_date, invoice.invoice_due_date
+        )
+        if info.get("sender") and terms is not None:
+            self.store.remember_terms(info["sender"], terms)
+        c.ok(f"{Path(job.email_path).name}: {result['outbound_email_json']}")
+
+    def _fail(self, job: Job, e: BaseException) -> None:
+        failed = self.store.fail(job.job_id, f"{type(e).__name__}: {e}")
+        FAILURES.labels("batch").inc()
+        self.report.failed += 1
+        c.error(
+            f"{Path(job.email_path).name}: attempt {failed.attempts} "
+            f"failed in batch: {e}"
+        )
+
+
+def _fingerprint(data: Dict[str, Any]) -> Fingerprint:
+    minhash = data.get("minhash")
+    return Fingerprint(**{**data, "minhash": tuple(minhash) if minhash else None})
+
+
+def _claim_ready(store: JobStore, limit: int | None) -> Iterator[Job]:
+    """Claim ready jobs one at a time, up to `limit`."""
+    claimed = 0
+    while limit is None or claimed < limit:
+        jobs = store.ready(limit=64)
+        if not jobs:
+            return
+        for job in jobs:
+            if store.claim(job.job_id):
+                claimed += 1
+                yield job
+                if limit is not None and claimed >= limit:
+                    return
+
+
+# --- Entry points ------------------------------------------------------------
+
+
+async def submit_inbox(
+    inbox: str | Path,
+    backend: Any,
+    *,
+    db_path: str | Path = "outputs/jobs.sqlite3",
+    bulk_dir: str | Path = "outputs/bulk",
+    cpu_workers: int | None = None,
+    max_attempts: int = 3,
+    dedup_db: str | Path | None = "outputs/dedup.sqlite3",
+    limit: int | None = None,
+) -> List[BatchManifest]:
+    """Prepare the ready emails of `inbox` and submit them as batches.
+
+    Uses the same job store as `run_batch`: finished jobs are skipped and
+    failures are retried. Duplicates of already extracted PDFs are completed
+    without being submitted. `limit` caps how many emails are submitted.
+    Returns the manifests of the submitted batches.
+    """
+
+    inbox = Path(inbox).expanduser().resolve()
+    if not inbox.is_dir():
+        raise NotADirectoryError(f"Inbox directory not found: {inbox}")
+    cpu_workers = cpu_workers or os.cpu_count() or 1
+
+    with (
+        JobStore(db_path, max_attempts=max_attempts) as store,
+        DedupIndex(dedup_db) if dedup_db else nullcontext() as dedup,
+    ):
+        requeued = store.recover()
+        for path in sorted(inbox.glob("*.json")):
+            store.enqueue(path)
+        counts = store.counts()
+        c.sysmsg(
+            f"Bulk: {sum(counts.values())} jobs, "
+            f"{counts.get(str(JobState.DONE), 0)} done, "
+            f"{counts.get(str(JobState.SUBMITTED), 0)} already in batches, "
+            f"{requeued} resumed after interruption."
+        )
+
+        runner = BulkRunner(store, backend, bulk_dir=bulk_dir, dedup=dedup)
+        prepare = partial(
+            prepare_email, dedup=dedup is not None, artifacts=get_artifact_store()
+        )
+        loop = asyncio.get_running_loop()
+        jobs = _claim_ready(store, limit)
+        inflight: Dict[asyncio.Future, Job] = {}
+
+        with ProcessPoolExecutor(max_workers=cpu_workers) as pool:
+            while True:
+                # Keep the pool busy while finished emails are written out.
+                while len(inflight) < 2 * cpu_workers:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    future = loop.run_in_executor(pool, prepare, job.email_path)
+                    inflight[future] = job
+                if not inflight:
+                    break
+                finished, _ = await asyncio.wait(
+                    inflight, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in finished:
+                    job = inflight.pop(future)
+                    try:
+                        prepared = future.result()
+                    except Exception as e:
+                        failed = store.fail(job.job_id, f"{type(e).__name__}: {e}")
+                        FAILURES.labels("prepare").inc()
+                        c.error(
+                            f"{Path(job.email_path).name}: attempt "
+                            f"{failed.attempts} failed in prepare: {e}"
+                        )
+                        continue
+                    store.advance(
+                        job.job_id, JobState.EXTRACT, timings=prepared.timings
+                    )
+                    RENDER_CACHE.labels(
+                        "hit" if prepared.render_cached else "miss"
+                    ).inc()
+                    if not runner.skip_duplicate(job, prepared):
+                        await runner.add(job, prepared)
+        await runner.flush()
+
+        emails = sum(len(m.jobs) for m in runner.submitted)
+        c.sysmsg(
+            f"Submitted {emails} emails in {len(runner.submitted)} batches; "
+            "collect the results with --bulk-collect."
+        )
+        return runner.submitted
+
+
+async def collect_batches(
+    backend: Any,
+    *,
+    db_path: str | Path = "outputs/jobs.sqlite3",
+    bulk_dir: str | Path = "outputs/bulk",
+    max_attempts: int = 3,
+    dedup_db: str | Path | None = "outputs/dedup.sqlite3",
+    wait: bool = False,
+    poll_interval: float = 60.0,
+    concurrency: int = 4,
+) -> BulkReport:
+    """Ingest the results of finished batches and notify for each invoice.
+
+    With `wait`, polls every `poll_interval` seconds until no batch is still
+    running. Logs cost and throughput next to the streaming path's, using
+    its recent extract timings at `concurrency` model calls.
+    """
+
+    with (
+        JobStore(db_path, max_attempts=max_attempts) as store,
+        DedupIndex(dedup_db) if dedup_db else nullcontext() as dedup,
+    ):
+        runner = BulkRunner(store, backend, bulk_dir=bulk_dir, dedup=dedup)
+        while True:
+            running = await runner.collect()
+            if not running or not wait:
+                break
+            c.sysmsg(
+                f"{running} batches still running; checking again in "
+                f"{poll_interval:g}s."
+            )
+            await asyncio.sleep(poll_interval)
+
+        if running:
+            c.sysmsg(f"{running} batches still running.")
+        for line in runner.report.lines(store.stage_seconds("extract"), concurrency):
+            c.dim("BULK", line)
+        return runner.report
@@ -0,0 +1,406 @@
+"""Persistent duplicate-invoice index.
+
+The same invoice often arrives several times (reminders, forwards, CC'd
+copies). Before any model call, an email's PDF is looked up in two layers:
+
+- exact: SHA-256 of the attachment bytes;
+- near-duplicate: MinHash of word shingles of the normalized PDF text,
+  confirmed by a dHash (perceptual hash) of the rendered first page and by
+  the numbers on the invoice, which must be identical. Different invoices
+  from one vendor template share most of their text but not their numbers.
+
+A first-page dHash alone (scanned PDFs without text) is too coarse to tell
+invoices on the same template apart, so such matches are only reported.
+After extraction, (vendor_name, invoice_number) collisions catch the
+duplicates that the document layers miss.
+
+Both near-duplicate signals are indexed with locality-sensitive hashing:
+each signature is cut into bands stored in `(band, bucket)`-keyed SQLite
+tables, so a lookup is a handful of B-tree seeks regardless of index size.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import struct
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+# MinHash: NUM_PERM permutations, LSH with TEXT_BANDS bands of TEXT_ROWS rows.
+# 8 x 8 puts the LSH threshold at a Jaccard similarity of about 0.77.
+NUM_PERM = 64
+TEXT_BANDS = 8
+TEXT_ROWS = NUM_PERM // TEXT_BANDS
+SHINGLE_WORDS = 3
+
+# dHash: 64 bits in 4 bands of 16. Two hashes within 3 bits of each other
+# share at least one band (pigeonhole), so MAX_HAMMING <= 3 is exhaustive.
+IMAGE_BANDS = 4
+MAX_HAMMING = 3
+
+_MERSENNE = (1 << 61) - 1
+_rng = random.Random(0x1DE5)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE), _rng.randrange(0, _MERSENNE))
+    for _ in range(NUM_PERM)
+]
+_MINHASH = struct.Struct(f">{NUM_PERM}I")
+_WORD = re.compile(r"[^\W_]+")
+
+
+@dataclass
+class Fingerprint:
+    """Content signatures of one invoice PDF (picklable)."""
+
+    sha256: str
+    dhash: Optional[int] = None
+    minhash: Optional[Tuple[int, ...]] = None
+    numbers: Optional[str] = None
+
+
+@dataclass
+class IndexedInvoice:
+    """An invoice already processed, as stored in the index."""
+
+    doc_id: int
+    job_id: str
+    sha256: str
+    vendor_name: Optional[str]
+    invoice_number: Optional[str]
+    result: Optional[dict[str, Any]]
+    created_at: float
+
+
+@dataclass
+class DuplicateMatch:
+    """Why an email is considered a duplicate of `original`.
+
+    `kind` is "exact", "near", "visual" (first page only; advisory) or
+    "invoice_number" (same vendor and invoice number after extraction).
+    """
+
+    kind: str
+    original: IndexedInvoice
+    similarity: float = 1.0
+    hamming: Optional[int] = None
+
+    @property
+    def conclusive(self) -> bool:
+        return self.kind != "visual"
+
+
+# --- Signatures --------------------------------------------------------------
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def _signed(value: int) -> int:
+    """Unsigned 64-bit -> SQLite INTEGER."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def normalize_words(text: str) -> List[str]:
+    """Case-folded alphanumeric words; layout, punctuation and spacing drop out."""
+    return _WORD.findall(text.casefold())
+
+
+def minhash(words: List[str]) -> Optional[Tuple[int, ...]]:
+    """MinHash signature of the word shingles (None for empty text)."""
+    if not words:
+        return None
+    k = min(SHINGLE_WORDS, len(words))
+    shingles = {
+        _hash64(" ".join(words[i : i + k]).encode()) for i in range(len(words) - k + 1)
+    }
+    return tuple(
+        min((a * x + b) % _MERSENNE for x in shingles) & 0xFFFFFFFF
+        for a, b in _PERMUTATIONS
+    )
+
+
+def numbers_key(words: List[str]) -> str:
+    """Digest of every number on the invoice (amounts, dates, references)."""
+    numbers = sorted(w for w in words if any(ch.isdigit() for ch in w))
+    return hashlib.sha256("\n".join(numbers).encode()).hexdigest()[:32]
+
+
+def dhash(image_path: str | Path) -> int:
+    """64-bit difference hash of an image (horizontal gradient of a 9x8 thumbnail)."""
+    from PIL import Image
+
+    with Image.open(image_path) as image:
+        pixels = image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def fingerprint(
+    pdf_path: str | Path, pdf_text: str, first_page: str | Path | None = None
+) -> Fingerprint:
+    """Signatures of a prepared invoice PDF."""
+    words = normalize_words(pdf_text or "")
+    page_hash = None
+    if first_page is not None:
+        try:
+            page_hash = dhash(first_page)
+        except OSError:
+            page_hash = None  # unreadable render: no visual signal
+    return Fingerprint(
+        sha256=hashlib.sha256(Path(pdf_path).read_bytes()).hexdigest(),
+        dhash=page_hash,
+        minhash=minhash(words),
+        numbers=numbers_key(words) if words else None,
+    )
+
+
+def _text_buckets(signature: Tuple[int, ...]) -> List[Tuple[int, int]]:
+    packed = _MINHASH.pack(*signature)
+    size = TEXT_ROWS * 4
+    return [
+        (band, _signed(_hash64(packed[band * size : (band + 1) * size])))
+        for band in range(TEXT_BANDS)
+    ]
+
+
+def _image_buckets(value: int) -> List[Tuple[int, int]]:
+    width = 64 // IMAGE_BANDS
+    mask = (1 << width) - 1
+    return [(band, (value >> (band * width)) & mask) for band in range(IMAGE_BANDS)]
+
+
+def _hamming(a: int, stored: int) -> int:
+    """Bit distance between a dHash and one read back from SQLite."""
+    return bin(a ^ (stored & 0xFFFFFFFFFFFFFFFF)).count("1")
+
+
+def _similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def _invoice_key(value: Optional[str]) -> Optional[str]:
+    key = "".join(normalize_words(value or ""))
+    return key or None
+
+
+# --- Index -------------------------------------------------------------------
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id         INTEGER PRIMARY KEY,
+    job_id         TEXT NOT NULL,
+    sha256         TEXT NOT NULL UNIQUE,
+    dhash          INTEGER,
+    minhash        BLOB,
+    numbers        TEXT,
+    vendor_name    TEXT,
+    invoice_number TEXT,
+    vendor_key     TEXT,
+    invoice_key    TEXT,
+    result         TEXT,
+    created_at     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_invoice
+    ON documents(invoice_key, vendor_key);
+
+CREATE TABLE IF NOT EXISTS text_lsh (
+    band   INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL,
+    PRIMARY KEY (band, bucket, doc_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS image_lsh (
+    band   INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL,
+    PRIMARY KEY (band, bucket, doc_id)
+) WITHOUT ROWID;
+"""
+
+
+class DedupIndex:
+    """SQLite index of processed invoices for duplicate detection."""
+
+    def __init__(
+        self,
+        path: str | Path = "outputs/dedup.sqlite3",
+        *,
+        text_threshold: float = 0.9,
+        max_hamming: int = MAX_HAMMING,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.text_threshold = text_threshold
+        self.max_hamming = max_hamming
+
+        self._db = sqlite3.connect(self.path, isolation_level=None, timeout=30.0)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "DedupIndex":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    # --- Lookups -------------------------------------------------------------
+
+    def _entry(self, row: sqlite3.Row) -> IndexedInvoice:
+        return IndexedInvoice(
+            doc_id=row["doc_id"],
+            job_id=row["job_id"],
+            sha256=row["sha256"],
+            vendor_name=row["vendor_name"],
+            invoice_number=row["invoice_number"],
+            result=json.loads(row["result"]) if row["result"] else None,
+            created_at=row["created_at"],
+        )
+
+    def _candidates(
+        self, table: str, buckets: List[Tuple[int, int]]
+    ) -> List[sqlite3.Row]:
+        doc_ids: set[int] = set()
+        for band, bucket in buckets:
+            doc_ids.update(
+                r[0]
+                for r in self._db.execute(
+                    f"SELECT doc_id FROM {table} WHERE band = ? AND bucket = ?",
+                    (band, bucket),
+                )
+            )
+        return [
+            self._db.execute(
+                "SELECT * FROM documents WHERE doc_id = ?", (i,)
+            ).fetchone()
+            for i in sorted(doc_ids)
+        ]
+
+    def match(self, fp: Fingerprint) -> Optional[DuplicateMatch]:
+        """Best match for a document that has not been extracted yet."""
+        row = self._db.execute(
+            "SELECT * FROM documents WHERE sha256 = ?", (fp.sha256,)
+        ).fetchone()
+        if row is not None:
+            return DuplicateMatch("exact", self._entry(row))
+
+        best: Optional[DuplicateMatch] = None
+        if fp.minhash is not None:
+            for row in self._candidates("text_lsh", _text_buckets(fp.minhash)):
+                if row["numbers"] != fp.numbers or row["minhash"] is None:
+                    continue
+                similarity = _similarity(fp.minhash, _MINHASH.unpack(row["minhash"]))
+                hamming = None
+                if fp.dhash is not None and row["dhash"] is not None:
+                    hamming = _hamming(fp.dhash, row["dhash"])
+                    if hamming > self.max_hamming:
+                        continue
+                if similarity >= self.text_threshold and (
+                    best is None or similarity > best.similarity
+                ):
+                    best = DuplicateMatch("near", self._entry(row), similarity, hamming)
+            return best
+
+        if fp.dhash is not None:
+            scored = [
+                (_hamming(fp.dhash, row["dhash"]), row)
+                for row in self._candidates("image_lsh", _image_buckets(fp.dhash))
+                if row["dhash"] is not None
+            ]
+            if scored:
+                hamming, row = min(scored, key=lambda hr: hr[0])
+                if hamming <= self.max_hamming:
+                    best = DuplicateMatch(
+                        "visual", self._entry(row), 1 - hamming / 64, hamming
+                    )
+        return best
+
+    def find_invoice(
+        self, vendor_name: Optional[str], invoice_number: Optional[str]
+    ) -> Optional[DuplicateMatch]:
+        """Earlier invoice with the same vendor and invoice number, if any."""
+        invoice_key = _invoice_key(invoice_number)
+        if invoice_key is None:
+            return None
+        row = self._db.execute(
+            "SELECT * FROM documents WHERE invoice_key = ? AND vendor_key IS ? "
+            "ORDER BY doc_id LIMIT 1",
+            (invoice_key, _invoice_key(vendor_name)),
+        ).fetchone()
+        return DuplicateMatch("invoice_number", self._entry(row)) if row else None
+
+    # --- Updates -------------------------------------------------------------
+
+    def add(
+        self,
+        fp: Fingerprint,
+        *,
+        job_id: str,
+        vendor_name: Optional[str] = None,
+        invoice_number: Optional[str] = None,
+        result: Optional[dict[str, Any]] = None,
+    ) -> bool:
+        """Index a processed invoice. Returns False if its PDF is already known."""
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            cur = self._db.execute(
+                "INSERT OR IGNORE INTO documents (job_id, sha256, dhash, minhash, "
+                "numbers, vendor_name, invoice_number, vendor_key, invoice_key, "
+                "result, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    fp.sha256,
+                    _signed(fp.dhash) if fp.dhash is not None else None,
+                    _MINHASH.pack(*fp.minhash) if fp.minhash is not None else None,
+                    fp.numbers,
+                    vendor_name,
+                    invoice_number,
+                    _invoice_key(vendor_name),
+                    _invoice_key(invoice_number),
+                    json.dumps(result) if result is not None else None,
+                    time.time(),
+                ),
+            )
+            if cur.rowcount != 1:
+                return False
+            doc_id = cur.lastrowid
+            if fp.minhash is not None:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO text_lsh (band, bucket, doc_id) "
+                    "VALUES (?, ?, ?)",
+                    [
+                        (band, bucket, doc_id)
+                        for band, bucket in _text_buckets(fp.minhash)
+                    ],
+                )
+            if fp.dhash is not None:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO image_lsh (band, bucket, doc_id) "
+                    "VALUES (?, ?, ?)",
+                    [
+                        (band, bucket, doc_id)
+                        for band, bucket in _image_buckets(fp.dhash)
+                    ],
+                )
+        return True
+
+    def count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
@@ -0,0 +1,563 @@
+"""Persistent SQLite job store for batch invoice intake.
+
+Each inbound email is a job that moves through the intake stages
+(load -> text -> raster -> extract -> notify -> done/failed); jobs sent to
+an offline batch wait in `submitted` between extract and notify. Every
+transition is committed, so a batch that dies part-way can be restarted
+and will skip finished work, resume interrupted jobs and retry failures
+with exponential backoff instead of paying for every model call again.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+
+class JobState(str, Enum):
+    """Lifecycle states for a job."""
+
+    PENDING = "pending"
+    LOAD = "load"
+    TEXT = "text"
+    RASTER = "raster"
+    EXTRACT = "extract"
+    NOTIFY = "notify"
+    # Waiting on an offline batch (see `bulk`); not reclaimed by `recover()`.
+    SUBMITTED = "submitted"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __str__(self) -> str:
+        return self.value
+
+
+# Minimum seconds between two heartbeats of a worker in the `owners` table.
+HEARTBEAT_INTERVAL = 30.0
+
+# States in which a worker is actively processing the job.
+ACTIVE_STATES = (
+    JobState.LOAD,
+    JobState.TEXT,
+    JobState.RASTER,
+    JobState.EXTRACT,
+    JobState.NOTIFY,
+)
+
+
+class JobStoreError(RuntimeError):
+    """Error reading or updating the job store."""
+
+
+@dataclass
+class Job:
+    """A single row of the job store."""
+
+    job_id: str
+    email_path: str
+    state: JobState
+    attempts: int
+    last_error: Optional[str]
+    result: Optional[dict[str, Any]]
+    created_at: float
+    updated_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    next_attempt_at: float
+    owner: Optional[str]
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        return cls(
+            job_id=row["job_id"],
+            email_path=row["email_path"],
+            state=JobState(row["state"]),
+            attempts=row["attempts"],
+            last_error=row["last_error"],
+            result=json.loads(row["result"]) if row["result"] else None,
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+            started_at=row["started_at"],
+            finished_at=row["finished_at"],
+            next_attempt_at=row["next_attempt_at"],
+            owner=row["owner"],
+        )
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id          TEXT PRIMARY KEY,
+    email_path      TEXT NOT NULL,
+    state           TEXT NOT NULL,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    last_error      TEXT,
+    result          TEXT,
+    created_at      REAL NOT NULL,
+    updated_at      REAL NOT NULL,
+    started_at      REAL,
+    finished_at     REAL,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    owner           TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state_updated ON jobs(state, updated_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_state_next ON jobs(state, next_attempt_at);
+
+CREATE TABLE IF NOT EXISTS job_timings (
+    job_id  TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    stage   TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (job_id, attempt, stage)
+);
+
+CREATE TABLE IF NOT EXISTS owners (
+    owner        TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sender_terms (
+    sender     TEXT PRIMARY KEY,
+    terms_days INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def job_key(path: str | Path) -> str:
+    """Stable job ID for an email file (hash of its content).
+
+    Keying on content rather than path makes enqueueing idempotent: the
+    same email copied or re-dropped under another name is one job.
+    """
+    digest = hashlib.sha256(Path(path).read_bytes()).hexdigest()
+    return digest[:32]
+
+
+def _owner_id() -> str:
+    # The nonce tells a restarted worker from its predecessor when the PID is
+    # reused (e.g. PID 1 in a container with a stable hostname).
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _owner_process(owner: str) -> tuple[str, Optional[int]]:
+    """(host, pid) of an owner ID (also reads the older `host:pid` form)."""
+    host, _, rest = owner.partition(":")
+    pid = rest.partition(":")[0]
+    return host, int(pid) if pid.isdigit() else None
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """SQLite-backed store of intake jobs.
+
+    Safe to share between coroutines of one process; every public method
+    runs a single short transaction.
+    """
+
+    def __init__(
+        self,
+        path: str | Path = "outputs/jobs.sqlite3",
+        *,
+        max_attempts: int = 3,
+        backoff_base: float = 30.0,
+        backoff_max: float = 3600.0,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.owner = _owner_id()
+        self._heartbeat_at = 0.0
+
+        self._db = sqlite3.connect(self.path, isolation_level=None, timeout=30.0)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    # --- Lifecycle -----------------------------------------------------------
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "JobStore":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    # --- Queueing ------------------------------------------------------------
+
+    def enqueue(self, email_path: str | Path) -> Job:
+        """Add an email to the store (no-op if its content is already known)."""
+        email_path = Path(email_path).expanduser().resolve()
+        job_id = job_key(email_path)
+        now = time.time()
+        self._db.execute(
+            "INSERT OR IGNORE INTO jobs "
+            "(job_id, email_path, state, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (job_id, str(email_path), str(JobState.PENDING), now, now),
+        )
+        job = self.get(job_id)
+        assert job is not None
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        row = self._db.execute(
+            "SELECT * FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return Job.from_row(row) if row else None
+
+    def ready(self, *, limit: int = 100, now: float | None = None) -> List[Job]:
+        """Jobs that may be claimed now: pending, or failed and due a retry.
+
+        Pending jobs postponed with `postpone()` are left out until due.
+        """
+        now = time.time() if now is None else now
+        rows = self._db.execute(
+            "SELECT * FROM jobs WHERE state = ? AND next_attempt_at <= ? "
+            "UNION ALL "
+            "SELECT * FROM jobs WHERE state = ? AND attempts < ? "
+            "AND next_attempt_at <= ? "
+            "ORDER BY created_at LIMIT ?",
+            (
+                str(JobState.PENDING),
+                now,
+                str(JobState.FAILED),
+                self.max_attempts,
+                now,
+                limit,
+            ),
+        ).fetchall()
+        return [Job.from_row(r) for r in rows]
+
+    def next_retry_at(self) -> Optional[float]:
+        """Earliest time a backed-off or postponed job becomes ready (None if none)."""
+        row = self._db.execute(
+            "SELECT MIN(next_attempt_at) FROM jobs "
+            "WHERE state = ? OR (state = ? AND attempts < ?)",
+            (str(JobState.PENDING), str(JobState.FAILED), self.max_attempts),
+        ).fetchone()
+        return row[0]
+
+    def claim(self, job_id: str) -> bool:
+        """Atomically move a ready job into the first active stage.
+
+        Returns False if another worker claimed it first or it is not ready.
+        """
+        now = time.time()
+        self.heartbeat(now)
+        cur = self._db.execute(
+            "UPDATE jobs SET state = ?, attempts = attempts + 1, owner = ?, "
+            "started_at = ?, updated_at = ?, finished_at = NULL "
+            "WHERE job_id = ? AND next_attempt_at <= ? AND (state = ? OR "
+            "(state = ? AND attempts < ?))",
+            (
+                str(JobState.LOAD),
+                self.owner,
+                now,
+                now,
+                job_id,
+                now,
+                str(JobState.PENDING),
+                str(JobState.FAILED),
+                self.max_attempts,
+            ),
+        )
+        return cur.rowcount == 1
+
+    def postpone(self, job_id: str, until: float) -> None:
+        """Keep a ready job out of `ready()` until `until` (no attempt used).
+
+        For jobs another worker is processing, e.g. leased by another node.
+        """
+        self._db.execute(
+            "UPDATE jobs SET next_attempt_at = ? WHERE job_id = ? AND state IN (?, ?)",
+            (until, job_id, str(JobState.PENDING), str(JobState.FAILED)),
+        )
+
+    def adopt_failure(
+        self, job_id: str, *, attempts: int, next_attempt_at: float, error: str | None
+    ) -> None:
+        """Take over attempts and backoff of a job that failed elsewhere."""
+        now = time.time()
+        self._db.execute(
+            "UPDATE jobs SET state = ?, attempts = MAX(attempts, ?), last_error = ?, "
+            "next_attempt_at = ?, updated_at = ?, finished_at = ? "
+            "WHERE job_id = ? AND state IN (?, ?)",
+            (
+                str(JobState.FAILED),
+                attempts,
+                error,
+                next_attempt_at,
+                now,
+                now,
+                job_id,
+                str(JobState.PENDING),
+                str(JobState.FAILED),
+            ),
+        )
+
+    # --- Transitions ---------------------------------------------------------
+
+    def _leave_stage(
+        self, job_id: str, now: float, timings: dict[str, float] | None = None
+    ) -> Job:
+        """Record how long the job spent in its current stage.
+
+        `timings` overrides the measured duration with stage timings taken
+        elsewhere (e.g. several stages run together in a worker process).
+        """
+        job = self.get(job_id)
+        if job is None:
+            raise JobStoreError(f"Unknown job: {job_id}")
+        if timings is None and job.state in ACTIVE_STATES:
+            timings = {str(job.state): now - job.updated_at}
+        for stage, seconds in (timings or {}).items():
+            self._db.execute(
+                "INSERT OR REPLACE INTO job_timings "
+                "(job_id, attempt, stage, seconds) VALUES (?, ?, ?, ?)",
+                (job_id, job.attempts, str(stage), seconds),
+            )
+        return job
+
+    def advance(
+        self,
+        job_id: str,
+        state: JobState,
+        *,
+        timings: dict[str, float] | None = None,
+    ) -> None:
+        """Move a job to the next active stage."""
+        if state not in ACTIVE_STATES:
+            raise JobStoreError(f"Not an active stage: {state}")
+        now = time.time()
+        self.heartbeat(now)
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._leave_stage(job_id, now, timings)
+            self._db.execute(
+                "UPDATE jobs SET state = ?, updated_at = ? WHERE job_id = ?",
+                (str(state), now, job_id),
+            )
+
+    def complete(self, job_id: str, result: dict[str, Any] | None = None) -> None:
+        """Mark a job done, storing its (JSON-serializable) result."""
+        now = time.time()
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            self._leave_stage(job_id, now)
+            self._db.execute(
+                "UPDATE jobs SET state = ?, result = ?, last_error = NULL, "
+                "updated_at = ?, finished_at = ? WHERE job_id = ?",
+                (
+                    str(JobState.DONE),
+                    json.dumps(result) if result is not None else None,
+                    now,
+                    now,
+                    job_id,
+                ),
+            )
+
+    def defer(self, job_id: str) -> None:
+        """Park an extracting job while an offline batch runs its model call."""
+        now = time.time()
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            # No `extract` timing: those describe streamed model calls.
+            self._leave_stage(job_id, now, timings={})
+            self._db.execute(
+                "UPDATE jobs SET state = ?, owner = NULL, updated_at = ? "
+                "WHERE job_id = ?",
+                (str(JobState.SUBMITTED), now, job_id),
+            )
+
+    def fail(self, job_id: str, error: str) -> Job:
+        """Mark a job failed and schedule its retry with jittered backoff."""
+        now = time.time()
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            job = self._leave_stage(job_id, now)
+            delay = min(
+                self.backoff_max, self.backoff_base * 2 ** max(job.attempts - 1, 0)
+            )
+            delay *= random.uniform(0.5, 1.0)
+            self._db.execute(
+                "UPDATE jobs SET state = ?, last_error = ?, updated_at = ?, "
+                "finished_at = ?, next_attempt_at = ? WHERE job_id = ?",
+                (str(JobState.FAILED), error, now, now, now + delay, job_id),
+            )
+        job = self.get(job_id)
+        assert job is not None
+        return job
+
+    def heartbeat(self, now: float | None = None, *, force: bool = False) -> None:
+        """Record that this worker is alive (see `recover()`).
+
+        Called as jobs are claimed and advanced, and by `heartbeating()`;
+        unless `force`d, writes at most once every `HEARTBEAT_INTERVAL`
+        seconds.
+        """
+        now = time.time() if now is None else now
+        if not force and now - self._heartbeat_at < HEARTBEAT_INTERVAL:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO owners (owner, heartbeat_at) VALUES (?, ?)",
+            (self.owner, now),
+        )
+        self._heartbeat_at = now
+
+    @asynccontextmanager
+    async def heartbeating(
+        self, interval: float = HEARTBEAT_INTERVAL
+    ) -> AsyncIterator["JobStore"]:
+        """Heartbeat every `interval` seconds while the block runs.
+
+        Keeps a worker that is alive but idle (long model calls, backoff, a
+        deep extract queue) from looking crashed to `recover()` elsewhere.
+        """
+
+        async def _loop() -> None:
+            while True:
+                self.heartbeat(force=True)
+                await asyncio.sleep(interval)
+
+        task = asyncio.create_task(_loop())
+        try:
+            yield self
+        finally:
+            task.cancel()
+
+    def recover(self, *, stale_after: float = 900.0) -> int:
+        """Requeue jobs left in an active stage by a worker that died.
+
+        Staleness is judged by the owner, not by how long the job has been
+        in its stage: a job may wait in the extract queue for a long time.
+        A job is reclaimed if its owner is a dead process on this host (or
+        an earlier worker with this process's PID), or an owner elsewhere
+        whose last heartbeat (or, without one, the job's last update) is
+        older than `stale_after` seconds. Jobs of this store's own worker
+        and `submitted` jobs are never reclaimed. Returns the number of jobs
+        requeued.
+        """
+        host = socket.gethostname()
+        now = time.time()
+        placeholders = ",".join("?" for _ in ACTIVE_STATES)
+        rows = self._db.execute(
+            f"SELECT job_id, owner, updated_at FROM jobs "
+            f"WHERE state IN ({placeholders})",
+            [str(s) for s in ACTIVE_STATES],
+        ).fetchall()
+        heartbeats = dict(
+            self._db.execute("SELECT owner, heartbeat_at FROM owners").fetchall()
+        )
+
+        requeued = 0
+        for row in rows:
+            owner = row["owner"]
+            if owner == self.owner:
+                continue
+            owner_host, pid = _owner_process(owner or "")
+            if owner_host == host and pid is not None:
+                stale = pid == os.getpid() or not _pid_alive(pid)
+            else:
+                seen = max(heartbeats.get(owner, 0.0), row["updated_at"])
+                stale = now - seen >= stale_after
+            if stale:
+                cur = self._db.execute(
+                    "UPDATE jobs SET state = ?, owner = NULL, updated_at = ? "
+                    "WHERE job_id = ? AND updated_at = ?",
+                    (str(JobState.PENDING), now, row["job_id"], row["updated_at"]),
+                )
+                requeued += cur.rowcount
+        return requeued
+
+    # --- Sender history ------------------------------------------------------
+
+    def remember_terms(self, sender: str, terms_days: int) -> None:
+        """Record the payment terms last seen on an invoice from `sender`."""
+        self._db.execute(
+            "INSERT OR REPLACE INTO sender_terms (sender, terms_days, updated_at) "
+            "VALUES (?, ?, ?)",
+            (sender, terms_days, time.time()),
+        )
+
+    def sender_terms(self, sender: str | None) -> Optional[int]:
+        """Payment terms (days) of the last invoice from `sender`, if known."""
+        if not sender:
+            return None
+        row = self._db.execute(
+            "SELECT terms_days FROM sender_terms WHERE sender = ?", (sender,)
+        ).fetchone()
+        return row["terms_days"] if row else None
+
+    # --- Queries -------------------------------------------------------------
+
+    def counts(self) -> dict[str, int]:
+        """Number of jobs per state."""
+        rows = self._db.execute(
+            "SELECT state, COUNT(*) AS n FROM jobs GROUP BY state"
+        ).fetchall()
+        return {row["state"]: row["n"] for row in rows}
+
+    def stuck(self, *, older_than: float = 900.0) -> List[Job]:
+        """Active jobs that have not changed stage for `older_than` seconds."""
+        cutoff = time.time() - older_than
+        placeholders = ",".join("?" for _ in ACTIVE_STATES)
+        rows = self._db.execute(
+            f"SELECT * FROM jobs WHERE state IN ({placeholders}) "
+            f"AND updated_at < ? ORDER BY updated_at",
+            [*(str(s) for s in ACTIVE_STATES), cutoff],
+        ).fetchall()
+        return [Job.from_row(r) for r in rows]
+
+    def failed_since(self, since: float) -> List[Job]:
+        """Jobs whose latest attempt failed at or after `since` (epoch seconds)."""
+        rows = self._db.execute(
+            "SELECT * FROM jobs WHERE state = ? AND updated_at >= ? "
+            "ORDER BY updated_at DESC",
+            (str(JobState.FAILED), since),
+        ).fetchall()
+        return [Job.from_row(r) for r in rows]
+
+    def stage_seconds(self, stage: str, *, limit: int = 1000) -> List[float]:
+        """Most recent durations of `stage` across jobs."""
+        rows = self._db.execute(
+            "SELECT seconds FROM job_timings WHERE stage = ? "
+            "ORDER BY rowid DESC LIMIT ?",
+            (stage, limit),
+        )
+        return [row["seconds"] for row in rows]
+
+    def timings(self, job_id: str) -> Iterator[tuple[int, str, float]]:
+        """(attempt, stage, seconds) rows for a job."""
+        rows = self._db.execute(
+            "SELECT attempt, stage, seconds FROM job_timings WHERE job_id = ? "
+            "ORDER BY attempt, rowid",
+            (job_id,),
+        )
+        for row in rows:
+            yield row["attempt"], row["stage"], row["seconds"]
@@ -0,0 +1,379 @@
+"""Work sharing between intake nodes over a shared filesystem.
+
+Several nodes (hosts or processes) can process one inbox, e.g. on NFS, when
+they share a lease directory. Each node keeps its own job store; the lease
+directory is the only thing they share:
+
+    nodes/<node>.json    a live node and its capacity (mtime = heartbeat)
+    <job_id>.lease       the node working on a job (mtime = heartbeat)
+    <job_id>.done        the notify result of a finished job
+    <job_id>.failed      attempts and backoff of a job whose last try failed
+
+- A lease is created by hard-linking a private temp file to its name, which
+  is atomic on local filesystems and NFS alike (O_EXCL is not reliable on
+  old NFS); the link count tells whether the link was really made.
+- Holders touch their leases every `ttl / 3` seconds. A lease untouched for
+  `ttl` seconds belongs to a crashed node: it is reclaimed by renaming it
+  away (exactly one node's rename succeeds) and linking a new one.
+- Node IDs (default `<host>-<pid>`) must be unique among running nodes; a
+  node restarted with the same ID takes back its old leases at once.
+- Ages are measured against the shared filesystem's clock (the mtime of the
+  node's own heartbeat file), so clock skew between hosts does not matter.
+- Attempts and retry backoff live in the `.failed` marker rather than in
+  any node's job store, so a failing email is retried `max_attempts` times
+  in total, after the backoff, whichever nodes try it.
+- Every node prefers the jobs that weighted rendezvous hashing assigns to
+  it, with weight = capacity, and takes the others only when they are
+  still free. Nodes therefore rarely contend for the same email, and work
+  spreads in proportion to capacity while an idle node still helps with
+  another's backlog.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import socket
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, TypeVar
+
+from ..utils import console as c
+from ..utils.sinks import safe_name
+
+T = TypeVar("T")
+
+
+class LeaseError(RuntimeError):
+    """Error reading or updating the lease directory."""
+
+
+@dataclass
+class LeaseFailure:
+    """Shared record of a job's failed attempts."""
+
+    attempts: int
+    # Seconds until the job may be retried (<= 0: due now).
+    retry_in: float
+    error: Optional[str] = None
+
+
+def _weight(node: str, capacity: float, job_id: str) -> float:
+    """Weighted rendezvous score of `node` for `job_id` (highest wins)."""
+    digest = hashlib.sha256(f"{node}\0{job_id}".encode()).digest()
+    h = (int.from_bytes(digest[:8], "big") + 1) / (2**64 + 2)  # in (0, 1)
+    return -capacity / math.log(h)
+
+
+def _owner(nodes: Dict[str, float], job_id: str) -> str:
+    return max(nodes, key=lambda node: _weight(node, nodes[node], job_id))
+
+
+class LeaseCoordinator:
+    """Claims jobs for one node through lease files in a shared directory."""
+
+    def __init__(
+        self,
+        root: str | Path,
+        *,
+        node_id: str | None = None,
+        capacity: float = 1.0,
+        ttl: float = 60.0,
+    ):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.root = Path(root)
+        self.node_id = safe_name(node_id or f"{socket.gethostname()}-{os.getpid()}")
+        self.capacity = capacity
+        self.ttl = ttl
+        # job_id -> token written into our lease file.
+        self.held: Dict[str, str] = {}
+        self._node_file = self.root / "nodes" / f"{self.node_id}.json"
+
+    @property
+    def poll_interval(self) -> float:
+        """How often to look again at jobs leased by other nodes."""
+        return self.ttl / 4
+
+    # --- Nodes ---------------------------------------------------------------
+
+    def register(self) -> None:
+        """Announce this node and its capacity."""
+        self._write_atomic(
+            self._node_file,
+            {"node": self.node_id, "capacity": self.capacity, "pid": os.getpid()},
+        )
+
+    def _now(self) -> float:
+        """Current time on the shared filesystem's clock."""
+        try:
+            os.utime(self._node_file)
+        except FileNotFoundError:
+            self.register()
+        return self._node_file.stat().st_mtime
+
+    def live_nodes(self) -> Dict[str, float]:
+        """Capacity of every node whose heartbeat is recent."""
+        now = self._now()
+        nodes = {}
+        for path in (self.root / "nodes").glob("*.json"):
+            try:
+                if now - path.stat().st_mtime > self.ttl:
+                    continue
+                info = json.loads(path.read_text())
+            except (FileNotFoundError, ValueError):
+                continue
+            nodes[info.get("node", path.stem)] = float(info.get("capacity", 1.0))
+        nodes.setdefault(self.node_id, self.capacity)
+        return nodes
+
+    def order(self, jobs: List[T], key=lambda job: job.job_id) -> List[T]:
+        """`jobs` with those assigned to this node first (order kept otherwise)."""
+        nodes = self.live_nodes()
+        if len(nodes) == 1:
+            return list(jobs)
+        own, others = [], []
+        for job in jobs:
+            (own if _owner(nodes, key(job)) == self.node_id else others).append(job)
+        return own + others
+
+    # --- Leases --------------------------------------------------------------
+
+    def _lease_path(self, job_id: str) -> Path:
+        return self.root / f"{job_id}.lease"
+
+    def _done_path(self, job_id: str) -> Path:
+        return self.root / f"{job_id}.done"
+
+    def _failed_path(self, job_id: str) -> Path:
+        return self.root / f"{job_id}.failed"
+
+    def _write_atomic(self, path: Path, payload: dict) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_text(json.dumps(payload))
+        os.replace(tmp, path)
+
+    def _link_new(self, path: Path, token: str) -> bool:
+        """Create `path` with our lease content unless it exists."""
+        tmp = self.root / f".{path.name}.{token}.tmp"
+        tmp.write_text(
+            json.dumps(
+                {
+                    "node": self.node_id,
+                    "token": token,
+                    "host": socket.gethostname(),
+                    "pid": os.getpid(),
+                    "acquired_at": time.time(),
+                }
+            )
+        )
+        try:
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                return False
+            except OSError:
+                pass  # NFS may report an error for a link that was made
+            return os.stat(tmp).st_nlink == 2
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def _token(self, path: Path) -> Optional[str]:
+        try:
+            return json.loads(path.read_text()).get("token")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _orphaned(self, path: Path) -> bool:
+        try:
+            lease = json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            return False
+        return lease.get("node") == self.node_id and lease.get("token") not in set(
+            self.held.values()
+        )
+
+    def _reclaim(self, path: Path) -> bool:
+        """Remove `path` if its holder stopped heartbeating; True if gone.
+
+        Leases left by an earlier run of this node (same node ID, unknown
+        token) are reclaimed at once instead of after `ttl`.
+        """
+        now = self._now()
+        try:
+            if now - path.stat().st_mtime <= self.ttl and not self._orphaned(path):
+                return False
+        except FileNotFoundError:
+            return True
+        grave = path.with_name(f".{path.name}.stale-{uuid.uuid4().hex}")
+        try:
+            os.rename(path, grave)
+        except FileNotFoundError:
+            return True  # another node reclaimed (or the holder released) it
+        if now - grave.stat().st_mtime <= self.ttl and not self._orphaned(grave):
+            # The holder heartbeat between our check and the rename: put it back.
+            try:
+                os.link(grave, path)
+            except FileExistsError:
+                pass
+            grave.unlink(missing_ok=True)
+            return False
+        grave.unlink(missing_ok=True)
+        return True
+
+    def acquire(self, job_id: str) -> bool:
+        """Take the lease of `job_id`; False if another node holds it or it is done."""
+        if job_id in self.held:
+            return True
+        if self._done_path(job_id).exists():
+            return False
+        path = self._lease_path(job_id)
+        token = uuid.uuid4().hex
+        if not self._link_new(path, token):
+            if not self._reclaim(path) or not self._link_new(path, token):
+                return False
+        self.held[job_id] = token
+        if self._done_path(job_id).exists():
+            # Finished (and released) by another node while we were linking.
+            self.release(job_id)
+            return False
+        return True
+
+    def release(self, job_id: str) -> None:
+        """Give up a lease (e.g. after a failed attempt) so any node may retry."""
+        token = self.held.pop(job_id, None)
+        path = self._lease_path(job_id)
+        if token is not None and self._token(path) == token:
+            path.unlink(missing_ok=True)
+
+    def finish(self, job_id: str, result: dict[str, Any] | None) -> None:
+        """Record a finished job for every node, then release its lease."""
+        self._write_atomic(self._done_path(job_id), {"result": result})
+        self._failed_path(job_id).unlink(missing_ok=True)
+        self.release(job_id)
+
+    def fail(self, job_id: str, *, attempts: int, retry_in: float, error: str) -> None:
+        """Record a failed attempt for every node, then release the lease.
+
+        `retry_in` is measured from now; it is stored relative to the marker's
+        mtime, so other nodes read it on the shared filesystem's clock.
+        """
+        previous = self.failure(job_id)
+        if previous is not None:
+            attempts = max(attempts, previous.attempts)
+        self._write_atomic(
+            self._failed_path(job_id),
+            {
+                "attempts": attempts,
+                "delay": retry_in,
+                "error": error,
+                "node": self.node_id,
+            },
+        )
+        self.release(job_id)
+
+    def failure(self, job_id: str) -> Optional[LeaseFailure]:
+        """Failed attempts of a job on any node, if its last attempt failed."""
+        path = self._failed_path(job_id)
+        try:
+            info = json.loads(path.read_text())
+            written = path.stat().st_mtime
+            return LeaseFailure(
+                attempts=int(info["attempts"]),
+                retry_in=written + float(info["delay"]) - self._now(),
+                error=info.get("error"),
+            )
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError) as e:
+            c.error(f"Ignoring unreadable failure marker of job {job_id}: {e}")
+            return None
+
+    def finished(self, job_id: str) -> Optional[dict[str, Any]]:
+        """Result of a job some node has finished, if any."""
+        try:
+            done = json.loads(self._done_path(job_id).read_text())
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            raise LeaseError(f"Unreadable done marker for job {job_id}: {e}")
+        return done.get("result") or {}
+
+    def heartbeat(self) -> List[str]:
+        """Refresh this node and its leases; returns jobs whose lease was lost."""
+        self._now()
+        lost = []
+        for job_id, token in list(self.held.items()):
+            path = self._lease_path(job_id)
+            if self._token(path) != token:
+                lost.append(job_id)
+                self.held.pop(job_id, None)
+                continue
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                lost.append(job_id)
+                self.held.pop(job_id, None)
+        return lost
+
+    def close(self) -> None:
+        """Release every lease and leave the node list."""
+        for job_id in list(self.held):
+            self.release(job_id)
+        self._node_file.unlink(missing_ok=True)
+
+    @asynccontextmanager
+    async def heartbeating(self) -> AsyncIterator["LeaseCoordinator"]:
+        """Register, heartbeat every `ttl / 3` seconds, and clean up on exit."""
+
+        async def _loop() -> None:
+            while True:
+                await asyncio.sleep(self.ttl / 3)
+                lost = await asyncio.to_thread(self.heartbeat)
+                if lost:
+                    # This node stalled for longer than `ttl`; other nodes may
+                    # now process these jobs too.
+                    c.error(f"Lost leases of {len(lost)} jobs: {', '.join(lost)}")
+
+        self.register()
+        task = asyncio.create_task(_loop())
+        try:
+            yield self
+        finally:
+            task.cancel()
+            self.close()
+
+
+def make_leases(
+    lease_dir: str | Path | None,
+    *,
+    node_id: str | None = None,
+    capacity: float = 1.0,
+    ttl: float = 60.0,
+) -> Optional[LeaseCoordinator]:
+    """Coordinator for `--lease-dir`, or None when the inbox is not shared."""
+    if lease_dir is None:
+        return None
+    coordinator = LeaseCoordinator(
+        lease_dir, node_id=node_id, capacity=capacity, ttl=ttl
+    )
+    c.sysmsg(
+        f"Sharing work via {coordinator.root} as node {coordinator.node_id} "
+        f"(capacity {capacity:g})."
+    )
+    return coordinator
+
+
+def claim_shares(nodes: Dict[str, float], job_ids: Iterable[str]) -> Dict[str, int]:
+    """How many of `job_ids` rendezvous hashing assigns to each node."""
+    shares = {node: 0 for node in nodes}
+    for job_id in job_ids:
+        shares[_owner(nodes, job_id)] += 1
+    return shares
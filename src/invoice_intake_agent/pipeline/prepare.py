@@ -0,0 +1,87 @@
+"""CPU-bound preparation of an email (load, PDF text, PDF raster).
+
+`prepare_email` runs in a worker process, so it only takes and returns
+plain picklable values.
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+from ..utils.artifacts import ArtifactStore, get_artifact_store
+from ..utils.documents import extract_text_from_doc, render_doc
+from ..utils.emails import load_email
+from .dedup import Fingerprint, fingerprint
+
+
+@dataclass
+class PreparedEmail:
+    """Everything the Invoice Specialist needs for one email."""
+
+    email_path: str
+    email: dict[str, Any]
+    pdf_path: str
+    pdf_text: str
+    pdf_images: List[str]
+    timings: dict[str, float] = field(default_factory=dict)
+    fingerprint: Optional[Fingerprint] = None
+    # Whether the pages came from the artifact store's render cache.
+    render_cached: bool = False
+
+
+def prepare_email(
+    email_path: str,
+    *,
+    dedup: bool = False,
+    artifacts: ArtifactStore | None = None,
+    pin: str | None = None,
+) -> PreparedEmail:
+    """Load an email and extract its PDF text and page images.
+
+    Pages are rendered into `artifacts` (the process-wide store if None) and,
+    with `pin`, pinned under that key until the caller unpins them. With
+    `dedup`, also computes the PDF's duplicate-detection fingerprint.
+    """
+
+    timings: dict[str, float] = {}
+
+    t0 = time.perf_counter()
+    email = load_email(email_path)
+    pdf_path = email.get_pdf_path()
+    t1 = time.perf_counter()
+    timings["load"] = t1 - t0
+
+    pdf_text = extract_text_from_doc(pdf_path)
+    t2 = time.perf_counter()
+    timings["text"] = t2 - t1
+
+    pdf_images, render_cached = render_doc(pdf_path, artifacts)
+    if pin is not None:
+        (artifacts or get_artifact_store()).pin(pin, pdf_images)
+    t3 = time.perf_counter()
+    timings["raster"] = t3 - t2
+
+    fp = None
+    if dedup:
+        fp = fingerprint(pdf_path, pdf_text, pdf_images[0] if pdf_images else None)
+        timings["fingerprint"] = time.perf_counter() - t3
+
+    return PreparedEmail(
+        email_path=str(email_path),
+        email=email.to_dict(),
+        pdf_path=str(pdf_path),
+        pdf_text=pdf_text,
+        pdf_images=pdf_images,
+        timings=timings,
+        fingerprint=fp,
+        render_cached=render_cached,
+    )
+
+
+def warm_up() -> None:
+    """Import the PDF backends in a worker process ahead of the first job."""
+    import pdf2image  # noqa: F401
+    import pdfminer.high_level  # noqa: F401
+    import PIL.Image  # noqa: F401
@@ -0,0 +1,211 @@
+"""SLA-aware ordering of prepared emails in front of the model calls.
+
+Each email gets a priority class from signals that are free before the
+model call: subject keywords ("urgent", "past due", ...), payment terms
+mentioned in the email or remembered for its sender from earlier invoices,
+and VIP senders. A class sets the latency target, and the deadline is the
+email's received time plus that target:
+
+    urgent  5 min    keywords, or terms of `urgent_terms_days` or less
+    high    15 min   VIP sender, or terms of `short_terms_days` or less
+    normal  60 min   everything else
+
+`DeadlineQueue` hands out the earliest deadline first. Deadlines are fixed
+when an email is queued, so waiting is its own aging: a normal email queued
+at t is served before any urgent email that arrives after t + 55 min, and
+nothing starves under a steady stream of urgent work. An email that was
+already past its target when it was queued is due immediately, so a backlog
+of old mail does not push fresh urgent invoices to the back.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from ..utils.metrics import QUEUE_WAIT_SECONDS, SLA_MISSED
+
+PRIORITY_CLASSES = ("urgent", "high", "normal")
+
+_TERMS = re.compile(r"\bnet\s*[- ]?\s*(\d{1,3})\b", re.IGNORECASE)
+_DUE_SOON = re.compile(r"\bdue\s+(?:today|tomorrow|immediately|now)\b", re.IGNORECASE)
+
+
+def parse_terms_days(text: Optional[str]) -> Optional[int]:
+    """Days of payment terms in text such as "Net 30" or "terms net-15"."""
+    if not text:
+        return None
+    if re.search(r"\b(?:due on receipt|upon receipt|cod)\b", text, re.IGNORECASE):
+        return 0
+    match = _TERMS.search(text)
+    return int(match.group(1)) if match else None
+
+
+def invoice_terms_days(
+    payment_terms: Optional[str],
+    invoice_date: Optional[str] = None,
+    due_date: Optional[str] = None,
+) -> Optional[int]:
+    """Payment terms of an extracted invoice, from its terms or its dates."""
+    days = parse_terms_days(payment_terms)
+    if days is not None or not (invoice_date and due_date):
+        return days
+    try:
+        delta = datetime.fromisoformat(due_date) - datetime.fromisoformat(invoice_date)
+    except ValueError:
+        return None
+    return delta.days if delta.days >= 0 else None
+
+
+def sender_address(email: dict[str, Any]) -> Optional[str]:
+    """Lower-cased sender address of an email message."""
+    address = ((email.get("From") or {}).get("EmailAddress") or {}).get("Address")
+    return address.strip().lower() if address else None
+
+
+def received_at(email: dict[str, Any]) -> Optional[float]:
+    """Epoch time the email was sent, if it says so."""
+    sent = email.get("SentDateTime") or email.get("ReceivedDateTime")
+    if not sent:
+        return None
+    try:
+        stamp = datetime.fromisoformat(str(sent).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return stamp.timestamp()
+
+
+@dataclass(frozen=True)
+class SlaPolicy:
+    """How emails are classified and how soon each class must be served."""
+
+    targets: Dict[str, float] = field(
+        default_factory=lambda: {"urgent": 300.0, "high": 900.0, "normal": 3600.0}
+    )
+    # Addresses ("ap@vendor.com") or whole domains ("@vendor.com").
+    vip_senders: frozenset[str] = frozenset()
+    urgent_keywords: Tuple[str, ...] = (
+        "urgent",
+        "overdue",
+        "past due",
+        "final notice",
+        "asap",
+        "immediate",
+    )
+    urgent_terms_days: int = 7
+    short_terms_days: int = 15
+
+    def is_vip(self, sender: Optional[str]) -> bool:
+        if not sender:
+            return False
+        return sender in self.vip_senders or (
+            "@" + sender.rsplit("@", 1)[-1] in self.vip_senders
+        )
+
+    def classify(
+        self, email: dict[str, Any], *, known_terms_days: Optional[int] = None
+    ) -> Tuple[str, str]:
+        """(priority class, reason) of an email message."""
+        subject = str(email.get("Subject") or "")
+        body = str((email.get("Body") or {}).get("Content") or "")
+
+        lowered = subject.lower()
+        for keyword in self.urgent_keywords:
+            if keyword in lowered:
+                return "urgent", f"subject: {keyword}"
+        if _DUE_SOON.search(subject) or _DUE_SOON.search(body[:2000]):
+            return "urgent", "due soon"
+
+        terms = parse_terms_days(subject)
+        if terms is None:
+            terms = parse_terms_days(body[:2000])
+        source = "email"
+        if terms is None:
+            terms, source = known_terms_days, "vendor history"
+        if terms is not None and terms <= self.urgent_terms_days:
+            return "urgent", f"net {terms} ({source})"
+        if self.is_vip(sender_address(email)):
+            return "high", "vip sender"
+        if terms is not None and terms <= self.short_terms_days:
+            return "high", f"net {terms} ({source})"
+        return "normal", "default"
+
+    def deadline(self, priority: str, received: float, queued: float) -> float:
+        """When an email of `priority` received at `received` is due."""
+        target = self.targets[priority]
+        # Mail that was already late when queued is due now, not in the past.
+        return max(received, queued - target) + target
+
+
+@dataclass
+class ScheduleStats:
+    """Queue waits and SLA misses per priority class."""
+
+    waits: Dict[str, Deque[float]] = field(
+        default_factory=lambda: {p: deque(maxlen=10000) for p in PRIORITY_CLASSES}
+    )
+    missed: Dict[str, int] = field(
+        default_factory=lambda: {p: 0 for p in PRIORITY_CLASSES}
+    )
+
+    def record(self, priority: str, wait: float, late: bool) -> None:
+        self.waits.setdefault(priority, deque(maxlen=10000)).append(wait)
+        QUEUE_WAIT_SECONDS.labels(priority).observe(wait)
+        if late:
+            self.missed[priority] = self.missed.get(priority, 0) + 1
+            SLA_MISSED.labels(priority).inc()
+
+    def __str__(self) -> str:
+        parts = []
+        for priority, waits in self.waits.items():
+            if not waits:
+                continue
+            ordered = sorted(waits)
+            p50 = ordered[len(ordered) // 2]
+            p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+            parts.append(
+                f"{priority} {len(ordered)} (wait p50 {p50:.1f}s, p95 {p95:.1f}s, "
+                f"{self.missed.get(priority, 0)} past SLA)"
+            )
+        return "; ".join(parts) or "nothing scheduled"
+
+
+class DeadlineQueue(asyncio.Queue):
+    """Bounded asyncio queue that hands out the earliest deadline first.
+
+    `schedule(item)` returns the item's (priority class, deadline as epoch
+    time); it is called once, when the item is put.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 0,
+        *,
+        schedule: Callable[[Any], Tuple[str, float]],
+        stats: ScheduleStats | None = None,
+    ):
+        self._schedule = schedule
+        self._seq = itertools.count()
+        self.schedule_stats = stats or ScheduleStats()
+        super().__init__(maxsize)
+
+    def _init(self, maxsize: int) -> None:
+        self._queue: list = []
+
+    def _put(self, item: Any) -> None:
+        priority, deadline = self._schedule(item)
+        entry = (deadline, next(self._seq), priority, time.time(), item)
+        heapq.heappush(self._queue, entry)
+
+    def _get(self) -> Any:
+        deadline, _, priority, queued, item = heapq.heappop(self._queue)
+        now = time.time()
+        self.schedule_stats.record(priority, now - queued, now > deadline)
+        return item
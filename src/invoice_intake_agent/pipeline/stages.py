@@ -0,0 +1,164 @@
+"""Staged producer/consumer pipeline with bounded queues.
+
+Each `Stage` owns a bounded input queue and a fixed number of async
+workers. A worker hands its output to the next stage's queue, blocking
+when that queue is full, so a slow stage (usually the model calls) pushes
+back on the stages before it instead of letting work pile up in memory.
+Stages keep simple counters (queue depth, busy time) so the bottleneck is
+visible in `Pipeline.stats()`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, List, Optional
+
+Handler = Callable[[Any], Awaitable[Any]]
+ErrorHandler = Callable[[str, Any, BaseException], Awaitable[None]]
+
+
+@dataclass
+class StageStats:
+    """Counters for a single stage."""
+
+    name: str
+    workers: int
+    queue_depth: int = 0
+    queue_size: int = 0
+    active: int = 0
+    processed: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+    started_at: float = field(default_factory=time.perf_counter)
+
+    @property
+    def utilization(self) -> float:
+        """Fraction of worker time spent handling items since start."""
+        elapsed = time.perf_counter() - self.started_at
+        if elapsed <= 0:
+            return 0.0
+        return min(1.0, self.busy_seconds / (elapsed * self.workers))
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: queue {self.queue_depth}/{self.queue_size}, "
+            f"active {self.active}/{self.workers}, "
+            f"done {self.processed}, failed {self.failed}, "
+            f"util {self.utilization:.0%}"
+        )
+
+
+class Stage:
+    """A pool of async workers consuming a bounded queue."""
+
+    def __init__(
+        self,
+        name: str,
+        handler: Handler,
+        *,
+        workers: int = 1,
+        queue_size: int | None = None,
+        queue: asyncio.Queue | None = None,
+    ):
+        """`queue` replaces the default FIFO (e.g. with a priority queue)."""
+        if workers < 1:
+            raise ValueError(f"Stage {name!r} needs at least one worker")
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        if queue is None:
+            queue = asyncio.Queue(maxsize=queue_size or workers * 2)
+        self.queue: asyncio.Queue = queue
+        self.downstream: Optional[Stage] = None
+        self._stats = StageStats(name, workers, queue_size=self.queue.maxsize)
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def stats(self) -> StageStats:
+        self._stats.queue_depth = self.queue.qsize()
+        return self._stats
+
+    def start(self, on_error: ErrorHandler) -> None:
+        self._stats.started_at = time.perf_counter()
+        self._tasks = [
+            asyncio.create_task(self._work(on_error), name=f"{self.name}-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self, on_error: ErrorHandler) -> None:
+        while True:
+            item = await self.queue.get()
+            try:
+                self._stats.active += 1
+                t0 = time.perf_counter()
+                try:
+                    out = await self.handler(item)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:  # noqa: BLE001 - reported via on_error
+                    self._stats.failed += 1
+                    await on_error(self.name, item, e)
+                    continue
+                finally:
+                    self._stats.busy_seconds += time.perf_counter() - t0
+                    self._stats.active -= 1
+
+                self._stats.processed += 1
+                # Blocks while the next stage is saturated (backpressure).
+                if self.downstream is not None and out is not None:
+                    await self.downstream.queue.put(out)
+            finally:
+                self.queue.task_done()
+
+
+class Pipeline:
+    """A linear chain of stages."""
+
+    def __init__(self, stages: List[Stage], *, on_error: ErrorHandler):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = stages
+        self.on_error = on_error
+        for upstream, downstream in zip(stages, stages[1:]):
+            upstream.downstream = downstream
+
+    async def __aenter__(self) -> "Pipeline":
+        for stage in self.stages:
+            stage.start(self.on_error)
+        return self
+
+    async def __aexit__(self, *exc: object) -> None:
+        for stage in self.stages:
+            await stage.stop()
+
+    async def submit(self, item: Any) -> None:
+        """Feed an item into the first stage (waits while it is full)."""
+        await self.stages[0].queue.put(item)
+
+    async def drain(self) -> None:
+        """Wait until every submitted item has left the last stage."""
+        # Upstream workers enqueue downstream before marking their item done,
+        # so joining the stages in order is enough.
+        for stage in self.stages:
+            await stage.queue.join()
+
+    def stats(self) -> List[StageStats]:
+        return [stage.stats for stage in self.stages]
+
+    def bottleneck(self) -> StageStats:
+        """The stage with the highest utilization."""
+        return max(self.stats(), key=lambda s: s.utilization)
+
+    async def report_every(self, seconds: float, emit: Callable[[str], None]) -> None:
+        """Periodically emit one line of stats per stage (run as a task)."""
+        while True:
+            await asyncio.sleep(seconds)
+            emit(" | ".join(str(s) for s in self.stats()))
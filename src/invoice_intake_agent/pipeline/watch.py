@@ -0,0 +1,381 @@
+"""Watch an inbox directory and feed new emails to the pipeline.
+
+Emails are picked up as they arrive, using inotify on Linux and directory
+snapshots polled every `poll_interval` seconds elsewhere (or on network
+filesystems, with `polling=True`). An email is only queued once its JSON
+parses, every attachment it names exists, and none of those files has
+changed for `settle` seconds, so half-copied files are never processed.
+
+The job store is the persisted index: jobs are keyed by email content, so
+emails already processed are skipped after a restart, and failed jobs are
+retried with backoff while the watcher keeps running.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import json
+import os
+import signal
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ..config import load_settings
+from ..utils import console as c
+from .batch import BatchRunner
+from .dedup import DedupIndex
+from .jobs import Job, JobState, JobStore
+from .leases import make_leases
+
+# inotify(7) event masks.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+_WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+_EVENT = struct.Struct("iIII")
+
+# (size, mtime_ns) of a file.
+Signature = Tuple[int, int]
+
+
+class WatchError(RuntimeError):
+    """Error watching the inbox directory."""
+
+
+def _signature(path: str | Path) -> Optional[Signature]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+# --- Change sources ----------------------------------------------------------
+
+
+class PollingWatcher:
+    """Reports changed file names by diffing directory snapshots."""
+
+    kind = "polling"
+
+    def __init__(self, directory: str | Path, *, interval: float = 1.0):
+        self.directory = Path(directory)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[str, Signature]:
+        snapshot = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    st = entry.stat()
+                    snapshot[entry.name] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    async def changes(self, timeout: Optional[float]) -> Set[str]:
+        """Names added or modified since the last call."""
+        wait = self.interval if timeout is None else min(timeout, self.interval)
+        await asyncio.sleep(wait)
+        snapshot = self._scan()
+        changed = {n for n, sig in snapshot.items() if self._snapshot.get(n) != sig}
+        self._snapshot = snapshot
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """Reports changed file names from Linux inotify events."""
+
+    kind = "inotify"
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise WatchError(f"inotify_init1: {os.strerror(ctypes.get_errno())}")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(self.directory), _WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise WatchError(
+                f"inotify_add_watch {self.directory}: {os.strerror(errno)}"
+            )
+
+    def _read(self) -> Set[str]:
+        names: Set[str] = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size : offset + _EVENT.size + length]
+                offset += _EVENT.size + length
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    raise WatchError(f"Inbox directory went away: {self.directory}")
+                if mask & IN_Q_OVERFLOW:
+                    # Events were dropped; let the caller recheck everything.
+                    names.update(os.listdir(self.directory))
+                elif name:
+                    names.add(os.fsdecode(name.rstrip(b"\0")))
+
+    async def changes(self, timeout: Optional[float]) -> Set[str]:
+        """Names created, written or moved in since the last call."""
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(self.fd, readable.set)
+        try:
+            await asyncio.wait_for(readable.wait(), timeout)
+        except asyncio.TimeoutError:
+            return set()
+        finally:
+            loop.remove_reader(self.fd)
+        return self._read()
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def make_watcher(
+    directory: str | Path, *, poll_interval: float = 1.0, polling: bool = False
+) -> InotifyWatcher | PollingWatcher:
+    """inotify where available, polling otherwise (or when forced)."""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError, WatchError) as e:
+            c.dim("WATCH", f"inotify unavailable ({e}); polling instead")
+    return PollingWatcher(directory, interval=poll_interval)
+
+
+# --- Debouncing --------------------------------------------------------------
+
+
+class InboxTracker:
+    """Holds arriving emails back until they are complete and stable."""
+
+    def __init__(self, inbox: str | Path, *, settle: float = 1.0):
+        self.inbox = Path(inbox)
+        self.settle = settle
+        # email path -> (signature of email + attachments, stable since)
+        self._pending: Dict[Path, Tuple[Optional[tuple], float]] = {}
+
+    def notice(self, names: Iterable[str]) -> None:
+        """Track emails among the changed file names."""
+        for name in names:
+            if name.lower().endswith(".json") and not name.startswith("."):
+                self._pending.setdefault(self.inbox / name, (None, 0.0))
+
+    def _email_signature(self, path: Path) -> Optional[tuple]:
+        """Signature of an email and its attachments (None if incomplete)."""
+        sig = _signature(path)
+        if sig is None:
+            return None
+        try:
+            message = json.loads(path.read_bytes()).get("Message") or {}
+            names = [a["Name"] for a in message.get("Attachments") or []]
+        except ValueError:
+            return None  # still being written
+        except (AttributeError, KeyError, TypeError):
+            names = []  # not an email; let the load stage report it
+        sigs = [sig]
+        for name in names:
+            attachment = _signature(path.parent / Path(name).name)
+            if attachment is None:
+                return None
+            sigs.append(attachment)
+        return tuple(sigs)
+
+    def ready(self, now: float | None = None) -> List[Path]:
+        """Emails whose files have not changed for `settle` seconds."""
+        now = time.monotonic() if now is None else now
+        ready = []
+        for path, (last, since) in list(self._pending.items()):
+            if not path.exists():
+                del self._pending[path]
+                continue
+            sig = self._email_signature(path)
+            if sig is None:
+                self._pending[path] = (None, now)
+                continue
+            if sig != last:
+                self._pending[path] = (sig, now)
+                since = now
+            if now - since >= self.settle:
+                del self._pending[path]
+                ready.append(path)
+        return ready
+
+    def next_check(self, now: float | None = None) -> Optional[float]:
+        """Seconds until the next complete email may settle (None if none)."""
+        now = time.monotonic() if now is None else now
+        due = [since + self.settle for sig, since in self._pending.values() if sig]
+        return max(0.0, min(due) - now) if due else None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._pending)
+
+
+# --- Daemon ------------------------------------------------------------------
+
+
+def _log_latency(job: Job, done: asyncio.Future) -> None:
+    if done.cancelled() or done.exception() is not None:
+        return
+    if job.attempts == 0:
+        c.dim(
+            "WATCH",
+            f"{Path(job.email_path).name}: notified "
+            f"{time.time() - job.created_at:.1f}s after it was queued",
+        )
+
+
+async def watch_inbox(
+    inbox: str | Path,
+    *,
+    db_path: str | Path = "outputs/jobs.sqlite3",
+    concurrency: int = 4,
+    cpu_workers: int | None = None,
+    max_attempts: int = 3,
+    settle: float = 1.0,
+    poll_interval: float = 1.0,
+    polling: bool = False,
+    dedup_db: str | Path | None = "outputs/dedup.sqlite3",
+    lease_dir: str | Path | None = None,
+    node_id: str | None = None,
+    lease_ttl: float = 60.0,
+) -> dict[str, int]:
+    """Process emails as they land in `inbox` until SIGINT/SIGTERM.
+
+    Emails already in the inbox are picked up first. On shutdown the watcher
+    stops queueing new emails and lets the pipeline drain. With `lease_dir`,
+    the inbox is shared with other nodes watching it. Returns the final job
+    counts per state.
+    """
+
+    load_settings()
+
+    inbox = Path(inbox).expanduser().resolve()
+    if not inbox.is_dir():
+        raise NotADirectoryError(f"Inbox directory not found: {inbox}")
+
+    cpu_workers = cpu_workers or os.cpu_count() or 1
+    leases = make_leases(
+        lease_dir, node_id=node_id, capacity=concurrency, ttl=lease_ttl
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    with (
+        JobStore(db_path, max_attempts=max_attempts) as store,
+        ProcessPoolExecutor(max_workers=cpu_workers) as pool,
+        DedupIndex(dedup_db) if dedup_db else nullcontext() as dedup,
+    ):
+        requeued = store.recover()
+        runner = BatchRunner(
+            store,
+            pool,
+            cpu_workers=cpu_workers,
+            llm_concurrency=concurrency,
+            dedup=dedup,
+            leases=leases,
+        )
+        watcher = make_watcher(inbox, poll_interval=poll_interval, polling=polling)
+        tracker = InboxTracker(inbox, settle=settle)
+        # Catch up on emails that arrived while nothing was watching.
+        tracker.notice(os.listdir(inbox))
+
+        c.sysmsg(
+            f"Watching {inbox} ({watcher.kind}, settle {settle:g}s); "
+            f"{requeued} jobs resumed after interruption. Ctrl-C to stop."
+        )
+
+        stopping = asyncio.create_task(stop.wait())
+        async with (
+            store.heartbeating(),
+            leases.heartbeating() if leases else nullcontext(),
+            runner.pipeline as pipeline,
+        ):
+            try:
+                while not stop.is_set():
+                    for path in tracker.ready():
+                        job = store.enqueue(path)
+                        if job.state == JobState.DONE:
+                            c.dim("WATCH", f"{path.name}: already processed, skipped")
+
+                    await runner.feed(
+                        lambda job, done: done.add_done_callback(
+                            lambda f: _log_latency(job, f)
+                        ),
+                        stop=stop,
+                    )
+
+                    timeout = tracker.next_check()
+                    retry_at = store.next_retry_at()
+                    if retry_at is not None:
+                        retry_in = max(0.0, retry_at - time.time())
+                        timeout = (
+                            retry_in if timeout is None else min(timeout, retry_in)
+                        )
+                    if timeout is None and tracker.waiting:
+                        # Incomplete emails: recheck now and then in case an
+                        # attachment write produced no event we noticed.
+                        timeout = max(settle, poll_interval)
+                    if leases is not None and timeout is not None:
+                        # Notice crashed nodes' leases expiring in good time.
+                        timeout = min(timeout, leases.poll_interval)
+
+                    changes = asyncio.create_task(watcher.changes(timeout))
+                    await asyncio.wait(
+                        {changes, stopping}, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if changes.done():
+                        tracker.notice(changes.result())
+                    else:
+                        changes.cancel()
+            finally:
+                stopping.cancel()
+                watcher.close()
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    loop.remove_signal_handler(sig)
+
+            c.sysmsg("Stopping: draining in-flight jobs...")
+            await pipeline.drain()
+            await runner.close()
+            runner.report()
+
+        counts = store.counts()
+        c.sysmsg(f"Watch stopped: {counts}")
+        return counts
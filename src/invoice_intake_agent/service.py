@@ -0,0 +1,379 @@
+"""Long-lived intake service over local HTTP or a Unix socket.
+
+Keeps the agents, model client, rate limiter and parse worker pool warm
+between invoices, so per-invoice latency only covers the actual work.
+
+Endpoints (HTTP/1.1, JSON unless noted, one request per connection):
+
+    POST /jobs     {"email_path": "inputs/Email.json"}
+                   or {"email": {"Message": {...}}, "attachments": {name: b64}}
+                   -> 200 with the notify result once the invoice is done
+    GET  /health   status, uptime, queue depth per stage, in-flight jobs
+    GET  /stats    pipeline, usage and hedging statistics
+    GET  /metrics  Prometheus text-format metrics
+
+SIGINT/SIGTERM stop accepting connections, finish in-flight jobs and exit.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, AsyncContextManager, Optional, Tuple
+
+from .agents.invoice_agent import build_invoice_agent
+from .config import load_settings
+from .pipeline.batch import BatchRunner
+from .pipeline.dedup import DedupIndex
+from .pipeline.jobs import JobState, JobStore
+from .pipeline.prepare import warm_up
+from .utils import console as c
+from .utils import metrics
+from .utils.hedge import hedge_stats
+from .utils.usage import USAGE
+
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class ServiceError(RuntimeError):
+    """Request error returned to the client with an HTTP status."""
+
+    def __init__(self, status: int, message: str, **extra: Any):
+        super().__init__(message)
+        self.status = status
+        self.payload = {"error": message, **extra}
+
+
+# --- HTTP plumbing -----------------------------------------------------------
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+    """Read one HTTP request; returns (method, path, body)."""
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    try:
+        method, path, _ = request_line.split(" ", 2)
+    except ValueError:
+        raise ServiceError(400, f"Malformed request line: {request_line!r}")
+
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1")
+        if line in ("\r\n", "\n", ""):
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise ServiceError(400, "Invalid Content-Length")
+    if length < 0:
+        raise ServiceError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise ServiceError(413, f"Body larger than {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path.split("?", 1)[0], body
+
+
+def _response(
+    status: int, payload: Any, content_type: str = "application/json"
+) -> bytes:
+    if isinstance(payload, str):
+        body = payload.encode("utf-8")
+    else:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    head = (
+        f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+def spool_inline_email(payload: dict[str, Any], spool_dir: str | Path) -> Path:
+    """Write an inline email (and base64 attachments) to disk.
+
+    Attachments may be given as `{"attachments": {name: base64}}` or inline
+    in the Graph-style `Message.Attachments[*].ContentBytes`. Returns the
+    path of the email JSON, next to its attachments.
+    """
+    email = payload.get("email")
+    if not isinstance(email, dict) or not isinstance(email.get("Message"), dict):
+        raise ServiceError(400, "Inline payload needs an 'email' with a 'Message'")
+    extra = payload.get("attachments") or {}
+    listed = email["Message"].get("Attachments") or []
+    if not isinstance(extra, dict) or not isinstance(listed, list):
+        raise ServiceError(400, "Invalid attachments")
+
+    message = dict(email["Message"])
+    files: dict[str, bytes] = {}
+    try:
+        for name, b64 in extra.items():
+            files[name] = base64.b64decode(b64)
+        attachments = []
+        for attachment in listed:
+            attachment = dict(attachment)
+            if "ContentBytes" in attachment:
+                files[str(attachment["Name"])] = base64.b64decode(
+                    attachment.pop("ContentBytes")
+                )
+            attachments.append(attachment)
+    except (ValueError, KeyError, TypeError) as e:
+        raise ServiceError(400, f"Invalid attachment: {e}")
+    message["Attachments"] = attachments
+    for name in files:
+        # Attachments are written next to the email under their base name.
+        if Path(name).name.lower() in ("", "..", "email.json"):
+            raise ServiceError(400, f"Invalid attachment name: {name!r}")
+
+    email_bytes = json.dumps({"Message": message}, ensure_ascii=False).encode()
+    digest = hashlib.sha256(email_bytes)
+    for name in sorted(files):
+        digest.update(files[name])
+
+    job_dir = Path(spool_dir) / digest.hexdigest()[:16]
+    job_dir.mkdir(parents=True, exist_ok=True)
+    for name, data in files.items():
+        (job_dir / Path(name).name).write_bytes(data)
+    email_path = job_dir / "Email.json"
+    email_path.write_bytes(email_bytes)
+    return email_path
+
+
+# --- Service -----------------------------------------------------------------
+
+
+class IntakeService:
+    """Warm pipeline shared by all requests."""
+
+    def __init__(
+        self,
+        *,
+        db_path: str | Path = "outputs/jobs.sqlite3",
+        spool_dir: str | Path = "outputs/spool",
+        concurrency: int = 4,
+        cpu_workers: int | None = None,
+        max_attempts: int = 3,
+        dedup_db: str | Path | None = "outputs/dedup.sqlite3",
+    ):
+        self.db_path = db_path
+        self.spool_dir = Path(spool_dir)
+        self.concurrency = concurrency
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.max_attempts = max_attempts
+        self.dedup_db = dedup_db
+        self.started_at = time.monotonic()
+        self.draining = False
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.store: Optional[JobStore] = None
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.runner: Optional[BatchRunner] = None
+        self.dedup: Optional[DedupIndex] = None
+        self._heartbeat: Optional[AsyncContextManager[JobStore]] = None
+
+    async def start(self) -> None:
+        load_settings()
+        build_invoice_agent()
+
+        self.store = JobStore(self.db_path, max_attempts=self.max_attempts)
+        self.store.recover()
+        self._heartbeat = self.store.heartbeating()
+        await self._heartbeat.__aenter__()
+        if self.dedup_db:
+            self.dedup = DedupIndex(self.dedup_db)
+        self.pool = ProcessPoolExecutor(max_workers=self.cpu_workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self.pool, warm_up) for _ in range(self.cpu_workers))
+        )
+
+        self.runner = BatchRunner(
+            self.store,
+            self.pool,
+            cpu_workers=self.cpu_workers,
+            llm_concurrency=self.concurrency,
+            dedup=self.dedup,
+        )
+        await self.runner.pipeline.__aenter__()
+
+    async def stop(self) -> None:
+        """Finish in-flight jobs, then release the pipeline and pool."""
+        self.draining = True
+        await self._idle.wait()
+        if self.runner is not None:
+            await self.runner.pipeline.drain()
+            await self.runner.pipeline.__aexit__(None, None, None)
+            await self.runner.close()
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self._heartbeat is not None:
+            await self._heartbeat.__aexit__(None, None, None)
+        if self.store is not None:
+            self.store.close()
+        if self.dedup is not None:
+            self.dedup.close()
+
+    # --- Endpoints -----------------------------------------------------------
+
+    def health(self) -> dict[str, Any]:
+        assert self.runner is not None
+        stats = self.runner.pipeline.stats()
+        return {
+            "status": "draining" if self.draining else "ok",
+            "uptime_seconds": round(time.monotonic() - self.started_at, 1),
+            "in_flight": self.in_flight,
+            "queue_depth": {s.name: s.queue_depth for s in stats},
+        }
+
+    def stats(self) -> dict[str, Any]:
+        assert self.runner is not None and self.store is not None
+        hedging = hedge_stats()
+        return {
+            "jobs": self.store.counts(),
+            "stages": {str(s.name): str(s) for s in self.runner.pipeline.stats()},
+            "usage": {name: str(u) for name, u in USAGE.items()},
+            "hedging": str(hedging) if hedging is not None else None,
+            "schedule": str(self.runner.schedule.schedule_stats),
+        }
+
+    async def submit(self, payload: dict[str, Any]) -> dict[str, Any]:
+        """Run one job to completion and return its notify result."""
+        assert self.runner is not None and self.store is not None
+        if self.draining:
+            raise ServiceError(503, "Service is draining")
+
+        if "email_path" in payload:
+            if not isinstance(payload["email_path"], str):
+                raise ServiceError(400, "'email_path' must be a string")
+            email_path = Path(payload["email_path"]).expanduser()
+            if not email_path.is_file():
+                raise ServiceError(400, f"Email file not found: {email_path}")
+        else:
+            email_path = spool_inline_email(payload, self.spool_dir)
+
+        job = self.store.enqueue(email_path)
+        if job.state == JobState.DONE:
+            return {"job_id": job.job_id, "state": str(job.state), **(job.result or {})}
+        if not self.store.claim(job.job_id):
+            job = self.store.get(job.job_id)
+            raise ServiceError(
+                409,
+                f"Job is {job.state}",
+                job_id=job.job_id,
+                next_attempt_at=job.next_attempt_at,
+            )
+
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            done = await self.runner.submit(job)
+            try:
+                result = await done
+            except Exception as e:
+                raise ServiceError(500, f"{type(e).__name__}: {e}", job_id=job.job_id)
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+        return {"job_id": job.job_id, "state": str(JobState.DONE), **result}
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serve one HTTP request on a connection."""
+        content_type = "application/json"
+        try:
+            method, path, body = await _read_request(reader)
+            if path == "/health" and method == "GET":
+                status, payload = 200, self.health()
+            elif path == "/stats" and method == "GET":
+                status, payload = 200, self.stats()
+            elif path == "/metrics" and method == "GET":
+                status, payload = 200, metrics.render()
+                content_type = metrics.CONTENT_TYPE
+            elif path == "/jobs" and method == "POST":
+                try:
+                    request = json.loads(body or b"{}")
+                except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                    raise ServiceError(400, f"Invalid JSON: {e}")
+                if not isinstance(request, dict):
+                    raise ServiceError(400, "Request body must be a JSON object")
+                status, payload = 200, await self.submit(request)
+            elif path in ("/health", "/stats", "/metrics", "/jobs"):
+                raise ServiceError(405, f"{method} not allowed on {path}")
+            else:
+                raise ServiceError(404, f"No such endpoint: {path}")
+        except ServiceError as e:
+            status, payload = e.status, e.payload
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except Exception as e:
+            c.error(f"Intake service request failed: {type(e).__name__}: {e}")
+            status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+
+        try:
+            writer.write(_response(status, payload, content_type))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def run_service(
+    *,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket_path: str | None = None,
+    **service_options: Any,
+) -> None:
+    """Serve until SIGINT/SIGTERM, then drain gracefully."""
+
+    service = IntakeService(**service_options)
+    c.sysmsg("Starting intake service (warming agents and worker pool)...")
+    await service.start()
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(service.handle, path=socket_path)
+        where = f"unix:{socket_path}"
+    else:
+        server = await asyncio.start_server(service.handle, host=host, port=port)
+        where = f"http://{host}:{port}"
+    c.sysmsg(f"Intake service listening on {where}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await stop.wait()
+    c.sysmsg("Shutting down: draining in-flight jobs...")
+    server.close()
+    await service.stop()
+    if socket_path and os.path.exists(socket_path):
+        os.unlink(socket_path)
+    c.sysmsg("Intake service stopped.")
@@ -1,12 +1,12 @@
 """Tools for notifying Customer Service of successful invoice intake."""
 
-import json
-import sys
-from pathlib import Path
+import time
 
 from agents import function_tool
 
+from ..utils.metrics import INVOICES, STAGE_SECONDS
 from ..utils.runtime import RUNTIME
+from ..utils.sinks import OutputSink, get_sink
 from ..utils import console as c
 
 from ..schema.invoice import Invoice
@@ -54,6 +54,23 @@ def compose_email(invoice: Invoice) -> dict:
     }
 
 
+def notification_name(invoice: Invoice) -> str:
+    """Output name (without extension) of an invoice's notification."""
+    return f"outbound_email_{invoice.invoice_number}"
+
+
+def write_notification(invoice: Invoice, sink: OutputSink | None = None) -> dict:
+    """Compose and write the outbound email JSON for an invoice.
+
+    Plain (non-tool) entry point. Writes to the configured output sink
+    (see `--outputs-dir` / `--output-format`) unless `sink` is given.
+    Returns paths to the created output files.
+    """
+
+    sink = sink or get_sink()
+    return sink.write(notification_name(invoice), compose_email(invoice))
+
+
 @function_tool
 def notify(invoice: Invoice) -> dict:
     """Write a Customer Service notification.
@@ -76,30 +93,21 @@ def notify(invoice: Invoice) -> dict:
         c.print(
             f"Preparing outbound notification for invoice {invoice_no}", style="dim"
         )
+        spinner_cm = c.status("[green]Writing outbound email JSON...")
     else:
         c.print("\nRunning notification tool...\n", style="dim")
         spinner_cm = c.status("[green]Notifying Customer Service...")
-        spinner_cm.__enter__()
-
-    out_dir = Path("outputs")
-    out_dir.mkdir(parents=True, exist_ok=True)
+    spinner_cm.__enter__()
 
-    json_path = out_dir / f"outbound_email_{invoice_no}.json"
-
-    email_payload = compose_email(invoice)
-
-    spinner_cm = None
-    if RUNTIME.verbose:
-        spinner_cm = c.status("[green]Writing outbound email JSON...")
-        spinner_cm.__enter__()
-
-    json_path.write_text(
-        json.dumps(email_payload, indent=2, ensure_ascii=False),
-        encoding="utf-8",
-    )
-
-    if spinner_cm is not None:
+    t0 = time.perf_counter()
+    try:
+        result = write_notification(invoice)
+    finally:
         spinner_cm.__exit__(None, None, None)
+    STAGE_SECONDS.labels("notify").observe(time.perf_counter() - t0)
+    INVOICES.labels("notified").inc()
+
+    json_path = result["outbound_email_json"]
 
     if RUNTIME.verbose:
         c.ok(f"NOTIFY successfully wrote outbound email JSON to {json_path}.")
@@ -108,9 +116,6 @@ def notify(invoice: Invoice) -> dict:
         c.rule("Notify Customer Service Complete", style="tool")
         c.print("\n\n")
     else:
-        if spinner_cm is not None:
-            spinner_cm.__exit__(None, None, None)
-            spinner_cm = None
         c.print(f"Notification written to {json_path}\n", style="dim")
 
-    return {"outbound_email_json": str(json_path)}
+    return result
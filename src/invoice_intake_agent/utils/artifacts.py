@@ -0,0 +1,344 @@
+"""Managed store for rendered PDF pages and other run artifacts.
+
+Layout under `root` (default `outputs/artifacts`):
+
+    blobs/<ab>/<sha256>.png          page renders, content-addressed
+    renders/<pdf sha256>-<dpi>.json  page digests of a rendered PDF
+    runs/<run_id>/<doc_id>.json      which PDF and pages a run processed
+    pins/<key>.json                  pages an in-flight job still needs
+
+Identical renders are stored once, and a PDF rendered before is served from
+`renders/` without running pdf2image again. Run IDs (timestamp + random
+suffix) and document IDs never collide between concurrent runs.
+
+The store keeps itself bounded: blobs unused for `max_age` seconds are
+deleted, and once the blobs exceed `max_bytes` the least recently used ones
+are evicted (LRU by mtime, which every use refreshes). Blobs used in the
+last `min_age` seconds are never evicted, and neither are pinned ones: a
+job pins its pages when they are rendered and unpins them once it is done,
+so pages survive however long the job waits for a model call, whichever
+process prunes. Pins left behind by a crash expire after `PIN_TTL`. Stores
+are plain picklable objects that can be passed to parse workers; the
+pruning bookkeeping is kept per process and per root.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from .runtime import RUNTIME
+
+GiB = 1024**3
+DAY = 24 * 3600.0
+
+RENDER_DPI = 200
+# After an eviction pass the blobs are brought down to this share of the cap.
+LOW_WATER = 0.9
+# Pins older than this belong to a crashed process and are ignored.
+PIN_TTL = DAY
+
+
+class ArtifactStoreError(RuntimeError):
+    """Error reading or updating the artifact store."""
+
+
+# Top-level entries of a store root, plus the per-second run folders written
+# before this store existed (`outputs/artifacts/<YYYYmmddHHMMSS>`).
+_LAYOUT = ("blobs", "pins", "renders", "runs")
+_LEGACY_RUN = re.compile(r"\d{14}")
+
+# Per process, per root: [blob bytes at the last prune + bytes written since,
+# time of the last prune]. Kept outside the store so that the copies pickled
+# to parse workers share it.
+_PRUNE_STATE: dict[Path, list[float]] = {}
+
+
+def new_run_id() -> str:
+    """Sortable, collision-free run ID: `YYYYmmdd-HHMMSS-<8 hex>`."""
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _touch(path: Path) -> bool:
+    """Mark a file as just used; False if it is gone (e.g. evicted)."""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _tree_usage(path: Path) -> Tuple[int, int]:
+    """(files, bytes) under `path`."""
+    files = size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                size += os.stat(os.path.join(dirpath, name)).st_size
+                files += 1
+            except FileNotFoundError:
+                pass
+    return files, size
+
+
+class ArtifactStore:
+    """Content-addressed, size-capped store of page renders."""
+
+    def __init__(
+        self,
+        root: str | Path = "outputs/artifacts",
+        *,
+        max_bytes: int | None = 2 * GiB,
+        max_age: float | None = 7 * DAY,
+        min_age: float = 600.0,
+        prune_interval: float = 300.0,
+        run_id: str | None = None,
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes or None
+        self.max_age = max_age or None
+        self.min_age = min_age
+        self.prune_interval = prune_interval
+        self.run_id = run_id or new_run_id()
+
+    @property
+    def _state(self) -> list[float]:
+        return _PRUNE_STATE.setdefault(self.root.resolve(), [0, 0.0])
+
+    # --- Blobs ---------------------------------------------------------------
+
+    def blob_path(self, digest: str, suffix: str = ".png") -> Path:
+        return self.root / "blobs" / digest[:2] / f"{digest}{suffix}"
+
+    def put(self, data: bytes, suffix: str = ".png") -> Path:
+        """Store `data` once under its SHA-256; returns the blob path."""
+        path = self.blob_path(hashlib.sha256(data).hexdigest(), suffix)
+        if not _touch(path):
+            _atomic_write(path, data)
+            self._state[0] += len(data)
+        self._maybe_prune()
+        return path
+
+    def _blobs(self) -> Iterator[Tuple[float, int, Path]]:
+        """(mtime, size, path) of every blob."""
+        blobs = self.root / "blobs"
+        if not blobs.is_dir():
+            return
+        for shard in os.scandir(blobs):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, st.st_size, Path(entry.path)
+
+    def _run_dirs(self) -> Iterator[Path]:
+        """Run folders, including those of the pre-store layout."""
+        if (self.root / "runs").is_dir():
+            yield from (self.root / "runs").iterdir()
+        if self.root.is_dir():
+            for path in self.root.iterdir():
+                if _LEGACY_RUN.fullmatch(path.name) and path.is_dir():
+                    yield path
+
+    # --- Render cache and run manifests -------------------------------------
+
+    def _render_manifest(self, pdf_sha256: str, dpi: int) -> Path:
+        return self.root / "renders" / f"{pdf_sha256}-{dpi}.json"
+
+    def cached_render(
+        self, pdf_sha256: str, dpi: int = RENDER_DPI
+    ) -> Optional[List[Path]]:
+        """Page paths of a PDF rendered before, if all of them are still stored."""
+        manifest = self._render_manifest(pdf_sha256, dpi)
+        try:
+            pages = [Path(p) for p in json.loads(manifest.read_text())["pages"]]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        pages = [self.root / p for p in pages]
+        if not all(_touch(page) for page in pages):
+            return None
+        _touch(manifest)
+        return pages
+
+    def record_render(
+        self, pdf_sha256: str, pages: List[Path], dpi: int = RENDER_DPI
+    ) -> None:
+        relative = [str(Path(p).relative_to(self.root)) for p in pages]
+        _atomic_write(
+            self._render_manifest(pdf_sha256, dpi),
+            json.dumps({"pages": relative}).encode(),
+        )
+
+    def record_document(
+        self, pdf_path: str | Path, pdf_sha256: str, pages: List[Path]
+    ) -> str:
+        """Note which pages this run used for a PDF; returns the document ID."""
+        doc_id = f"{pdf_sha256[:16]}-{uuid.uuid4().hex[:8]}"
+        manifest = {
+            "run_id": self.run_id,
+            "doc_id": doc_id,
+            "pdf_path": str(pdf_path),
+            "pdf_sha256": pdf_sha256,
+            "pages": [str(p) for p in pages],
+            "created_at": time.time(),
+        }
+        _atomic_write(
+            self.root / "runs" / self.run_id / f"{doc_id}.json",
+            json.dumps(manifest, indent=2).encode(),
+        )
+        return doc_id
+
+    # --- Pins ----------------------------------------------------------------
+
+    def _pin_path(self, key: str) -> Path:
+        return self.root / "pins" / f"{key}.json"
+
+    def pin(self, key: str, pages: List[str] | List[Path]) -> None:
+        """Keep `pages` from eviction until `unpin(key)`."""
+        relative = [str(Path(p).relative_to(self.root)) for p in pages]
+        _atomic_write(self._pin_path(key), json.dumps({"pages": relative}).encode())
+
+    def unpin(self, key: str) -> None:
+        try:
+            self._pin_path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _pinned(self, now: float) -> set[Path]:
+        """Blobs pinned by live pins; expired pins are removed."""
+        pinned: set[Path] = set()
+        pins = self.root / "pins"
+        if not pins.is_dir():
+            return pinned
+        for pin in pins.glob("*.json"):
+            try:
+                if now - pin.stat().st_mtime > PIN_TTL:
+                    pin.unlink()
+                    continue
+                pages = json.loads(pin.read_text())["pages"]
+            except (FileNotFoundError, ValueError, KeyError):
+                continue
+            pinned.update(self.root / page for page in pages)
+        return pinned
+
+    # --- Retention -----------------------------------------------------------
+
+    def _maybe_prune(self) -> None:
+        blob_bytes, pruned_at = self._state
+        over_cap = self.max_bytes is not None and blob_bytes > self.max_bytes
+        if over_cap or time.time() - pruned_at >= self.prune_interval:
+            self.prune()
+
+    def prune(self, *, now: float | None = None) -> Tuple[int, int]:
+        """Apply the age and size limits; returns (files removed, bytes freed)."""
+        now = time.time() if now is None else now
+        removed = freed = 0
+
+        def unlink(path: Path, size: int) -> None:
+            nonlocal removed, freed
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                return  # another process got there first
+            removed += 1
+            freed += size
+
+        pinned = self._pinned(now)
+        kept = []
+        for mtime, size, path in self._blobs():
+            if path in pinned:
+                kept.append((mtime, size, path))
+            elif self.max_age is not None and now - mtime > self.max_age:
+                unlink(path, size)
+            else:
+                kept.append((mtime, size, path))
+
+        total = sum(size for _, size, _ in kept)
+        if self.max_bytes is not None and total > self.max_bytes:
+            for mtime, size, path in sorted(kept):
+                if total <= self.max_bytes * LOW_WATER or now - mtime < self.min_age:
+                    break
+                if path in pinned:
+                    continue
+                unlink(path, size)
+                total -= size
+
+        if self.max_age is not None:
+            for manifest in (self.root / "renders").glob("*.json"):
+                try:
+                    if now - manifest.stat().st_mtime > self.max_age:
+                        unlink(manifest, 0)
+                except FileNotFoundError:
+                    pass
+            for run in self._run_dirs():
+                try:
+                    expired = now - run.stat().st_mtime > self.max_age
+                except FileNotFoundError:
+                    continue
+                if expired and run.name != self.run_id:
+                    shutil.rmtree(run, ignore_errors=True)
+
+        self._state[:] = [total, now]
+        return removed, freed
+
+    def usage(self) -> Tuple[int, int]:
+        """(files, bytes) currently under the store root."""
+        return _tree_usage(self.root) if self.root.is_dir() else (0, 0)
+
+    def clean(self) -> Tuple[int, int]:
+        """Delete everything in the store; returns (files, bytes) removed.
+
+        The root is renamed away first, so concurrent runs see an empty
+        store immediately instead of a half-deleted one.
+        """
+        if not self.root.exists():
+            return 0, 0
+        unexpected = sorted(
+            name
+            for name in os.listdir(self.root)
+            if name not in _LAYOUT and not _LEGACY_RUN.fullmatch(name)
+        )
+        if unexpected:
+            raise ArtifactStoreError(
+                f"Refusing to clean {self.root}: not an artifact store "
+                f"(contains {', '.join(unexpected[:3])})"
+            )
+        usage = self.usage()
+        trash = self.root.with_name(
+            f".{self.root.name}.deleting-{uuid.uuid4().hex[:8]}"
+        )
+        os.replace(self.root, trash)
+        shutil.rmtree(trash, ignore_errors=True)
+        self._state[0] = 0
+        return usage
+
+
+@lru_cache(maxsize=1)
+def get_artifact_store() -> ArtifactStore:
+    """Process-wide store configured from the runtime settings."""
+    return ArtifactStore(
+        RUNTIME.artifacts_dir,
+        max_bytes=RUNTIME.artifacts_max_bytes,
+        max_age=RUNTIME.artifacts_max_age,
+    )
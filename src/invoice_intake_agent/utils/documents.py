@@ -0,0 +1,89 @@
+"""PDF text extraction and rasterization.
+
+Kept free of agent/SDK imports so parse workers start quickly; the PDF
+backends themselves are imported on first use.
+"""
+
+import hashlib
+import io
+import warnings
+import logging
+from pathlib import Path
+from typing import List, Tuple
+
+from .artifacts import RENDER_DPI, ArtifactStore, get_artifact_store
+from .metrics import RENDER_CACHE
+
+
+def render_doc(path, store: ArtifactStore | None = None) -> Tuple[List[str], bool]:
+    """Render a document's pages; returns their paths and whether they came
+    from the render cache.
+
+    Does not count the cache lookup: in a parse worker the caller reports it
+    to the main process, whose metrics are the ones exported.
+    """
+    store = store or get_artifact_store()
+    pdf_sha256 = hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+    pages = store.cached_render(pdf_sha256)
+    cached = pages is not None
+    if pages is None:
+        from pdf2image import convert_from_path
+
+        pages = []
+        for image in convert_from_path(path, dpi=RENDER_DPI):
+            buf = io.BytesIO()
+            image.save(buf, format="PNG")
+            pages.append(store.put(buf.getvalue()))
+        store.record_render(pdf_sha256, pages)
+
+    store.record_document(path, pdf_sha256, pages)
+    return [str(page) for page in pages], cached
+
+
+def convert_doc_to_images(path, store: ArtifactStore | None = None):
+    """Convert a document to images.
+
+    Pages are stored in the artifact store (content-addressed, so identical
+    renders are kept once); a PDF rendered before is not rendered again.
+    Returns the page image paths.
+    """
+    pages, cached = render_doc(path, store)
+    RENDER_CACHE.labels("hit" if cached else "miss").inc()
+    return pages
+
+
+def extract_text_from_doc(path):
+    """Extract text from a document.
+
+    Suppress noisy warning messages from pdfminer loggers
+    (BOTH warnings and pdfminer logging).
+    """
+    from pdfminer.high_level import extract_text
+
+    # Suppress warning-based noise (in case the backend emits warnings).
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+            "ignore",
+            message=r"Could not get FontBBox from font descriptor.*",
+            category=UserWarning,
+        )
+
+        # Suppress logger-based noise from pdfminer (most common).
+        logger_names = [
+            "pdfminer",
+            "pdfminer.pdffont",
+            "pdfminer.pdfinterp",
+            "pdfminer.converter",
+        ]
+        prev_levels = {}
+        try:
+            for name in logger_names:
+                lg = logging.getLogger(name)
+                prev_levels[name] = lg.level
+                lg.setLevel(logging.ERROR)
+
+            return extract_text(path)
+        finally:
+            for name, level in prev_levels.items():
+                logging.getLogger(name).setLevel(level)
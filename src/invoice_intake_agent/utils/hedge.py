@@ -0,0 +1,250 @@
+"""Request hedging to cut tail latency on model calls.
+
+If a call has neither produced its first token nor finished within the
+tracked p-th percentile of time-to-first-token, a duplicate is started;
+whichever finishes first wins and the other is cancelled. The extra cost is
+bounded by `max_rate` (fraction of calls allowed to hedge).
+
+Time-to-first-token is measured from admission: an attempt calls `on_start`
+once the rate limiter lets it through, so time spent queueing for a permit
+neither triggers a hedge nor inflates the threshold.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import random
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# attempt(on_start, on_first_token, primary) -> result
+Attempt = Callable[[Callable[[], None], Callable[[], None], bool], Awaitable[T]]
+
+
+def _percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, int(p * len(sorted_values)))
+    return sorted_values[idx]
+
+
+class LatencyTracker:
+    """Sliding-window latency percentiles (last `window` samples)."""
+
+    def __init__(self, window: int = 500):
+        self._window: Deque[float] = deque(maxlen=window)
+        self._sorted: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self._window)
+
+    def add(self, seconds: float) -> None:
+        if len(self._window) == self._window.maxlen:
+            old = self._window[0]
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+        self._window.append(seconds)
+        bisect.insort(self._sorted, seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        return _percentile(self._sorted, p)
+
+
+@dataclass
+class HedgeStats:
+    """Counters for hedged calls.
+
+    Latencies are split by whether hedging was armed for the call. Calls
+    without it (warm-up, hedge budget exhausted, or the random control
+    sample) give the baseline the armed calls' p99 is compared against.
+    """
+
+    calls: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=10000))
+    control: Deque[float] = field(default_factory=lambda: deque(maxlen=10000))
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.calls if self.calls else 0.0
+
+    def p99(self) -> tuple[Optional[float], Optional[float]]:
+        """(p99 with hedging armed, p99 of the unhedged control calls)."""
+        return (
+            _percentile(sorted(self.latencies), 0.99),
+            _percentile(sorted(self.control), 0.99),
+        )
+
+    def __str__(self) -> str:
+        armed, control = self.p99()
+        text = (
+            f"calls {self.calls}, hedged {self.hedged} ({self.hedge_rate:.1%}), "
+            f"hedge wins {self.hedge_wins}"
+        )
+        if armed is not None and control is not None:
+            text += (
+                f", p99 {armed:.2f}s vs {control:.2f}s unhedged "
+                f"({control - armed:+.2f}s saved)"
+            )
+        return text
+
+
+class _Progress:
+    """Admission and first-token timestamps of one attempt."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.started: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.admitted = asyncio.Event()
+        self.event = asyncio.Event()
+
+    def start(self) -> None:
+        # Called again when the limiter retries; the clock restarts with it.
+        if self.first_token_at is None:
+            self.started = self.loop.time()
+            self.admitted.set()
+
+    def first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = self.loop.time()
+            self.event.set()
+
+
+class Hedger:
+    """Runs attempts with an optional hedge after the p-th percentile TTFT."""
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        *,
+        min_samples: int = 20,
+        max_rate: float = 0.1,
+        control_rate: float = 0.05,
+        window: int = 500,
+    ):
+        if not 0 < percentile < 1:
+            raise ValueError("percentile must be between 0 and 1")
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_rate = max_rate
+        self.control_rate = control_rate
+        self.ttft = LatencyTracker(window)
+        self.stats = HedgeStats()
+
+    def threshold(self) -> Optional[float]:
+        """Seconds to wait before hedging (None while warming up or over budget)."""
+        if len(self.ttft) < self.min_samples:
+            return None
+        if self.stats.hedged >= self.max_rate * max(self.stats.calls, 1):
+            return None
+        if random.random() < self.control_rate:
+            return None
+        return self.ttft.percentile(self.percentile)
+
+    async def run(
+        self, attempt: Attempt[T], *, saturated: Callable[[], bool] | None = None
+    ) -> T:
+        """Run `attempt`, hedging it with a duplicate if it is slow to start.
+
+        No hedge is sent while `saturated()` is true (e.g. the rate limiter
+        is at its concurrency limit or backing off): the duplicate would only
+        queue behind the primary and add load where it hurts most.
+        """
+
+        loop = asyncio.get_running_loop()
+        self.stats.calls += 1
+
+        primary = _Progress(loop)
+        primary_task = asyncio.create_task(
+            attempt(primary.start, primary.first_token, True)
+        )
+        tasks = {primary_task: primary}
+        winner: Optional[asyncio.Task] = None
+        delay = self.threshold()
+
+        try:
+            if delay is not None:
+                await self._race(primary_task, primary.admitted, None)
+                if not primary_task.done() and primary.started is not None:
+                    timeout = max(0.0, primary.started + delay - loop.time())
+                    slow = not await self._race(primary_task, primary.event, timeout)
+                    if slow and not (saturated is not None and saturated()):
+                        self.stats.hedged += 1
+                        hedge = _Progress(loop)
+                        hedge_task = asyncio.create_task(
+                            attempt(hedge.start, hedge.first_token, False)
+                        )
+                        tasks[hedge_task] = hedge
+
+            winner = await self._first_success(list(tasks))
+            return winner.result()
+        finally:
+            end = loop.time()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if winner is not None:
+                self._record(primary, primary_task is winner, delay is not None, end)
+
+    @staticmethod
+    async def _race(
+        task: asyncio.Task, event: asyncio.Event, timeout: Optional[float]
+    ) -> bool:
+        """Wait for `task` or `event`; whether either happened within `timeout`."""
+        waiter = asyncio.create_task(event.wait())
+        done, _ = await asyncio.wait(
+            {task, waiter}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        waiter.cancel()
+        return bool(done)
+
+    @staticmethod
+    async def _first_success(tasks: List[asyncio.Task]) -> asyncio.Task:
+        pending = set(tasks)
+        first_error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task
+                first_error = first_error or task.exception()
+        assert first_error is not None
+        raise first_error
+
+    def _record(
+        self, primary: _Progress, primary_won: bool, armed: bool, end: float
+    ) -> None:
+        if primary.started is None:
+            return
+        # Track the primary's TTFT (or a lower bound if it never got one) so
+        # that hedging itself does not drag the threshold down.
+        ttft_end = primary.first_token_at or end
+        self.ttft.add(ttft_end - primary.started)
+
+        latency = end - primary.started
+        (self.stats.latencies if armed else self.stats.control).append(latency)
+        if not primary_won:
+            self.stats.hedge_wins += 1
+
+
+_HEDGER: Optional[Hedger] = None
+
+
+def get_hedger(percentile: float) -> Hedger:
+    """The process-wide hedger for Invoice Specialist calls."""
+    global _HEDGER
+    if _HEDGER is None or _HEDGER.percentile != percentile:
+        _HEDGER = Hedger(percentile)
+    return _HEDGER
+
+
+def hedge_stats() -> Optional[HedgeStats]:
+    """Statistics of the process-wide hedger, if hedging was used."""
+    return _HEDGER.stats if _HEDGER is not None else None
@@ -0,0 +1,340 @@
+"""Prometheus-style metrics for the intake pipeline (stdlib only).
+
+Instruments are module-level, like `USAGE`, and updating one on the hot
+path costs a dict lookup, a lock and an addition. `render()` produces the
+Prometheus text exposition format (0.0.4), served by the service at
+GET /metrics or rewritten periodically to `--metrics-file` (e.g. for the
+node_exporter textfile collector).
+
+Values that are cheaper to read than to track (queue depths, job counts)
+are refreshed by collectors registered with `REGISTRY.add_collector()`,
+which run on each render.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import threading
+import uuid
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+BYTE_BUCKETS = tuple(2**n for n in range(14, 26, 1))  # 16 KiB .. 32 MiB
+
+Labels = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Registry:
+    """A set of metrics rendered together."""
+
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: "_Metric") -> None:
+        if any(m.name == metric.name for m in self._metrics):
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics.append(metric)
+
+    def add_collector(self, collect: Callable[[], None]) -> None:
+        """Run `collect()` before every render (e.g. to set gauges)."""
+        self._collectors.append(collect)
+
+    def remove_collector(self, collect: Callable[[], None]) -> None:
+        if collect in self._collectors:
+            self._collectors.remove(collect)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text format."""
+        for collect in list(self._collectors):
+            collect()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, names, values, value in metric.samples():
+                lines.append(
+                    f"{metric.name}{suffix}{_format_labels(names, values)} "
+                    f"{_format_value(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        *,
+        registry: Registry | None = REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Labels, object] = {}
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The child for one combination of label values."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(
+                    f"{self.name} expects labels {self.labelnames}, got {values}"
+                )
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def samples(self) -> Iterator[Tuple[str, Sequence[str], Labels, float]]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self, lock: threading.Lock):
+        self._lock = lock
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value(self._lock)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield "", self.labelnames, values, child.value
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("_lock", "upper", "counts", "sum")
+
+    def __init__(self, lock: threading.Lock, upper: Tuple[float, ...]):
+        self._lock = lock
+        self.upper = upper
+        self.counts = [0] * (len(upper) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.upper, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    """Distribution of observations in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        *,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry: Registry | None = REGISTRY,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry=registry)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self._lock, self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def samples(self):
+        names = self.labelnames + ("le",)
+        for values, child in list(self._children.items()):
+            with self._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for upper, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", names, values + (_format_value(upper),), cumulative
+            yield "_sum", self.labelnames, values, total
+            yield "_count", self.labelnames, values, cumulative
+
+
+# --- Intake metrics ----------------------------------------------------------
+
+INVOICES = Counter(
+    "intake_invoices_total",
+    "Invoices finished, by outcome (notified, duplicate).",
+    ["outcome"],
+)
+FAILURES = Counter("intake_failures_total", "Failed job attempts, by stage.", ["stage"])
+DUPLICATES = Counter(
+    "intake_duplicates_total",
+    "Duplicate invoices detected, by layer (exact, near, invoice_number).",
+    ["kind"],
+)
+GUARDRAIL_CHECKS = Counter(
+    "intake_guardrail_checks_total",
+    "Input guardrail checks, by result (passed, tripped).",
+    ["result"],
+)
+STAGE_SECONDS = Histogram(
+    "intake_stage_seconds",
+    "Time per job in each stage (load, text, raster, fingerprint, extract, notify).",
+    ["stage"],
+)
+MODEL_CALL_SECONDS = Histogram(
+    "intake_model_call_seconds", "Duration of model calls, by agent.", ["agent"]
+)
+MODEL_TTFT_SECONDS = Histogram(
+    "intake_model_ttft_seconds",
+    "Time from request to first output token, by agent.",
+    ["agent"],
+)
+MODEL_TOKENS = Counter(
+    "intake_model_tokens_total",
+    "Model tokens by agent and kind (input, cached, output); "
+    "cached / input is the prompt-cache hit rate.",
+    ["agent", "kind"],
+)
+INVOICE_TOKENS = Histogram(
+    "intake_invoice_tokens",
+    "Tokens per Invoice Specialist call, by kind (input, output).",
+    ["kind"],
+    buckets=TOKEN_BUCKETS,
+)
+IMAGE_PAYLOAD_BYTES = Histogram(
+    "intake_image_payload_bytes",
+    "Bytes of page images (data URLs) sent with each invoice.",
+    buckets=BYTE_BUCKETS,
+)
+RENDER_CACHE = Counter(
+    "intake_render_cache_total",
+    "Page render cache lookups in the artifact store, by result (hit, miss).",
+    ["result"],
+)
+QUEUE_DEPTH = Gauge(
+    "intake_stage_queue_depth", "Items waiting in each pipeline stage.", ["stage"]
+)
+STAGE_ACTIVE = Gauge(
+    "intake_stage_active", "Items being processed in each pipeline stage.", ["stage"]
+)
+JOBS = Gauge("intake_jobs", "Jobs in the job store, by state.", ["state"])
+QUEUE_WAIT_SECONDS = Histogram(
+    "intake_queue_wait_seconds",
+    "Time prepared emails wait for a model call, by priority class.",
+    ["priority"],
+    buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 900, 1800, 3600),
+)
+SLA_MISSED = Counter(
+    "intake_sla_missed_total",
+    "Emails whose extraction started after their SLA deadline, by priority class.",
+    ["priority"],
+)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# --- File export -------------------------------------------------------------
+
+
+def write_metrics_file(path: str | Path) -> None:
+    """Atomically replace `path` with the current metrics."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp.write_text(render(), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+@asynccontextmanager
+async def export_metrics_file(
+    path: str | Path | None, interval: float = 15.0
+) -> AsyncIterator[None]:
+    """Rewrite `path` every `interval` seconds while the block runs, and on exit.
+
+    Rendering runs on the event loop, so collectors may use loop-bound state.
+    Does nothing when `path` is None.
+    """
+    if path is None:
+        yield
+        return
+
+    async def _loop() -> None:
+        while True:
+            await asyncio.sleep(interval)
+            write_metrics_file(path)
+
+    task = asyncio.create_task(_loop())
+    try:
+        yield
+    finally:
+        task.cancel()
+        write_metrics_file(path)
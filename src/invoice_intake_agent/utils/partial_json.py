@@ -0,0 +1,84 @@
+"""Incremental parsing of a JSON object streamed in text deltas.
+
+Structured outputs arrive as a single JSON object whose top-level fields
+are emitted in schema order. `PartialObjectParser` scans each delta once,
+tracking string/escape state and nesting depth, and decodes a top-level
+field as soon as its value is complete, so callers can act on early
+fields (e.g. `invoice_number`) long before the rest of the object (e.g.
+the line items) has been generated.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional
+
+
+class PartialObjectParser:
+    """Top-level fields of a JSON object, decoded as the text streams in.
+
+    `keys` lists every top-level key seen so far (including one whose value
+    is still being generated); `fields` holds the decoded values of the
+    fields that are complete. Nested values are decoded whole, once closed.
+    """
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.keys: List[str] = []
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._value_start: Optional[int] = None
+
+    def feed(self, delta: str) -> List[str]:
+        """Add a delta; returns the names of the fields it completed."""
+        self.text += delta
+        completed: List[str] = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._value_start is None:
+                        self.keys.append(json.loads(text[self._string_start : i + 1]))
+                continue
+            if self.done:
+                break
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete(i, completed)
+                    self.done = True
+            elif self._depth == 1:
+                if ch == ":":
+                    self._value_start = i + 1
+                elif ch == ",":
+                    self._complete(i, completed)
+        self._pos = len(text)
+        return completed
+
+    def _complete(self, end: int, completed: List[str]) -> None:
+        if self._value_start is None or not self.keys:
+            return
+        key = self.keys[-1]
+        raw = self.text[self._value_start : end]
+        self._value_start = None
+        try:
+            self.fields[key] = json.loads(raw)
+        except ValueError:
+            return  # not valid JSON; left to the final validation
+        completed.append(key)
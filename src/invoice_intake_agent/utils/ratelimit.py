@@ -0,0 +1,356 @@
+"""Client-side rate limiting and retries for model calls.
+
+A `ModelRateLimiter` combines:
+
+- token buckets for requests/min and tokens/min (charged with an estimate
+  of the prompt size and corrected once the real usage is known),
+- an AIMD concurrency limit that grows slowly while calls succeed and is
+  halved when the provider answers 429, so sustained throughput settles
+  just under the quota instead of oscillating between bursts and failures,
+- jittered exponential backoff for 429/5xx/connection errors.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+import weakref
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from ..config import load_settings
+
+T = TypeVar("T")
+
+# Rough prompt-size heuristics used before the real usage is known.
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 1500
+OUTPUT_TOKENS = 1000
+
+
+def estimate_tokens(
+    text: str = "", *, images: int = 0, output: int = OUTPUT_TOKENS
+) -> int:
+    """Estimate the tokens a request will consume (prompt + expected output)."""
+    return len(text) // CHARS_PER_TOKEN + images * IMAGE_TOKENS + output
+
+
+def estimate_input_tokens(input_data: Any, *, output: int = OUTPUT_TOKENS) -> int:
+    """Estimate tokens for agent input (a string or a list of messages).
+
+    Image parts are counted at `IMAGE_TOKENS` rather than by the length of
+    their base64 data URL.
+    """
+    if isinstance(input_data, str):
+        return estimate_tokens(input_data, output=output)
+
+    chars, images = 0, 0
+    for message in input_data:
+        content = message.get("content", "") if isinstance(message, dict) else ""
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content:
+            if part.get("type") == "input_image":
+                images += 1
+            else:
+                chars += len(part.get("text", ""))
+    return chars // CHARS_PER_TOKEN + images * IMAGE_TOKENS + output
+
+
+# --- Error classification ----------------------------------------------------
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    """Whether the provider rejected the call for exceeding a rate limit."""
+    return (
+        _status_code(exc) == 429 and getattr(exc, "code", None) != "insufficient_quota"
+    )
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """Whether a failed model call is worth retrying (429, 5xx, network)."""
+    status = _status_code(exc)
+    if status is not None:
+        return is_throttle_error(exc) or status >= 500 or status in (408, 409)
+
+    from openai import APIConnectionError  # includes APITimeoutError
+
+    return isinstance(exc, APIConnectionError)
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Server-suggested delay in seconds, if the error response carries one."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def backoff_delay(attempt: int, *, base: float = 1.0, cap: float = 60.0) -> float:
+    """Full-jitter exponential backoff for the given (0-based) retry."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+async def retry_with_backoff(
+    fn: Callable[[], Awaitable[T]],
+    *,
+    max_retries: int = 5,
+    base: float = 1.0,
+    cap: float = 60.0,
+    on_retry: Callable[[int, BaseException, float], None] | None = None,
+) -> T:
+    """Await `fn()`, retrying retryable errors with jittered backoff."""
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable_error(e):
+                raise
+            delay = retry_after(e) or backoff_delay(attempt, base=base, cap=cap)
+            if on_retry is not None:
+                on_retry(attempt + 1, e, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+# --- Limiters ----------------------------------------------------------------
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `per_minute / 60` per second."""
+
+    def __init__(self, per_minute: float, *, burst_seconds: float = 10.0):
+        if per_minute <= 0:
+            raise ValueError("per_minute must be positive")
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        """Wait until `amount` tokens are available and take them (FIFO)."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """Return (positive) or charge (negative) tokens after the fact."""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class AIMDConcurrency:
+    """Concurrency limit with additive increase / multiplicative decrease.
+
+    Each success adds `1 / limit` (about +1 per round of calls); a 429, or
+    latency well above the running average, cuts the limit. Decreases are
+    spaced by `cooldown` seconds so one burst of 429s counts once.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        *,
+        minimum: int = 1,
+        maximum: int = 32,
+        decrease: float = 0.5,
+        latency_factor: float = 3.0,
+        cooldown: float = 5.0,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.avg_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    @property
+    def saturated(self) -> bool:
+        """At the limit, or within `cooldown` of the last decrease."""
+        return self.in_flight >= int(self.limit) or (
+            self._last_decrease > 0
+            and time.monotonic() - self._last_decrease < self.cooldown
+        )
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def _cut(self, factor: float) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(float(self.minimum), self.limit * factor)
+            self._last_decrease = now
+
+    def on_success(self, latency: float) -> None:
+        if (
+            self.avg_latency is not None
+            and latency > self.latency_factor * self.avg_latency
+        ):
+            # Gentle cut: slow responses usually mean we are queueing upstream.
+            self._cut(0.9)
+        else:
+            self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+        self.avg_latency = (
+            latency
+            if self.avg_latency is None
+            else 0.9 * self.avg_latency + 0.1 * latency
+        )
+
+    def on_throttle(self) -> None:
+        self._cut(self.decrease)
+
+
+@dataclass
+class Permit:
+    """Handle for one admitted call; set `actual_tokens` once usage is known."""
+
+    estimated_tokens: int
+    actual_tokens: Optional[int] = None
+
+
+class ModelRateLimiter:
+    """Shared requests/min, tokens/min and concurrency limiter for model calls.
+
+    Quotas are scaled by `headroom` so the client aims slightly below the
+    provider limits rather than exactly at them.
+    """
+
+    def __init__(
+        self,
+        *,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        concurrency: AIMDConcurrency | None = None,
+        headroom: float = 0.9,
+    ):
+        self.requests = TokenBucket(requests_per_minute * headroom)
+        self.tokens = TokenBucket(tokens_per_minute * headroom)
+        self.concurrency = concurrency or AIMDConcurrency()
+        self.throttled = 0
+        self.retries = 0
+        self._backoff_until = 0.0
+
+    def saturated(self) -> bool:
+        """Whether extra calls would only add pressure: the concurrency limit
+        is reached or was just cut, or a retry is backing off."""
+        return self.concurrency.saturated or time.monotonic() < self._backoff_until
+
+    @asynccontextmanager
+    async def slot(
+        self, estimated_tokens: int, *, concurrency: bool = True
+    ) -> AsyncIterator[Permit]:
+        """Admit one call.
+
+        Use `concurrency=False` for calls nested inside another admitted call
+        (guardrails, the orchestrator) so they cannot deadlock on the limit.
+        """
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
+        if concurrency:
+            await self.concurrency.acquire()
+
+        permit = Permit(estimated_tokens)
+        t0 = time.monotonic()
+        try:
+            yield permit
+        except Exception as e:
+            if is_throttle_error(e):
+                self.throttled += 1
+                self.concurrency.on_throttle()
+            raise
+        else:
+            if concurrency:
+                self.concurrency.on_success(time.monotonic() - t0)
+        finally:
+            if concurrency:
+                await self.concurrency.release()
+            if permit.actual_tokens is not None:
+                self.tokens.adjust(estimated_tokens - permit.actual_tokens)
+
+    async def call(
+        self,
+        fn: Callable[[Permit], Awaitable[T]],
+        *,
+        estimated_tokens: int,
+        concurrency: bool = True,
+        max_retries: int = 5,
+    ) -> T:
+        """Run `fn(permit)` under the limiter, retrying 429/5xx with backoff."""
+
+        async def once() -> T:
+            async with self.slot(estimated_tokens, concurrency=concurrency) as permit:
+                return await fn(permit)
+
+        def count_retry(attempt: int, exc: BaseException, delay: float) -> None:
+            self.retries += 1
+            self._backoff_until = max(self._backoff_until, time.monotonic() + delay)
+
+        return await retry_with_backoff(
+            once, max_retries=max_retries, on_retry=count_retry
+        )
+
+
+# One limiter per event loop: its locks and conditions belong to the loop
+# that first waits on them, and the CLI may run several loops in a row.
+_LIMITERS: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ModelRateLimiter]
+_LIMITERS = weakref.WeakKeyDictionary()
+
+
+def get_model_limiter() -> ModelRateLimiter:
+    """The running loop's limiter, configured from `config` on first use."""
+    loop = asyncio.get_running_loop()
+    limiter = _LIMITERS.get(loop)
+    if limiter is None:
+        settings = load_settings()
+        limiter = _LIMITERS[loop] = ModelRateLimiter(
+            requests_per_minute=settings.rpm_limit,
+            tokens_per_minute=settings.tpm_limit,
+            concurrency=AIMDConcurrency(
+                initial=min(4, settings.max_concurrency),
+                maximum=settings.max_concurrency,
+            ),
+        )
+    return limiter
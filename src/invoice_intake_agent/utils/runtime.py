@@ -19,6 +19,13 @@ class RuntimeConfig:
     log_level: LogLevel = LogLevel.MINIMAL
     color: bool = True
     email_path: str | None = None
+    hedge_percentile: float | None = None
+    outputs_dir: str = "outputs"
+    output_format: str = "json"
+    artifacts_dir: str = "outputs/artifacts"
+    artifacts_max_bytes: int | None = 2 * 1024**3
+    artifacts_max_age: float | None = 7 * 24 * 3600.0
+    vip_senders: tuple[str, ...] = ()
 
     @property
     def verbose(self) -> bool:
@@ -41,6 +48,13 @@ def set_runtime(
     log_level: str | None = None,
     verbose: bool = False,
     color: bool = True,
+    hedge_percentile: float | None = None,
+    outputs_dir: str = "outputs",
+    output_format: str = "json",
+    artifacts_dir: str = "outputs/artifacts",
+    artifacts_max_bytes: int | None = 2 * 1024**3,
+    artifacts_max_age: float | None = 7 * 24 * 3600.0,
+    vip_senders: tuple[str, ...] = (),
 ) -> None:
     """Set the runtime configuration from CLI arguments."""
     level = RUNTIME.log_level
@@ -63,3 +77,10 @@ def set_runtime(
     RUNTIME.log_level = level
     RUNTIME.color = color
     RUNTIME.email_path = email_path
+    RUNTIME.hedge_percentile = hedge_percentile
+    RUNTIME.outputs_dir = outputs_dir
+    RUNTIME.output_format = output_format
+    RUNTIME.artifacts_dir = artifacts_dir
+    RUNTIME.artifacts_max_bytes = artifacts_max_bytes
+    RUNTIME.artifacts_max_age = artifacts_max_age
+    RUNTIME.vip_senders = vip_senders
@@ -0,0 +1,288 @@
+"""Output sinks for outbound notification emails.
+
+- `FileSink` writes one JSON file per notification. Each file is written
+  to a temporary name, fsynced and hard-linked into place, so readers never
+  see a partial file and an existing notification is never overwritten:
+  a different payload under a taken name gets a numeric suffix instead.
+- `JsonlSink` appends one compact JSON line per notification to a single
+  file and fsyncs it every `fsync_every` lines or `fsync_interval` seconds,
+  so a downstream ingester reads one file instead of listing thousands.
+- `SinkWriter` moves writes onto a single background thread, batching
+  whatever is queued into one `write_many` call, so the event loop never
+  waits on the disk.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import errno
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+from .runtime import RUNTIME
+
+OUTPUT_FORMATS = ("json", "json-compact", "jsonl")
+JSONL_NAME = "outbound_emails.jsonl"
+
+# One notification: (name without extension, payload).
+Record = Tuple[str, dict]
+
+
+class OutputSinkError(RuntimeError):
+    """Error writing notification output."""
+
+
+def safe_name(name: str) -> str:
+    """File-system safe version of `name` (e.g. an invoice number)."""
+    return re.sub(r"[^\w.-]+", "_", name).strip("._") or "unnamed"
+
+
+def serialize(payload: Any, *, compact: bool = False) -> bytes:
+    if compact:
+        text = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    else:
+        text = json.dumps(payload, ensure_ascii=False, indent=2)
+    return text.encode("utf-8")
+
+
+class OutputSink:
+    """Base class: a destination for notification payloads."""
+
+    def write(self, name: str, payload: dict) -> dict:
+        """Write one payload; returns where it went."""
+        raise NotImplementedError
+
+    def write_many(self, records: List[Record]) -> List[dict]:
+        return [self.write(name, payload) for name, payload in records]
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class FileSink(OutputSink):
+    """One JSON file per notification, written atomically, never clobbered."""
+
+    def __init__(self, out_dir: str | Path = "outputs", *, compact: bool = False):
+        self.out_dir = Path(out_dir)
+        self.compact = compact
+
+    def _link_unique(self, tmp: Path, data: bytes, name: str) -> Path:
+        """Link `tmp` to the first free `name[_n].json`; reuse identical files."""
+        for n in range(1, 10_000):
+            path = self.out_dir / (f"{name}.json" if n == 1 else f"{name}_{n}.json")
+            try:
+                os.link(tmp, path)
+                return path
+            except FileExistsError:
+                # A retry of the same job: keep the file that is already there.
+                if path.stat().st_size == len(data) and path.read_bytes() == data:
+                    return path
+            except OSError as e:
+                if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EXDEV):
+                    raise
+                # No hard links on this filesystem; rename (racy but atomic).
+                if path.exists():
+                    continue
+                os.replace(tmp, path)
+                return path
+        raise OutputSinkError(f"No free file name for {name} in {self.out_dir}")
+
+    def write(self, name: str, payload: dict) -> dict:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        name = safe_name(name)
+        data = serialize(payload, compact=self.compact)
+
+        tmp = self.out_dir / f".{name}.{uuid.uuid4().hex}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            path = self._link_unique(tmp, data, name)
+        finally:
+            tmp.unlink(missing_ok=True)
+        return {"outbound_email_json": str(path)}
+
+
+class JsonlSink(OutputSink):
+    """Append-only JSONL file with periodic fsync.
+
+    Each batch of lines is appended with a single `write()` on an O_APPEND
+    descriptor, so on a local filesystem lines from concurrent writers
+    (threads or processes on one host) do not interleave. NFS and most
+    network filesystems emulate O_APPEND on the client (find the end, then
+    write), so writers on different hosts can overwrite each other's lines:
+    give each node its own file there. If the kernel writes only part of a
+    batch (e.g. with the disk nearly full), the rest is appended right after.
+    """
+
+    def __init__(
+        self,
+        path: str | Path = "outputs/outbound_emails.jsonl",
+        *,
+        fsync_every: int = 100,
+        fsync_interval: float = 1.0,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def write(self, name: str, payload: dict) -> dict:
+        return self.write_many([(name, payload)])[0]
+
+    def write_many(self, records: List[Record]) -> List[dict]:
+        lines = [serialize(payload, compact=True) + b"\n" for _, payload in records]
+        with self._lock:
+            if self._fd < 0:
+                raise OutputSinkError(f"Sink is closed: {self.path}")
+            data = memoryview(b"".join(lines))
+            while data:
+                written = os.write(self._fd, data)
+                if written == 0:
+                    raise OutputSinkError(f"Nothing written to {self.path}")
+                data = data[written:]
+            end = os.lseek(self._fd, 0, os.SEEK_CUR)
+            self._unsynced += len(lines)
+            if (
+                self._unsynced >= self.fsync_every
+                or time.monotonic() - self._synced_at >= self.fsync_interval
+            ):
+                self._sync()
+
+        # Byte offset of each line, so a record can be located in the file.
+        results, offset = [], end - sum(len(line) for line in lines)
+        for line in lines:
+            results.append({"outbound_email_json": str(self.path), "offset": offset})
+            offset += len(line)
+        return results
+
+    def _sync(self) -> None:
+        os.fsync(self._fd)
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._fd >= 0 and self._unsynced:
+                self._sync()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fd >= 0:
+                self._sync()
+                os.close(self._fd)
+                self._fd = -1
+
+
+def make_sink(out_dir: str | Path = "outputs", fmt: str = "json") -> OutputSink:
+    """Build the sink for an `--output-format`."""
+    if fmt == "json":
+        return FileSink(out_dir)
+    if fmt == "json-compact":
+        return FileSink(out_dir, compact=True)
+    if fmt == "jsonl":
+        return JsonlSink(Path(out_dir) / JSONL_NAME)
+    raise ValueError(
+        f"Unknown output format: {fmt!r} (expected one of {OUTPUT_FORMATS})"
+    )
+
+
+def notification_files(out_dir: str | Path = "outputs") -> List[Path]:
+    """Notification files written to `out_dir` by any output format."""
+    out_dir = Path(out_dir)
+    files = sorted(out_dir.glob("outbound_email_*.json"))
+    if (out_dir / JSONL_NAME).exists():
+        files.append(out_dir / JSONL_NAME)
+    return files
+
+
+@lru_cache(maxsize=1)
+def get_sink() -> OutputSink:
+    """Process-wide sink configured from the runtime settings."""
+    return make_sink(RUNTIME.outputs_dir, RUNTIME.output_format)
+
+
+class SinkWriter:
+    """Writes to a sink from one background thread.
+
+    `write()` queues a record and resolves once it is written; records that
+    queue up while the thread is busy are written together, which for JSONL
+    means one `write()` syscall and at most one fsync per batch.
+    """
+
+    def __init__(self, sink: OutputSink, *, max_batch: int = 256):
+        self.sink = sink
+        self.max_batch = max_batch
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            closing = batch[-1] is None
+            batch = [entry for entry in batch if entry is not None]
+            if batch:
+                self._write(batch)
+            if closing:
+                return
+
+    def _write(self, batch: list) -> None:
+        try:
+            results = self.sink.write_many([record for record, _, _ in batch])
+        except Exception as e:
+            for _, loop, future in batch:
+                loop.call_soon_threadsafe(_set_exception, future, e)
+            return
+        for (_, loop, future), result in zip(batch, results):
+            loop.call_soon_threadsafe(_set_result, future, result)
+
+    async def write(self, name: str, payload: dict) -> dict:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="sink-writer", daemon=True
+            )
+            self._thread.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put(((name, payload), loop, future))
+        return await future
+
+    async def close(self) -> None:
+        """Write everything queued and flush the sink (which stays open)."""
+        if self._thread is not None:
+            self._queue.put(None)
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+        await asyncio.to_thread(self.sink.flush)
+
+
+def _set_result(future: asyncio.Future, result: Any) -> None:
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, e: BaseException) -> None:
+    if not future.done():
+        future.set_exception(e)
@@ -0,0 +1,73 @@
+"""Token usage and prompt-cache accounting per agent."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from .metrics import MODEL_CALL_SECONDS, MODEL_TOKENS
+
+
+@dataclass
+class AgentUsage:
+    """Accumulated usage of one agent across calls.
+
+    Latency is split by whether the call hit the provider's prompt cache,
+    so the effect of the cacheable prefix can be checked at volume.
+    """
+
+    calls: int = 0
+    input_tokens: int = 0
+    cached_tokens: int = 0
+    output_tokens: int = 0
+    cached_calls: int = 0
+    cached_seconds: float = 0.0
+    uncached_seconds: float = 0.0
+
+    @property
+    def cache_hit_rate(self) -> float:
+        """Share of input tokens served from the prompt cache."""
+        return self.cached_tokens / self.input_tokens if self.input_tokens else 0.0
+
+    def mean_latency(self, cached: bool) -> Optional[float]:
+        n = self.cached_calls if cached else self.calls - self.cached_calls
+        total = self.cached_seconds if cached else self.uncached_seconds
+        return total / n if n else None
+
+    def __str__(self) -> str:
+        text = (
+            f"calls {self.calls}, input {self.input_tokens} tok "
+            f"({self.cached_tokens} cached, {self.cache_hit_rate:.0%}), "
+            f"output {self.output_tokens} tok"
+        )
+        hit, miss = self.mean_latency(True), self.mean_latency(False)
+        if hit is not None and miss is not None:
+            text += f", mean latency {hit:.2f}s cached vs {miss:.2f}s uncached"
+        return text
+
+
+USAGE: Dict[str, AgentUsage] = {}
+
+
+def record_usage(agent_name: str, usage: Any, seconds: float) -> AgentUsage:
+    """Add one call's `agents.Usage` to the per-agent totals."""
+
+    stats = USAGE.setdefault(agent_name, AgentUsage())
+    details = getattr(usage, "input_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) or 0
+
+    stats.calls += 1
+    stats.input_tokens += usage.input_tokens
+    stats.output_tokens += usage.output_tokens
+    stats.cached_tokens += cached
+    if cached:
+        stats.cached_calls += 1
+        stats.cached_seconds += seconds
+    else:
+        stats.uncached_seconds += seconds
+
+    MODEL_CALL_SECONDS.labels(agent_name).observe(seconds)
+    MODEL_TOKENS.labels(agent_name, "input").inc(usage.input_tokens)
+    MODEL_TOKENS.labels(agent_name, "cached").inc(cached)
+    MODEL_TOKENS.labels(agent_name, "output").inc(usage.output_tokens)
+    return stats
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import time
+
+import pytest
+
+from invoice_intake_agent.utils.artifacts import (
+    ArtifactStore,
+    ArtifactStoreError,
+    new_run_id,
+)
+from invoice_intake_agent.utils.documents import convert_doc_to_images
+from invoice_intake_agent.utils.metrics import RENDER_CACHE
+
+
+def _age(path, seconds):
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+
+
+def test_run_ids_are_unique_within_a_second():
+    assert len({new_run_id() for _ in range(1000)}) == 1000
+
+
+def test_identical_renders_are_stored_once_and_cached(tmp_path):
+    store = ArtifactStore(tmp_path / "artifacts")
+    first = store.put(b"page-1")
+    assert store.put(b"page-1") == first
+    second = store.put(b"page-2")
+
+    assert store.cached_render("pdf") is None
+    store.record_render("pdf", [first, second])
+    assert store.cached_render("pdf") == [first, second]
+
+    # A render with an evicted page is not served from the cache.
+    second.unlink()
+    assert store.cached_render("pdf") is None
+
+
+def test_documents_of_concurrent_runs_do_not_collide(tmp_path):
+    a = ArtifactStore(tmp_path / "artifacts")
+    b = ArtifactStore(tmp_path / "artifacts")
+    page = a.put(b"page")
+    ids = {a.record_document("x.pdf", "f" * 64, [page]) for _ in range(5)}
+    ids.add(b.record_document("x.pdf", "f" * 64, [page]))
+    assert len(ids) == 6
+    assert len(list((tmp_path / "artifacts" / "runs").iterdir())) == 2
+
+
+def test_prune_evicts_least_recently_used_down_to_the_cap(tmp_path):
+    store = ArtifactStore(
+        tmp_path / "artifacts", max_bytes=2500, max_age=None, min_age=60
+    )
+    pages = [store.put(bytes([i]) * 1000) for i in range(4)]
+    for i, page in enumerate(pages):
+        _age(page, 1000 - i * 100)  # pages[0] is the least recently used
+    _age(pages[3], 10)  # in use by an in-flight job
+
+    removed, freed = store.prune()
+    assert (removed, freed) == (2, 2000)
+    assert [p.exists() for p in pages] == [False, False, True, True]
+
+
+def test_prune_applies_retention(tmp_path):
+    store = ArtifactStore(tmp_path / "artifacts", max_bytes=None, max_age=3600)
+    old, new = store.put(b"old"), store.put(b"new")
+    _age(old, 7200)
+    store.prune()
+    assert not old.exists() and new.exists()
+
+
+def test_pinned_pages_survive_eviction_until_unpinned(tmp_path):
+    """Pages of a job waiting for its model call outlive min_age and max_age."""
+    store = ArtifactStore(
+        tmp_path / "artifacts", max_bytes=1500, max_age=3600, min_age=60
+    )
+    pinned, other = store.put(b"a" * 1000), store.put(b"b" * 1000)
+    store.pin("job-1", [pinned])
+    _age(pinned, 7200)
+    _age(other, 1000)
+
+    store.prune()
+    assert pinned.exists() and not other.exists()
+
+    store.unpin("job-1")
+    store.prune()
+    assert not pinned.exists()
+
+
+def test_clean_removes_store_and_refuses_other_directories(tmp_path):
+    store = ArtifactStore(tmp_path / "artifacts")
+    store.put(b"page")
+    assert store.clean()[0] == 1
+    assert not (tmp_path / "artifacts").exists()
+
+    (tmp_path / "notes.txt").write_text("keep me")
+    with pytest.raises(ArtifactStoreError):
+        ArtifactStore(tmp_path).clean()
+    assert (tmp_path / "notes.txt").exists()
+
+
+def test_legacy_run_folders_are_pruned_and_cleaned(tmp_path):
+    root = tmp_path / "artifacts"
+    legacy = root / "20240101120000"
+    legacy.mkdir(parents=True)
+    (legacy / "image_0.png").write_bytes(b"png")
+    _age(legacy, 30 * 86400)
+
+    ArtifactStore(root, max_age=86400).prune()
+    assert not legacy.exists()
+
+    (root / "20240102120000").mkdir()
+    ArtifactStore(root).clean()
+    assert not root.exists()
+
+
+def test_render_cache_hits_are_counted(tmp_path):
+    """A PDF rendered before is served from the store and counted as a hit."""
+    pdf = tmp_path / "invoice.pdf"
+    pdf.write_bytes(b"%PDF-1.4 fake")
+    store = ArtifactStore(tmp_path / "artifacts")
+    page = store.put(b"page")
+    store.record_render(hashlib.sha256(pdf.read_bytes()).hexdigest(), [page])
+
+    hits = RENDER_CACHE.labels("hit")
+    before = hits.value
+    assert convert_doc_to_images(pdf, store) == [str(page)]
+    assert hits.value == before + 1
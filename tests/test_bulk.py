@@ -0,0 +1,210 @@
+import asyncio
+import json
+import re
+import time
+
+from invoice_intake_agent.config import BATCH_PRICE_FACTOR
+from invoice_intake_agent.pipeline.bulk import (
+    UPLOAD_GRACE,
+    BatchManifest,
+    BulkRunner,
+    LocalBatchBackend,
+)
+from invoice_intake_agent.pipeline.jobs import JobState, JobStore
+from invoice_intake_agent.pipeline.prepare import PreparedEmail
+from invoice_intake_agent.utils.sinks import FileSink
+
+USAGE = {
+    "input_tokens": 1000,
+    "input_tokens_details": {"cached_tokens": 400},
+    "output_tokens": 200,
+}
+
+
+def _body(output: dict) -> dict:
+    return {
+        "status": "completed",
+        "output": [
+            {"type": "reasoning", "summary": []},
+            {
+                "type": "message",
+                "content": [{"type": "output_text", "text": json.dumps(output)}],
+            },
+        ],
+        "usage": USAGE,
+    }
+
+
+def respond(body: dict) -> dict:
+    """Fake model: reads the invoice number from the PDF text."""
+    text = body["input"][0]["content"][1]["text"]
+    number = re.search(r"PDF Text: (\S*)", text).group(1)
+    if body["text"]["format"]["schema"]["title"] == "GuardrailOutput":
+        if number == "UNSAFE":
+            return _body({"is_safe": False, "reasoning": "inappropriate"})
+        return _body({"is_safe": True, "reasoning": "invoice"})
+    if number == "ERROR":
+        raise RuntimeError("model unavailable")
+    return _body(
+        {
+            "vendor_name": "Acme",
+            "invoice_number": number,
+            "payment_terms": "Net 10",
+            "summary": "- Acme",
+        }
+    )
+
+
+def _submit(tmp_path, store, runner, numbers):
+    """Claim and add one prepared email per invoice number."""
+    image = tmp_path / "page1.png"
+    image.write_bytes(b"\x89PNG fake")
+    jobs = {}
+    for number in numbers:
+        path = tmp_path / f"{number}.json"
+        path.write_text(json.dumps({"number": number}))
+        job = store.enqueue(path)
+        assert store.claim(job.job_id)
+        store.advance(job.job_id, JobState.EXTRACT, timings={"load": 0.1})
+        prepared = PreparedEmail(
+            email_path=str(path),
+            email={
+                "Subject": "Invoice",
+                "From": {"EmailAddress": {"Address": "ap@acme.example"}},
+            },
+            pdf_path=str(tmp_path / f"{number}.pdf"),
+            pdf_text=number,
+            pdf_images=[str(image)],
+        )
+        asyncio.run(runner.add(job, prepared))
+        jobs[number] = job.job_id
+    return jobs
+
+
+def test_submit_then_collect_notifies_each_invoice(tmp_path):
+    backend = LocalBatchBackend(tmp_path / "local", respond)
+    with JobStore(tmp_path / "jobs.db", max_attempts=2) as store:
+        runner = BulkRunner(
+            store, backend, bulk_dir=tmp_path / "bulk", sink=FileSink(tmp_path / "out")
+        )
+        jobs = _submit(tmp_path, store, runner, ["INV-1", "INV-2", " ", "UNSAFE"])
+        manifest = asyncio.run(runner.flush())
+
+        assert manifest is not None and manifest.requests == 8
+        lines = [json.loads(l) for l in open(manifest.input_file)]
+        assert {l["custom_id"] for l in lines} == {
+            f"{job_id}:{kind}"
+            for job_id in jobs.values()
+            for kind in ("invoice", "guardrail")
+        }
+        invoice_request = lines[0]
+        assert invoice_request["url"] == "/v1/responses"
+        assert invoice_request["body"]["text"]["format"]["strict"] is True
+        assert invoice_request["body"]["prompt_cache_key"].startswith(
+            "invoice-specialist-"
+        )
+        image = invoice_request["body"]["input"][0]["content"][2]
+        assert image["image_url"].startswith("data:image/png;base64,")
+        assert {store.get(j).state for j in jobs.values()} == {JobState.SUBMITTED}
+        # Parked jobs are neither ready nor reclaimed as stale.
+        assert store.ready() == []
+        assert store.recover(stale_after=0) == 0
+
+        assert asyncio.run(runner.collect()) == 0
+        report = runner.report
+        assert (report.notified, report.failed) == (2, 2)
+        assert store.get(jobs["INV-1"]).state == JobState.DONE
+        assert (tmp_path / "out" / "outbound_email_INV-1.json").exists()
+        assert "Guardrail tripped" in store.get(jobs["UNSAFE"]).last_error
+        assert "Invoice number is required" in store.get(jobs[" "]).last_error
+        assert store.sender_terms("ap@acme.example") == 10
+        assert [stage for _, stage, _ in store.timings(jobs["INV-1"])] == [
+            "load",
+            "batch",
+            "notify",
+        ]
+
+        assert report.input_tokens == 8 * 1000
+        assert report.cost(BATCH_PRICE_FACTOR) == report.cost() * BATCH_PRICE_FACTOR
+        assert "saved $" in "\n".join(report.lines([4.0], concurrency=4))
+
+        # Collected once: the manifest is marked and not ingested again.
+        saved = BatchManifest.load(next((tmp_path / "bulk" / "batches").glob("*.json")))
+        assert saved.status == "completed" and saved.collected_at is not None
+        assert runner.pending() == []
+
+
+def test_failed_requests_go_back_to_the_retry_path(tmp_path):
+    backend = LocalBatchBackend(tmp_path / "local", respond)
+    with JobStore(tmp_path / "jobs.db") as store:
+        runner = BulkRunner(
+            store, backend, bulk_dir=tmp_path / "bulk", sink=FileSink(tmp_path / "out")
+        )
+        jobs = _submit(tmp_path, store, runner, ["ERROR"])
+        asyncio.run(runner.flush())
+        asyncio.run(runner.collect())
+
+        job = store.get(jobs["ERROR"])
+        assert job.state == JobState.FAILED
+        assert "model unavailable" in job.last_error
+        assert store.ready(now=job.next_attempt_at)[0].job_id == job.job_id
+
+
+def test_input_files_roll_over_without_splitting_jobs(tmp_path):
+    backend = LocalBatchBackend(tmp_path / "local", respond)
+    with JobStore(tmp_path / "jobs.db") as store:
+        runner = BulkRunner(
+            store,
+            backend,
+            bulk_dir=tmp_path / "bulk",
+            sink=FileSink(tmp_path / "out"),
+            max_requests=5,
+        )
+        _submit(tmp_path, store, runner, ["A-1", "A-2", "A-3"])
+        asyncio.run(runner.flush())
+
+        assert [m.requests for m in runner.submitted] == [4, 2]
+        asyncio.run(runner.collect())
+        assert runner.report.notified == 3
+
+
+class CrashingBackend(LocalBatchBackend):
+    """Creates the batch, then dies before the caller learns its ID."""
+
+    def submit(self, path, name):
+        super().submit(path, name)
+        raise KeyboardInterrupt
+
+
+def test_interrupted_upload_is_found_instead_of_resubmitted(tmp_path):
+    """Jobs of an upload cut short stay parked and are collected, not requeued."""
+    with JobStore(tmp_path / "jobs.db") as store:
+        runner = BulkRunner(
+            store,
+            CrashingBackend(tmp_path / "local", respond),
+            bulk_dir=tmp_path / "bulk",
+            sink=FileSink(tmp_path / "out"),
+        )
+        jobs = _submit(tmp_path, store, runner, ["INV-1"])
+        try:
+            asyncio.run(runner.flush())
+        except KeyboardInterrupt:
+            pass
+        assert store.get(jobs["INV-1"]).state == JobState.SUBMITTED
+        assert store.recover(stale_after=0) == 0
+
+        runner = BulkRunner(
+            store,
+            LocalBatchBackend(tmp_path / "local", respond),
+            bulk_dir=tmp_path / "bulk",
+            sink=FileSink(tmp_path / "out"),
+        )
+        (pending,) = runner.pending()
+        assert pending.batch_id is None
+        # Within the grace period the upload may still be running elsewhere.
+        assert asyncio.run(runner.collect()) == 1
+
+        pending.submitted_at = time.time() - UPLOAD_GRACE - 1
+        pending.save(tmp_path / "bulk")
+        assert asyncio.run(runner.collect()) == 0
+        assert store.get(jobs["INV-1"]).state == JobState.DONE
@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+
+
+def _run(code):
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    env["PYTHONPATH"] = str(SRC)
+    return subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True
+    )
+
+
+def test_cli_import_is_lightweight():
+    """Importing the CLI does not pull in the SDK, Rich or PDF backends."""
+    proc = _run(
+        "import sys, invoice_intake_agent.cli\n"
+        "heavy = {'agents', 'openai', 'rich', 'pdfminer', 'pdf2image', 'dotenv'}\n"
+        "print(sorted(heavy & set(sys.modules)))"
+    )
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip() == "[]"
+
+
+def test_help_works_without_api_key():
+    """`--help` no longer requires OPENAI_API_KEY."""
+    proc = _run(
+        "import sys; sys.argv = ['invoice-intake-agent', '--help']\n"
+        "from invoice_intake_agent.cli import main; main()"
+    )
+    assert proc.returncode == 0, proc.stderr
+    assert "usage: invoice-intake-agent" in proc.stdout
+
+
+def test_clean_deletes_outputs_and_artifacts_without_prompt(tmp_path, capsys):
+    from invoice_intake_agent.cli import run_clean
+    from invoice_intake_agent.utils.artifacts import ArtifactStore
+
+    ArtifactStore(tmp_path / "artifacts").put(b"page")
+    (tmp_path / "outbound_email_1.json").write_text("{}")
+    (tmp_path / "jobs.sqlite3").write_text("")
+
+    run_clean(
+        artifacts_dir=str(tmp_path / "artifacts"),
+        outputs_dir=str(tmp_path),
+        artifacts=True,
+        outputs=True,
+        yes=True,
+    )
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["jobs.sqlite3"]
+    assert "Cleaned." in capsys.readouterr().out
+
+
+def test_lease_dir_is_rejected_outside_batch_and_watch():
+    """--serve does not take part in leases, so --lease-dir is an error there."""
+    proc = _run(
+        "import sys; sys.argv = ['invoice-intake-agent', '--serve', "
+        "'--lease-dir', 'leases']\n"
+        "from invoice_intake_agent.cli import main; main()"
+    )
+    assert proc.returncode == 2
+    assert "--lease-dir only applies to --batch and --watch" in proc.stderr
@@ -0,0 +1,85 @@
+from PIL import Image, ImageDraw
+
+from invoice_intake_agent.pipeline.dedup import (
+    DedupIndex,
+    Fingerprint,
+    dhash,
+    fingerprint,
+)
+
+TEXT = (
+    "ACME Supplies Ltd. INVOICE No. INV-1042 Date 2024-03-01 Bill to: Contoso "
+    "Retail, 12 Harbour Road. Description Qty Unit price Total. Copy paper A4 "
+    "10 4.50 45.00. Toner cartridge black 2 60.00 120.00. Subtotal 165.00 "
+    "VAT 20% 33.00 Total due 198.00 EUR. Payment terms: net 30 days. "
+    "Please quote the invoice number with your payment. Thank you."
+)
+
+
+def _fp(tmp_path, name, text, page=None):
+    pdf = tmp_path / f"{name}.pdf"
+    pdf.write_bytes(f"%PDF {name} {text}".encode())
+    return fingerprint(pdf, text, page)
+
+
+def _page(tmp_path, name, offset=0):
+    image = Image.new("L", (400, 560), 255)
+    draw = ImageDraw.Draw(image)
+    for i in range(12):
+        y = 40 + i * 40 + offset
+        draw.rectangle([40, y, 120 + (i * 23) % 240, y + 12], fill=0)
+    path = tmp_path / f"{name}.png"
+    image.save(path)
+    return path
+
+
+def test_exact_and_near_duplicates(tmp_path):
+    """Same bytes match exactly; re-rendered text with the same numbers is near."""
+    index = DedupIndex(tmp_path / "dedup.db")
+    original = _fp(tmp_path, "a", TEXT, _page(tmp_path, "a"))
+    index.add(original, job_id="job-a", vendor_name="ACME", invoice_number="INV-1042")
+
+    assert index.match(original).kind == "exact"
+
+    forwarded = _fp(
+        tmp_path,
+        "b",
+        "  FWD:\n" + TEXT.upper().replace(". ", ".\n"),
+        _page(tmp_path, "b", offset=1),
+    )
+    match = index.match(forwarded)
+    assert match is not None and match.kind == "near"
+    assert match.original.job_id == "job-a" and match.similarity >= 0.9
+
+
+def test_same_template_different_numbers_is_not_a_duplicate(tmp_path):
+    index = DedupIndex(tmp_path / "dedup.db")
+    index.add(_fp(tmp_path, "a", TEXT), job_id="job-a")
+
+    other = _fp(tmp_path, "b", TEXT.replace("INV-1042", "INV-1043"))
+    assert index.match(other) is None
+
+
+def test_first_page_only_match_is_advisory(tmp_path):
+    index = DedupIndex(tmp_path / "dedup.db")
+    index.add(Fingerprint("a" * 64, dhash=dhash(_page(tmp_path, "a"))), job_id="job-a")
+
+    match = index.match(Fingerprint("b" * 64, dhash=dhash(_page(tmp_path, "b"))))
+    assert match is not None and match.kind == "visual" and not match.conclusive
+
+
+def test_invoice_number_collision(tmp_path):
+    index = DedupIndex(tmp_path / "dedup.db")
+    index.add(
+        Fingerprint("a" * 64),
+        job_id="job-a",
+        vendor_name="ACME Supplies Ltd.",
+        invoice_number="INV-1042",
+        result={"outbound_email_json": "outputs/outbound_email_INV-1042.json"},
+    )
+
+    match = index.find_invoice("acme supplies ltd", "inv 1042")
+    assert match is not None and match.kind == "invoice_number"
+    assert match.original.result["outbound_email_json"].endswith("INV-1042.json")
+    assert index.find_invoice("Other Vendor", "INV-1042") is None
+    assert index.find_invoice("ACME Supplies Ltd.", None) is None
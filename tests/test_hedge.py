@@ -0,0 +1,108 @@
+import asyncio
+
+from invoice_intake_agent.utils.hedge import Hedger, LatencyTracker
+
+
+def test_latency_tracker_sliding_window():
+    """Percentiles only cover the most recent samples."""
+    tracker = LatencyTracker(window=10)
+    for i in range(100):
+        tracker.add(float(i))
+    assert len(tracker) == 10
+    assert tracker.percentile(0.0) == 90.0
+    assert tracker.percentile(0.99) == 99.0
+
+
+def _warm(hedger, seconds=0.01):
+    for _ in range(hedger.min_samples):
+        hedger.ttft.add(seconds)
+
+
+def test_slow_primary_is_hedged_and_cancelled():
+    """A primary with no first token past the threshold loses to the hedge."""
+    cancelled = []
+
+    async def attempt(on_start, on_first_token, primary):
+        on_start()
+        try:
+            await asyncio.sleep(1.0 if primary else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(primary)
+            raise
+        on_first_token()
+        return "primary" if primary else "hedge"
+
+    hedger = Hedger(0.9, max_rate=1.0, control_rate=0.0)
+    _warm(hedger)
+    assert asyncio.run(hedger.run(attempt)) == "hedge"
+    assert cancelled == [True]
+    assert hedger.stats.hedged == 1 and hedger.stats.hedge_wins == 1
+    assert hedger.stats.hedge_rate == 1.0
+
+
+def test_fast_primary_is_not_hedged():
+    """A primary that streams its first token in time is never duplicated."""
+    starts = []
+
+    async def attempt(on_start, on_first_token, primary):
+        on_start()
+        starts.append(primary)
+        on_first_token()
+        await asyncio.sleep(0.05)
+        return "done"
+
+    hedger = Hedger(0.9, max_rate=1.0, control_rate=0.0)
+    _warm(hedger)
+    assert asyncio.run(hedger.run(attempt)) == "done"
+    assert starts == [True]
+    assert hedger.stats.hedged == 0
+
+
+def test_no_hedging_until_warm():
+    """Without enough samples, calls run unhedged and count as control."""
+
+    async def attempt(on_start, on_first_token, primary):
+        on_start()
+        await asyncio.sleep(0.01)
+        return primary
+
+    hedger = Hedger(0.9)
+    assert asyncio.run(hedger.run(attempt)) is True
+    assert hedger.stats.hedged == 0
+    assert len(hedger.stats.control) == 1
+
+
+def test_hedge_clock_starts_at_admission():
+    """Time queued for a rate-limit permit does not count towards the hedge."""
+    starts = []
+
+    async def attempt(on_start, on_first_token, primary):
+        starts.append(primary)
+        await asyncio.sleep(0.1)  # waiting for the limiter
+        on_start()
+        await asyncio.sleep(0.005)
+        on_first_token()
+        return "done"
+
+    hedger = Hedger(0.9, max_rate=1.0, control_rate=0.0)
+    _warm(hedger)
+    assert asyncio.run(hedger.run(attempt)) == "done"
+    assert starts == [True]
+    assert max(hedger.ttft._sorted) < 0.1
+
+
+def test_no_hedge_while_saturated():
+    """A slow primary is not duplicated while the limiter is saturated."""
+    starts = []
+
+    async def attempt(on_start, on_first_token, primary):
+        on_start()
+        starts.append(primary)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    hedger = Hedger(0.9, max_rate=1.0, control_rate=0.0)
+    _warm(hedger)
+    assert asyncio.run(hedger.run(attempt, saturated=lambda: True)) == "done"
+    assert starts == [True]
+    assert hedger.stats.hedged == 0
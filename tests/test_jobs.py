@@ -0,0 +1,140 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from invoice_intake_agent.pipeline.jobs import JobState, JobStore
+
+
+def _email(tmp_path, name="Email.json", body="hello"):
+    path = tmp_path / name
+    path.write_text('{"Message": {"Subject": "%s"}}' % body, encoding="utf-8")
+    return path
+
+
+def test_enqueue_is_idempotent(tmp_path):
+    """Re-enqueueing the same content does not create a second job."""
+    with JobStore(tmp_path / "jobs.db") as store:
+        a = store.enqueue(_email(tmp_path, "a.json"))
+        b = store.enqueue(_email(tmp_path, "b.json"))
+        assert a.job_id == b.job_id
+        assert store.counts() == {"pending": 1}
+
+
+def test_job_lifecycle_records_timings(tmp_path):
+    """A job moves through the stages and records per-stage timings."""
+    with JobStore(tmp_path / "jobs.db") as store:
+        job = store.enqueue(_email(tmp_path))
+        assert store.claim(job.job_id)
+        assert not store.claim(job.job_id)
+        for state in (
+            JobState.TEXT,
+            JobState.RASTER,
+            JobState.EXTRACT,
+            JobState.NOTIFY,
+        ):
+            store.advance(job.job_id, state)
+        store.complete(job.job_id, {"outbound_email_json": "x.json"})
+
+        done = store.get(job.job_id)
+        assert done.state == JobState.DONE
+        assert done.result == {"outbound_email_json": "x.json"}
+        stages = [stage for _, stage, _ in store.timings(job.job_id)]
+        assert stages == ["load", "text", "raster", "extract", "notify"]
+        assert store.ready() == []
+
+
+def test_failed_jobs_back_off_and_give_up(tmp_path):
+    """Failures are retried after backoff, then left failed."""
+    with JobStore(tmp_path / "jobs.db", max_attempts=2, backoff_base=60) as store:
+        job = store.enqueue(_email(tmp_path))
+        store.claim(job.job_id)
+        failed = store.fail(job.job_id, "boom")
+        assert failed.next_attempt_at > time.time()
+        assert store.ready() == []
+        assert [j.job_id for j in store.ready(now=failed.next_attempt_at)] == [
+            job.job_id
+        ]
+        assert store.failed_since(time.time() - 60)[0].last_error == "boom"
+
+        store._db.execute("UPDATE jobs SET next_attempt_at = 0")
+        assert store.claim(job.job_id)
+        store.fail(job.job_id, "boom again")
+        assert store.next_retry_at() is None
+
+
+def test_recover_requeues_stale_jobs(tmp_path):
+    """Jobs abandoned mid-stage are requeued on restart."""
+    with JobStore(tmp_path / "jobs.db") as store:
+        job = store.enqueue(_email(tmp_path))
+        store.claim(job.job_id)
+        store.advance(job.job_id, JobState.EXTRACT)
+        assert [j.job_id for j in store.stuck(older_than=0)] == [job.job_id]
+        # Still owned by this (live) worker: left alone however long it waits.
+        assert store.recover(stale_after=0) == 0
+
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        store._db.execute(
+            "UPDATE jobs SET owner = ?", (f"{socket.gethostname()}:{dead.pid}",)
+        )
+        assert store.recover() == 1
+        assert store.get(job.job_id).state == JobState.PENDING
+
+
+def test_recover_uses_owner_heartbeats(tmp_path):
+    """Owners elsewhere are judged by their heartbeat, not the job's age."""
+    with JobStore(tmp_path / "jobs.db") as store:
+        job = store.enqueue(_email(tmp_path))
+        store.claim(job.job_id)
+        store._db.execute("UPDATE jobs SET owner = 'other-host:1', updated_at = 0")
+        store._db.execute(
+            "INSERT INTO owners (owner, heartbeat_at) VALUES ('other-host:1', ?)",
+            (time.time(),),
+        )
+        assert store.recover(stale_after=60) == 0
+
+        store._db.execute("UPDATE owners SET heartbeat_at = 0")
+        assert store.recover(stale_after=60) == 1
+
+
+def test_recover_after_restart_with_the_same_pid(tmp_path):
+    """A restarted worker with the PID and host of the crashed one (PID 1 in a
+    container) still requeues the jobs its predecessor left behind."""
+    with JobStore(tmp_path / "jobs.db") as crashed:
+        job = crashed.enqueue(_email(tmp_path))
+        crashed.claim(job.job_id)
+    with JobStore(tmp_path / "jobs.db") as restarted:
+        assert restarted.recover() == 1
+        assert restarted.get(job.job_id).state == JobState.PENDING
+
+        # Owners recorded before the nonce was added look the same.
+        restarted.claim(job.job_id)
+        restarted._db.execute(
+            "UPDATE jobs SET owner = ?", (f"{socket.gethostname()}:{os.getpid()}",)
+        )
+        assert restarted.recover() == 1
+
+
+def test_idle_worker_keeps_its_jobs_while_heartbeating(tmp_path):
+    """A worker with no job transitions for longer than `stale_after` keeps
+    its jobs as long as its heartbeat task runs."""
+    with (
+        JobStore(tmp_path / "jobs.db") as worker,
+        JobStore(tmp_path / "jobs.db") as other,
+    ):
+        worker.owner = "other-host:1:abcd"
+        job = worker.enqueue(_email(tmp_path))
+        worker.claim(job.job_id)
+        worker.advance(job.job_id, JobState.EXTRACT)
+
+        async def idle():
+            async with worker.heartbeating(interval=0.05):
+                await asyncio.sleep(0.4)
+                return other.recover(stale_after=0.2)
+
+        assert asyncio.run(idle()) == 0
+        time.sleep(0.3)
+        assert other.recover(stale_after=0.2) == 1
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+from invoice_intake_agent.pipeline.batch import BatchRunner, WorkItem
+from invoice_intake_agent.pipeline.jobs import JobState, JobStore
+from invoice_intake_agent.pipeline.leases import LeaseCoordinator, claim_shares
+
+JOBS = [f"job{i:03d}" for i in range(60)]
+
+
+def _node(root, node_id, capacity, queue):
+    """Claim and 'process' jobs until every one is done somewhere."""
+    leases = LeaseCoordinator(root, node_id=node_id, capacity=capacity, ttl=5.0)
+    leases.register()
+    processed = []
+    while True:
+        pending = [j for j in JOBS if leases.finished(j) is None]
+        if not pending:
+            break
+        for job_id in leases.order(pending, key=lambda j: j):
+            if leases.acquire(job_id):
+                time.sleep(0.002 / capacity)
+                leases.finish(job_id, {"node": node_id})
+                processed.append(job_id)
+                break
+        else:
+            time.sleep(0.001)
+    leases.close()
+    queue.put((node_id, processed))
+
+
+def test_nodes_process_each_job_exactly_once(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    nodes = [
+        ctx.Process(target=_node, args=(str(tmp_path), f"n{i}", 1 + i, queue))
+        for i in range(3)
+    ]
+    for p in nodes:
+        p.start()
+    results = dict(queue.get(timeout=60) for _ in nodes)
+    for p in nodes:
+        p.join(timeout=10)
+
+    processed = [job for jobs in results.values() for job in jobs]
+    assert sorted(processed) == JOBS
+    for job_id in JOBS:
+        done = json.loads((tmp_path / f"{job_id}.done").read_text())
+        assert job_id in results[done["result"]["node"]]
+    assert not list(tmp_path.glob("*.lease"))
+
+
+def test_stale_lease_of_a_crashed_node_is_reclaimed(tmp_path):
+    crashed = LeaseCoordinator(tmp_path, node_id="crashed", ttl=1.0)
+    alive = LeaseCoordinator(tmp_path, node_id="alive", ttl=1.0)
+    assert crashed.acquire("job")
+    assert not alive.acquire("job")
+
+    # No heartbeat for longer than the TTL.
+    lease = tmp_path / "job.lease"
+    old = time.time() - 10
+    os.utime(lease, (old, old))
+    assert alive.acquire("job")
+    assert json.loads(lease.read_text())["node"] == "alive"
+
+    # The crashed node finds out on its next heartbeat and leaves it alone.
+    assert crashed.heartbeat() == ["job"]
+    crashed.release("job")
+    assert lease.exists()
+
+
+def test_restarted_node_takes_back_its_own_leases(tmp_path):
+    before = LeaseCoordinator(tmp_path, node_id="n1")
+    assert before.acquire("job")
+    after = LeaseCoordinator(tmp_path, node_id="n1")
+    assert after.acquire("job")
+    assert not LeaseCoordinator(tmp_path, node_id="n2").acquire("job")
+
+
+def test_rendezvous_shares_follow_capacity():
+    shares = claim_shares({"small": 1.0, "big": 3.0}, (str(i) for i in range(4000)))
+    assert 0.7 < shares["big"] / 4000 < 0.8
+
+
+def _runner(tmp_path, node_id, max_attempts=3):
+    store = JobStore(tmp_path / f"{node_id}.db", max_attempts=max_attempts)
+    leases = LeaseCoordinator(tmp_path / "leases", node_id=node_id)
+    leases.register()
+    runner = BatchRunner(store, None, cpu_workers=1, llm_concurrency=1, leases=leases)
+    return store, runner
+
+
+def _emails(tmp_path, n):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir(exist_ok=True)
+    paths = []
+    for i in range(n):
+        path = inbox / f"email{i:03d}.json"
+        path.write_text(json.dumps({"n": i}))
+        paths.append(path)
+    return paths
+
+
+def test_failed_attempts_and_backoff_are_shared(tmp_path):
+    (email,) = _emails(tmp_path, 1)
+    store_a, runner_a = _runner(tmp_path, "a", max_attempts=2)
+    store_b, runner_b = _runner(tmp_path, "b", max_attempts=2)
+    job_a, job_b = store_a.enqueue(email), store_b.enqueue(email)
+
+    assert runner_a.claim(job_a)
+    asyncio.run(
+        runner_a._on_error("extract", WorkItem(job_a), RuntimeError("bad email"))
+    )
+
+    # Node b does not retry at once: it takes over the attempt and backoff.
+    assert not runner_b.claim(job_b)
+    adopted = store_b.get(job_b.job_id)
+    assert adopted.state == JobState.FAILED and adopted.attempts == 1
+    assert "bad email" in adopted.last_error
+    assert store_b.ready() == []
+
+    # Once due, b makes the last attempt; its failure ends the job everywhere.
+    store_b.postpone(job_b.job_id, 0)
+    (retry,) = store_b.ready()
+    os.utime(tmp_path / "leases" / f"{job_b.job_id}.failed", (0, 0))
+    assert runner_b.claim(retry)
+    asyncio.run(
+        runner_b._on_error("extract", WorkItem(retry), RuntimeError("bad email"))
+    )
+    assert not runner_a.claim(store_a.get(job_a.job_id))
+    assert store_a.get(job_a.job_id).attempts == 2
+    assert store_a.next_retry_at() is None
+
+
+def test_jobs_leased_elsewhere_do_not_block_the_ready_window(tmp_path):
+    emails = _emails(tmp_path, 70)
+    store_a, runner_a = _runner(tmp_path, "a")
+    store_b, runner_b = _runner(tmp_path, "b")
+    for path in emails:
+        store_a.enqueue(path)
+        store_b.enqueue(path)
+    for job in store_a.ready(limit=69):
+        assert runner_a.claim(job)
+
+    claimed = []
+    for _ in range(3):
+        claimed += [job for job in store_b.ready(limit=64) if runner_b.claim(job)]
+    assert [Path(job.email_path).name for job in claimed] == ["email069.json"]
+    # The others are postponed locally until a lease poll interval from now.
+    retry_at = store_b.next_retry_at()
+    assert 0 < retry_at - time.time() <= runner_b.leases.poll_interval
+
+
+def test_feed_stops_while_waiting_for_a_slot(tmp_path):
+    store, runner = _runner(tmp_path, "a")
+    for path in _emails(tmp_path, 5):
+        store.enqueue(path)
+
+    async def main():
+        stop = asyncio.Event()
+        feeding = asyncio.create_task(runner.feed(stop=stop))
+        await asyncio.sleep(0.05)
+        # Both unstarted slots are held: feed waits for one until stopped.
+        assert not feeding.done()
+        stop.set()
+        return await asyncio.wait_for(feeding, 1.0)
+
+    assert asyncio.run(main()) == 2
+    assert store.counts() == {"load": 2, "pending": 3}
+    assert runner._unstarted.locked()
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from invoice_intake_agent.utils.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+    export_metrics_file,
+)
+
+
+def test_render_counters_gauges_and_labels():
+    registry = Registry()
+    jobs = Counter("jobs_total", "Jobs.", ["outcome"], registry=registry)
+    depth = Gauge("queue_depth", "Depth.", registry=registry)
+
+    jobs.labels("ok").inc()
+    jobs.labels("ok").inc(2)
+    jobs.labels('bad "one"').inc()
+    registry.add_collector(lambda: depth.set(7))
+
+    text = registry.render()
+    assert "# TYPE jobs_total counter" in text
+    assert 'jobs_total{outcome="ok"} 3' in text
+    assert 'jobs_total{outcome="bad \\"one\\""} 1' in text
+    assert "# TYPE queue_depth gauge\nqueue_depth 7\n" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    seconds = Histogram("t_seconds", "T.", buckets=(0.1, 1), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3):
+        seconds.observe(value)
+
+    lines = registry.render().splitlines()
+    assert 't_seconds_bucket{le="0.1"} 2' in lines
+    assert 't_seconds_bucket{le="1"} 3' in lines
+    assert 't_seconds_bucket{le="+Inf"} 4' in lines
+    assert "t_seconds_sum 3.65" in lines
+    assert "t_seconds_count 4" in lines
+
+
+def test_label_count_is_checked():
+    registry = Registry()
+    counter = Counter("c_total", "C.", ["stage"], registry=registry)
+    with pytest.raises(ValueError):
+        counter.labels("a", "b")
+    with pytest.raises(ValueError):
+        Counter("c_total", "Again.", registry=registry)
+
+
+def test_export_metrics_file_writes_on_exit(tmp_path):
+    path = tmp_path / "metrics" / "intake.prom"
+
+    async def scenario():
+        async with export_metrics_file(path, interval=0.01):
+            await asyncio.sleep(0.05)
+            assert path.exists()
+
+    asyncio.run(scenario())
+    assert "# TYPE intake_invoices_total counter" in path.read_text()
+    assert [p.name for p in path.parent.iterdir()] == ["intake.prom"]
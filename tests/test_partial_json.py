@@ -0,0 +1,52 @@
+import json
+
+from invoice_intake_agent.agents.invoice_agent import _invoice_number_state
+from invoice_intake_agent.utils.partial_json import PartialObjectParser
+
+INVOICE = {
+    "vendor_name": 'Acme "Supply", {Ltd}',
+    "invoice_number": "AOS-20931",
+    "line_items": [{"sku": "PEN-12", "quantity": 10}, {"sku": "PAD-50"}],
+    "total_due": 113.0,
+    "summary": "- a\n- b",
+}
+
+
+def _feed_in_chunks(parser, text, size):
+    completed = []
+    for i in range(0, len(text), size):
+        completed += parser.feed(text[i : i + size])
+    return completed
+
+
+def test_fields_are_decoded_as_they_complete():
+    text = json.dumps(INVOICE, indent=1)
+    for size in (1, 3, 17, len(text)):
+        parser = PartialObjectParser()
+        assert _feed_in_chunks(parser, text, size) == list(INVOICE)
+        assert parser.fields == INVOICE
+        assert parser.done
+
+
+def test_number_is_known_before_the_line_items_finish():
+    parser = PartialObjectParser()
+    text = json.dumps(INVOICE)
+    parser.feed(text[: text.index('"line_items"') + 20])
+    assert parser.fields == {
+        "vendor_name": INVOICE["vendor_name"],
+        "invoice_number": "AOS-20931",
+    }
+    assert parser.keys[-1] == "line_items"
+    assert _invoice_number_state(parser) is True
+
+
+def test_missing_number_is_detected_once_output_moves_past_it():
+    parser = PartialObjectParser()
+    parser.feed('{"vendor_name": "Acme", "invoice_')
+    assert _invoice_number_state(parser) is None
+    parser.feed('date": "2025-')
+    assert _invoice_number_state(parser) is False
+
+    blank = PartialObjectParser()
+    blank.feed('{"vendor_name": null, "invoice_number": " ",')
+    assert _invoice_number_state(blank) is False
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+from invoice_intake_agent.config import Settings
+from invoice_intake_agent.utils import ratelimit
+from invoice_intake_agent.utils.ratelimit import (
+    AIMDConcurrency,
+    ModelRateLimiter,
+    TokenBucket,
+    retry_with_backoff,
+)
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code, code=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.code = code
+
+
+def test_token_bucket_limits_burst():
+    """Tokens beyond the burst capacity have to wait for the refill."""
+
+    async def main():
+        bucket = TokenBucket(per_minute=600, burst_seconds=1)  # 10/s, burst 10
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        for _ in range(12):
+            await bucket.acquire()
+        return loop.time() - t0
+
+    assert asyncio.run(main()) >= 0.15
+
+
+def test_aimd_grows_on_success_and_halves_on_throttle():
+    """Successes raise the limit slowly; a 429 cuts it multiplicatively."""
+    aimd = AIMDConcurrency(initial=4, maximum=8, cooldown=0)
+    for _ in range(8):
+        aimd.on_success(1.0)
+    assert 5 <= aimd.limit <= 6
+    aimd.on_throttle()
+    assert aimd.limit < 3
+    for _ in range(20):
+        aimd.on_throttle()
+    assert aimd.limit == aimd.minimum
+
+
+def test_retry_with_backoff_retries_only_retryable_errors():
+    """429/5xx are retried; other errors propagate immediately."""
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise FakeAPIError(503 if len(calls) == 1 else 429)
+        return "ok"
+
+    async def bad_request():
+        calls.append(1)
+        raise FakeAPIError(400)
+
+    assert asyncio.run(retry_with_backoff(flaky, base=0.001)) == "ok"
+    assert len(calls) == 3
+
+    calls.clear()
+    with pytest.raises(FakeAPIError):
+        asyncio.run(retry_with_backoff(bad_request, base=0.001))
+    assert len(calls) == 1
+
+
+def test_limiter_records_throttles_and_token_usage():
+    """429s are retried and feed back into the AIMD limit."""
+
+    async def main():
+        limiter = ModelRateLimiter(
+            requests_per_minute=6000,
+            tokens_per_minute=60000,
+            concurrency=AIMDConcurrency(initial=4, cooldown=0),
+        )
+        attempts = []
+
+        async def call(permit):
+            attempts.append(permit)
+            if len(attempts) == 1:
+                raise FakeAPIError(429)
+            permit.actual_tokens = 10
+            return "done"
+
+        result = await limiter.call(call, estimated_tokens=500)
+        return limiter, result
+
+    limiter, result = asyncio.run(main())
+    assert result == "done"
+    assert limiter.throttled == 1 and limiter.retries == 1
+    assert limiter.concurrency.limit < 4
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_limiter_reports_saturation():
+    """At the concurrency limit or just after a 429, extra calls would queue."""
+    limiter = ModelRateLimiter(
+        requests_per_minute=6000,
+        tokens_per_minute=60000,
+        concurrency=AIMDConcurrency(initial=2, cooldown=60),
+    )
+    assert not limiter.saturated()
+    limiter.concurrency.in_flight = 2
+    assert limiter.saturated()
+    limiter.concurrency.in_flight = 0
+    limiter.concurrency.on_throttle()
+    assert limiter.saturated()
+
+
+def test_each_event_loop_gets_its_own_limiter(monkeypatch):
+    """Consecutive asyncio.run calls do not share loop-bound primitives."""
+    monkeypatch.setattr(ratelimit, "load_settings", lambda: Settings("sk-test"))
+
+    async def use():
+        limiter = ratelimit.get_model_limiter()
+        assert ratelimit.get_model_limiter() is limiter
+        async with limiter.slot(10):
+            pass
+        return limiter
+
+    first, second = asyncio.run(use()), asyncio.run(use())
+    assert first is not second
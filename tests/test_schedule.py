@@ -0,0 +1,78 @@
+import asyncio
+
+from invoice_intake_agent.pipeline.jobs import JobStore
+from invoice_intake_agent.pipeline.schedule import (
+    DeadlineQueue,
+    SlaPolicy,
+    invoice_terms_days,
+    parse_terms_days,
+)
+
+
+def _email(subject="Invoice", body="", sender="ap@vendor.example"):
+    return {
+        "Subject": subject,
+        "Body": {"Content": body},
+        "From": {"EmailAddress": {"Address": sender}},
+    }
+
+
+def test_classify_from_cheap_signals():
+    policy = SlaPolicy(vip_senders=frozenset({"@vip.example"}))
+
+    assert policy.classify(_email("FINAL NOTICE: invoice 12"))[0] == "urgent"
+    assert policy.classify(_email(body="Terms: due on receipt"))[0] == "urgent"
+    assert policy.classify(_email(sender="Boss@VIP.example"))[0] == "high"
+    assert policy.classify(_email(body="Match to PO (terms Net 10)"))[0] == "high"
+    assert policy.classify(_email(body="terms Net 30"))[0] == "normal"
+    # No terms in the email: fall back to what the sender's invoices said.
+    assert policy.classify(_email(), known_terms_days=5) == (
+        "urgent",
+        "net 5 (vendor history)",
+    )
+
+
+def test_terms_parsing():
+    assert parse_terms_days("Net 30") == 30
+    assert parse_terms_days("net-15 days") == 15
+    assert parse_terms_days("Payment upon receipt") == 0
+    assert parse_terms_days("Thanks!") is None
+    assert invoice_terms_days(None, "2025-03-03", "2025-03-18") == 15
+    assert invoice_terms_days("2/10 Net 45", "x", "y") == 45
+
+
+def test_deadline_of_mail_that_was_already_late():
+    policy = SlaPolicy()
+    assert policy.deadline("urgent", received=1000.0, queued=1100.0) == 1300.0
+    # Received long before it was queued: due now rather than in the past.
+    assert policy.deadline("urgent", received=0.0, queued=10_000.0) == 10_000.0
+
+
+def test_deadline_queue_serves_earliest_deadline_and_records_waits():
+    queue = DeadlineQueue(schedule=lambda item: item)
+
+    async def scenario():
+        for item in [("normal", 3600.0), ("urgent", 300.0), ("high", 900.0)]:
+            await queue.put(item)
+        return [await queue.get() for _ in range(3)]
+
+    order = asyncio.run(scenario())
+    assert [priority for priority, _ in order] == ["urgent", "high", "normal"]
+    stats = queue.schedule_stats
+    assert {p: len(w) for p, w in stats.waits.items()} == {
+        "urgent": 1,
+        "high": 1,
+        "normal": 1,
+    }
+    # The deadlines are epoch seconds in 1970, so every get was late.
+    assert stats.missed == {"urgent": 1, "high": 1, "normal": 1}
+    assert "urgent 1 (wait p50" in str(stats)
+
+
+def test_sender_terms_are_remembered(tmp_path):
+    with JobStore(tmp_path / "jobs.db") as store:
+        assert store.sender_terms("ap@vendor.example") is None
+        store.remember_terms("ap@vendor.example", 30)
+        store.remember_terms("ap@vendor.example", 10)
+        assert store.sender_terms("ap@vendor.example") == 10
+        assert store.sender_terms(None) is None
@@ -0,0 +1,159 @@
+import asyncio
+import base64
+import json
+
+import pytest
+
+from invoice_intake_agent.pipeline.jobs import JobStore
+from invoice_intake_agent.pipeline.schedule import DeadlineQueue
+from invoice_intake_agent.pipeline.stages import Pipeline, Stage
+from invoice_intake_agent.service import (
+    IntakeService,
+    ServiceError,
+    spool_inline_email,
+)
+
+
+class FakeRunner:
+    """Completes every job immediately with a fixed notify result."""
+
+    def __init__(self, store):
+        self.store = store
+        self.schedule = DeadlineQueue(schedule=lambda item: ("normal", 0.0))
+        self.pipeline = Pipeline(
+            [Stage("extract", self._extract, queue=self.schedule)], on_error=None
+        )
+        self.submitted = 0
+
+    async def _extract(self, item):
+        return None
+
+    async def submit(self, job):
+        self.submitted += 1
+        self.store.complete(job.job_id, {"outbound_email_json": "out.json"})
+        done = asyncio.get_running_loop().create_future()
+        done.set_result({"outbound_email_json": "out.json"})
+        return done
+
+
+async def _request(port, method, path, payload=None, raw=False):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    head, _, body = data.partition(b"\r\n\r\n")
+    return int(head.split()[1]), body.decode() if raw else json.loads(body)
+
+
+def test_spool_inline_email_extracts_content_bytes(tmp_path):
+    """Graph-style ContentBytes attachments are written next to the email."""
+    payload = {
+        "email": {
+            "Message": {
+                "Subject": "Invoice",
+                "Attachments": [
+                    {
+                        "Name": "Invoice.pdf",
+                        "ContentType": "application/pdf",
+                        "ContentBytes": base64.b64encode(b"%PDF-1.4").decode(),
+                    }
+                ],
+            }
+        }
+    }
+    path = spool_inline_email(payload, tmp_path)
+    assert (path.parent / "Invoice.pdf").read_bytes() == b"%PDF-1.4"
+    saved = json.loads(path.read_text())
+    assert "ContentBytes" not in saved["Message"]["Attachments"][0]
+    assert spool_inline_email(payload, tmp_path) == path
+
+
+def test_spool_inline_email_rejects_reserved_attachment_names(tmp_path):
+    """An attachment may not replace the email it is spooled next to."""
+    email = {"Message": {"Subject": "Invoice", "Attachments": []}}
+    for name in ("Email.json", "../email.JSON", ".."):
+        payload = {"email": email, "attachments": {name: "e30="}}
+        with pytest.raises(ServiceError) as e:
+            spool_inline_email(payload, tmp_path)
+        assert e.value.status == 400
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_service_endpoints(tmp_path):
+    """/jobs returns the notify result; repeats are served from the store."""
+    email = tmp_path / "Email.json"
+    email.write_text('{"Message": {"Subject": "x"}}')
+
+    async def main():
+        service = IntakeService(db_path=tmp_path / "jobs.db", spool_dir=tmp_path)
+        service.store = JobStore(tmp_path / "jobs.db")
+        service.runner = FakeRunner(service.store)
+        server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            health = await _request(port, "GET", "/health")
+            first = await _request(port, "POST", "/jobs", {"email_path": str(email)})
+            again = await _request(port, "POST", "/jobs", {"email_path": str(email)})
+            missing = await _request(port, "GET", "/nope")
+            metrics = await _request(port, "GET", "/metrics", raw=True)
+            service.draining = True
+            draining = await _request(port, "POST", "/jobs", {"email_path": "x"})
+        service.store.close()
+        return (
+            health,
+            first,
+            again,
+            missing,
+            metrics,
+            draining,
+            service.runner.submitted,
+        )
+
+    health, first, again, missing, metrics, draining, submitted = asyncio.run(main())
+    assert health[0] == 200 and health[1]["status"] == "ok"
+    assert health[1]["queue_depth"] == {"extract": 0}
+    assert first[0] == 200 and first[1]["outbound_email_json"] == "out.json"
+    assert again[0] == 200 and again[1]["state"] == "done"
+    assert submitted == 1
+    assert missing[0] == 404
+    assert metrics[0] == 200 and "# TYPE intake_stage_seconds histogram" in metrics[1]
+    assert draining[0] == 503
+
+
+def test_bad_requests_get_json_errors(tmp_path):
+    """Malformed bodies and headers are 400s; unexpected failures are 500s."""
+
+    async def raw(port, data):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(data)
+        await writer.drain()
+        head, _, body = (await reader.read()).partition(b"\r\n\r\n")
+        writer.close()
+        return int(head.split()[1]), json.loads(body)
+
+    async def main():
+        service = IntakeService(db_path=tmp_path / "jobs.db", spool_dir=tmp_path)
+        service.store = JobStore(tmp_path / "jobs.db")
+        service.runner = FakeRunner(service.store)
+        server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            results = [
+                await _request(port, "POST", "/jobs", ["not", "an", "object"]),
+                await _request(port, "POST", "/jobs", {"email_path": 42}),
+                await _request(port, "POST", "/jobs", {"email": {"Message": "x"}}),
+                await raw(port, b"POST /jobs HTTP/1.1\r\nContent-Length: abc\r\n\r\n"),
+            ]
+            service.store.close()  # the store now fails every query
+            results.append(await _request(port, "GET", "/stats"))
+        return results
+
+    *bad, broken = asyncio.run(main())
+    assert [status for status, _ in bad] == [400, 400, 400, 400]
+    assert all("error" in payload for _, payload in bad)
+    assert broken[0] == 500 and "error" in broken[1]
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import os
+
+from invoice_intake_agent.utils.sinks import FileSink, JsonlSink, SinkWriter
+
+
+def test_file_sink_never_clobbers_a_different_notification(tmp_path):
+    """Same name, different payload gets a suffix; identical payload is reused."""
+    sink = FileSink(tmp_path)
+    first = sink.write("outbound_email_INV/001", {"amount": 1})
+    second = sink.write("outbound_email_INV/001", {"amount": 2})
+    again = sink.write("outbound_email_INV/001", {"amount": 1})
+
+    assert first["outbound_email_json"].endswith("outbound_email_INV_001.json")
+    assert second["outbound_email_json"].endswith("outbound_email_INV_001_2.json")
+    assert again == first
+    assert json.loads(open(second["outbound_email_json"]).read()) == {"amount": 2}
+    assert not [n for n in os.listdir(tmp_path) if n.endswith(".tmp")]
+
+
+def test_file_sink_compact(tmp_path):
+    result = FileSink(tmp_path, compact=True).write("x", {"a": [1, 2]})
+    assert open(result["outbound_email_json"]).read() == '{"a":[1,2]}'
+
+
+def test_jsonl_sink_appends_lines_with_offsets(tmp_path):
+    sink = JsonlSink(tmp_path / "out.jsonl", fsync_every=2)
+    results = sink.write_many([("a", {"n": 1}), ("b", {"n": 2})])
+    results.append(sink.write("c", {"n": 3}))
+    sink.close()
+
+    data = (tmp_path / "out.jsonl").read_bytes()
+    assert [json.loads(line) for line in data.splitlines()] == [
+        {"n": 1},
+        {"n": 2},
+        {"n": 3},
+    ]
+    for result, n in zip(results, (1, 2, 3)):
+        line = data[result["offset"] :].split(b"\n", 1)[0]
+        assert json.loads(line) == {"n": n}
+
+
+def test_jsonl_sink_finishes_short_writes(tmp_path, monkeypatch):
+    """A write that stops part-way through a batch is completed."""
+    write = os.write
+    monkeypatch.setattr(os, "write", lambda fd, data: write(fd, data[:5]))
+    sink = JsonlSink(tmp_path / "out.jsonl")
+    results = sink.write_many([("a", {"n": 1}), ("b", {"n": 22})])
+    sink.close()
+
+    data = (tmp_path / "out.jsonl").read_bytes()
+    assert data == b'{"n":1}\n{"n":22}\n'
+    assert [r["offset"] for r in results] == [0, 8]
+
+
+def test_sink_writer_batches_writes_off_the_event_loop(tmp_path):
+    sink = JsonlSink(tmp_path / "out.jsonl")
+    writer = SinkWriter(sink)
+
+    async def main():
+        results = await asyncio.gather(
+            *(writer.write(f"e{i}", {"i": i}) for i in range(50))
+        )
+        await writer.close()
+        return results
+
+    results = asyncio.run(main())
+    sink.close()
+    assert len({r["offset"] for r in results}) == 50
+    lines = (tmp_path / "out.jsonl").read_text().splitlines()
+    assert sorted(json.loads(line)["i"] for line in lines) == list(range(50))
@@ -0,0 +1,81 @@
+import asyncio
+
+from invoice_intake_agent.pipeline.stages import Pipeline, Stage
+
+
+def test_pipeline_runs_items_through_stages():
+    """Items pass through every stage; failures are reported, not forwarded."""
+    out, errors = [], []
+
+    async def double(x):
+        return x * 2
+
+    async def keep_multiples_of_four(x):
+        if x % 4:
+            raise ValueError(x)
+        return x
+
+    async def collect(x):
+        out.append(x)
+
+    async def on_error(stage, item, e):
+        errors.append((stage, item))
+
+    async def main():
+        pipeline = Pipeline(
+            [
+                Stage("double", double, workers=2),
+                Stage("filter", keep_multiples_of_four, workers=1, queue_size=1),
+                Stage("collect", collect),
+            ],
+            on_error=on_error,
+        )
+        async with pipeline:
+            for i in range(6):
+                await pipeline.submit(i)
+            await pipeline.drain()
+        return pipeline.stats()
+
+    stats = asyncio.run(main())
+    assert sorted(out) == [0, 4, 8]
+    assert sorted(item for _, item in errors) == [2, 6, 10]
+    assert [s.processed for s in stats] == [6, 3, 3]
+    assert stats[1].failed == 3
+    assert all(s.queue_depth == 0 for s in stats)
+
+
+def test_bounded_queue_applies_backpressure():
+    """A slow downstream stage limits how far the producer can run ahead."""
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def slow(x):
+            await gate.wait()
+
+        async def passthrough(x):
+            return x
+
+        async def on_error(stage, item, e):
+            raise AssertionError(e)
+
+        pipeline = Pipeline(
+            [
+                Stage("fast", passthrough, queue_size=1),
+                Stage("slow", slow, queue_size=1),
+            ],
+            on_error=on_error,
+        )
+        async with pipeline:
+            submitted = 0
+            for i in range(10):
+                try:
+                    await asyncio.wait_for(pipeline.submit(i), timeout=0.05)
+                except asyncio.TimeoutError:
+                    break
+                submitted += 1
+            assert submitted < 10
+            gate.set()
+            await pipeline.drain()
+
+    asyncio.run(main())
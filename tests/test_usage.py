@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from invoice_intake_agent.utils.ratelimit import IMAGE_TOKENS, estimate_input_tokens
+from invoice_intake_agent.utils.usage import AgentUsage, record_usage
+
+
+def _usage(input_tokens, cached, output_tokens=100):
+    return SimpleNamespace(
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        input_tokens_details=SimpleNamespace(cached_tokens=cached),
+    )
+
+
+def test_record_usage_tracks_cache_hits_and_latency(monkeypatch):
+    """Cached tokens and cached vs uncached latency are accumulated per agent."""
+    monkeypatch.setattr("invoice_intake_agent.utils.usage.USAGE", {})
+    record_usage("Invoice Specialist", _usage(2000, 0), 4.0)
+    stats = record_usage("Invoice Specialist", _usage(2000, 1536), 2.0)
+
+    assert isinstance(stats, AgentUsage)
+    assert stats.calls == 2 and stats.cached_calls == 1
+    assert stats.cache_hit_rate == 1536 / 4000
+    assert stats.mean_latency(True) == 2.0
+    assert stats.mean_latency(False) == 4.0
+
+
+def test_estimate_input_tokens_counts_images_not_base64():
+    """Image parts are charged a flat amount, not by data URL length."""
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "input_text", "text": "x" * 400},
+                {
+                    "type": "input_image",
+                    "image_url": "data:image/png;base64," + "A" * 10**6,
+                },
+            ],
+        }
+    ]
+    assert estimate_input_tokens(messages, output=0) == 100 + IMAGE_TOKENS
+    assert estimate_input_tokens("y" * 40, output=0) == 10
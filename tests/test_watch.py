@@ -0,0 +1,77 @@
+import asyncio
+import json
+import sys
+
+import pytest
+
+from invoice_intake_agent.pipeline.watch import (
+    InboxTracker,
+    InotifyWatcher,
+    PollingWatcher,
+)
+
+EMAIL = {
+    "Message": {
+        "Subject": "Invoice",
+        "Attachments": [{"Name": "Invoice.pdf", "ContentType": "application/pdf"}],
+    }
+}
+
+
+def test_tracker_waits_for_complete_and_stable_email(tmp_path):
+    """Partial JSON and missing attachments hold an email back until settled."""
+    tracker = InboxTracker(tmp_path, settle=1.0)
+    email = tmp_path / "Email.json"
+
+    email.write_text(json.dumps(EMAIL)[:20])
+    tracker.notice(["Email.json"])
+    assert tracker.ready(now=100.0) == []
+
+    email.write_text(json.dumps(EMAIL))
+    assert tracker.ready(now=101.0) == []  # attachment missing
+
+    (tmp_path / "Invoice.pdf").write_bytes(b"%PDF-1.4")
+    assert tracker.ready(now=102.0) == []  # just completed
+    assert tracker.next_check(now=102.0) == pytest.approx(1.0)
+    assert tracker.ready(now=103.0) == [email]
+
+    # Released emails are not kept: the job store knows them by content.
+    assert tracker.waiting == 0
+    tracker.notice(["Email.json"])
+    assert tracker.ready(now=110.0) == []
+    assert tracker.ready(now=111.0) == [email]
+
+
+def test_tracker_ignores_other_files(tmp_path):
+    tracker = InboxTracker(tmp_path, settle=0)
+    tracker.notice(["Invoice.pdf", ".Email.json.tmp", ".hidden.json"])
+    assert tracker.waiting == 0
+
+
+def test_polling_watcher_reports_new_and_modified_files(tmp_path):
+    (tmp_path / "old.json").write_text("{}")
+    watcher = PollingWatcher(tmp_path, interval=0.01)
+
+    async def scenario():
+        (tmp_path / "new.json").write_text("{}")
+        (tmp_path / "old.json").write_text('{"changed": true}')
+        return await watcher.changes(timeout=0.01)
+
+    assert asyncio.run(scenario()) == {"new.json", "old.json"}
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is Linux-only"
+)
+def test_inotify_watcher_reports_written_files(tmp_path):
+    watcher = InotifyWatcher(tmp_path)
+
+    async def scenario():
+        assert await watcher.changes(timeout=0.05) == set()
+        (tmp_path / "Email.json").write_text("{}")
+        return await watcher.changes(timeout=1.0)
+
+    try:
+        assert "Email.json" in asyncio.run(scenario())
+    finally:
+        watcher.close()